@@ -0,0 +1,136 @@
+import os
+import tempfile
+import zlib
+from typing import Callable, Iterable
+
+from django.core.files.storage import Storage
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+
+__all__ = [
+    "ENCODINGS",
+    "NotAcceptable",
+    "variant_name",
+    "compress_variants",
+    "negotiate",
+]
+
+
+class NotAcceptable(Exception):
+    """
+    The client refused the identity representation and every available
+    encoding.
+    """
+
+
+class _GzipCompressor:
+    def __init__(self) -> None:
+        # wbits=31 makes zlib emit a gzip container
+        self._zlib = zlib.compressobj(9, zlib.DEFLATED, 31)
+
+    def process(self, data: bytes) -> bytes:
+        return self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        return self._zlib.flush()
+
+
+def _brotli_compressor():
+    return brotli.Compressor(mode=brotli.MODE_TEXT, quality=11)
+
+
+# Ordered by preference when the client accepts several encodings equally.
+ENCODINGS: "dict[str, tuple[str, Callable]]" = {}
+if brotli is not None:
+    ENCODINGS["br"] = (".br", _brotli_compressor)
+ENCODINGS["gzip"] = (".gz", _GzipCompressor)
+
+
+def variant_name(name: str, encoding: str) -> str:
+    return name + ENCODINGS[encoding][0]
+
+
+def compress_variants(
+    storage: Storage, name: str, encodings: "Iterable[str] | None" = None
+) -> "list[str]":
+    """
+    Write the precompressed variants of a stored file next to it.
+
+    Only storages with local paths are supported, variants that are not
+    smaller than the original are discarded.
+    """
+    source_path = storage.path(name)
+    size = os.path.getsize(source_path)
+    created = []
+    for encoding in encodings or ENCODINGS:
+        if encoding not in ENCODINGS:
+            continue
+        path = storage.path(variant_name(name, encoding))
+        if os.path.exists(path):
+            created.append(encoding)
+            continue
+        compressor = ENCODINGS[encoding][1]()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as tmp, open(source_path, "rb") as src:
+                while chunk := src.read(64 * 2**10):
+                    tmp.write(compressor.process(chunk))
+                tmp.write(compressor.finish())
+            if os.path.getsize(tmp_path) < size:
+                os.replace(tmp_path, path)
+                created.append(encoding)
+            else:
+                os.unlink(tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return created
+
+
+def negotiate(
+    accept_encoding: "str | None", available: "Iterable[str]"
+) -> "str | None":
+    """
+    Pick the best of the available encodings for an Accept-Encoding header.
+
+    Returns None when the identity representation should be served, raises
+    NotAcceptable when it was refused with `identity;q=0` or `*;q=0` and
+    none of the available encodings is accepted either.
+    """
+    if not accept_encoding:
+        return None
+    weights: "dict[str, float]" = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+
+    # Identity is acceptable unless refused explicitly or by the wildcard.
+    identity_q = weights.get("identity", weights.get("*", 1.0))
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    if best is not None and best_q >= identity_q:
+        return best
+    if identity_q > 0:
+        return None
+    raise NotAcceptable(accept_encoding)
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.files.storage import storages
+from django.core.management.base import BaseCommand, CommandError
+
+from generic_storage.storage import TieredStorage
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the recently hot files of tiered storages to their first tier, "
+        "moving the coldest copies down to make room"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--storage",
+            action="append",
+            help="Only rebalance this storage alias, can be repeated",
+        )
+
+    def handle(self, *args, **kwargs):
+        aliases = kwargs["storage"] or [
+            alias
+            for alias, options in settings.STORAGES.items()
+            if options.get("BACKEND") == "generic_storage.storage.TieredStorage"
+        ]
+        for alias in aliases:
+            storage = storages[alias]
+            if not isinstance(storage, TieredStorage):
+                raise CommandError(f"{alias} is not a TieredStorage")
+            started = time.monotonic()
+            promoted = storage.rebalance()
+            self.stdout.write(
+                f"{alias}: promoted {promoted} files "
+                f"in {time.monotonic() - started:.1f}s"
+            )
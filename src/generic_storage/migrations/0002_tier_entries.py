@@ -0,0 +1,47 @@
+# Generated by Django 4.2.2 on 2026-10-19 05:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("generic_storage", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TierEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("store", models.CharField(max_length=255)),
+                ("name", models.CharField(max_length=1024)),
+                ("tier", models.CharField(max_length=255)),
+                ("size", models.BigIntegerField(default=0)),
+                ("hits", models.PositiveIntegerField(default=0)),
+                ("accessed", models.DateTimeField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["store", "tier", "accessed"],
+                        name="generic_storage_tier_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="tierentry",
+            constraint=models.UniqueConstraint(
+                fields=("store", "name"), name="generic_storage_tier_entry_uniq"
+            ),
+        ),
+    ]
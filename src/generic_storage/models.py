@@ -1,7 +1,7 @@
 import datetime
 import posixpath
 from typing import Any, Callable
-from django.db import models
+from django.db import models, transaction
 from django.core.files.storage import Storage
 from django.core.files.utils import validate_file_name
 
@@ -49,3 +49,96 @@ class GenericStorageFileField(models.FileField):
     
 
 __all__.append(GenericStorageFileField.__name__)
+
+
+class Blob(models.Model):
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def acquire(cls, digest: str, size: int) -> bool:
+        """
+        Add a reference to the blob, returns True if the blob was not known before.
+
+        The row stays locked until the surrounding transaction ends, callers
+        check or move the file before committing.
+        """
+        with transaction.atomic():
+            # Writing first takes the row lock, on SQLite the database write
+            # lock, before anything is read.
+            if cls.objects.filter(digest=digest).update(
+                refcount=models.F("refcount") + 1
+            ):
+                return False
+            blob, created = cls.objects.get_or_create(
+                digest=digest, defaults={"size": size, "refcount": 1}
+            )
+            if not created:
+                cls.objects.filter(digest=digest).update(
+                    refcount=models.F("refcount") + 1
+                )
+        return created
+
+    @classmethod
+    def release(cls, digest: str) -> int:
+        """
+        Drop a reference to the blob, returns the remaining references.
+
+        Like acquire() the row stays locked until the surrounding transaction
+        ends, a caller deleting the file at 0 does so before committing.
+        """
+        with transaction.atomic():
+            if not cls.objects.filter(digest=digest).update(
+                refcount=models.F("refcount") - 1
+            ):
+                return 0
+            remaining = (
+                cls.objects.filter(digest=digest)
+                .values_list("refcount", flat=True)
+                .get()
+            )
+            if remaining <= 0:
+                cls.objects.filter(digest=digest).delete()
+                return 0
+            return remaining
+
+    def __str__(self) -> str:
+        return self.digest
+
+
+__all__.append(Blob.__name__)
+
+
+class TierEntry(models.Model):
+    """
+    The fastest tier of a TieredStorage holding a copy of a file, and how
+    often the file was read recently.
+    """
+
+    store = models.CharField(max_length=255)
+    name = models.CharField(max_length=1024)
+    tier = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    accessed = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["store", "name"], name="generic_storage_tier_entry_uniq"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["store", "tier", "accessed"],
+                name="generic_storage_tier_idx",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.tier}:{self.name}"
+
+
+__all__.append(TierEntry.__name__)
@@ -0,0 +1,778 @@
+import hashlib
+import io
+import mimetypes
+import os
+import posixpath
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import IO, Any
+from urllib.parse import quote
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, Storage, storages
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+from .compression import ENCODINGS, variant_name
+from .models import Blob, TierEntry
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover - boto3 is optional
+    boto3 = None
+
+
+__all__ = []
+
+
+@deconstructible(path="generic_storage.storage.ContentAddressedStorage")
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Filesystem storage that names every file after the SHA-256 of its content.
+
+    Saving content that is already stored only adds a reference to the
+    existing blob, the file is removed once the last reference is deleted.
+    """
+
+    hash_algorithm = "sha256"
+    chunk_size = 64 * 2**10
+
+    def __init__(self, *args: Any, depth: int = 2, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.depth = depth
+
+    def name_for(self, digest: str) -> str:
+        parts = [digest[i * 2 : i * 2 + 2] for i in range(self.depth)]
+        return posixpath.join(*parts, digest)
+
+    def digest(self, name: str) -> str:
+        return posixpath.basename(name)
+
+    def reference(self, name: str) -> str:
+        """
+        Add a reference to an already stored blob without transferring it again.
+        """
+        size = self.size(name)
+        with transaction.atomic():
+            Blob.acquire(self.digest(name), size)
+            if not self.exists(name):
+                # Released and deleted in the meantime.
+                raise FileNotFoundError(name)
+        return name
+
+    def _store(self, path: str, digest: str, size: int) -> str:
+        """
+        Move a local file into the store unless the blob is stored already,
+        under the lock of the blob row so a concurrent delete() cannot
+        remove it in between.
+        """
+        name = self.name_for(digest)
+        full_path = self.path(name)
+        with transaction.atomic():
+            Blob.acquire(digest, size)
+            if os.path.exists(full_path):
+                os.unlink(path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                file_move_safe(path, full_path, allow_overwrite=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def ingest(self, path: str, digest: str, size: int) -> str:
+        """
+        Move a local file whose digest is already known into the store.
+        """
+        return self._store(path, digest, size)
+
+    def save(
+        self, name: str | None, content: IO[Any], max_length: int | None = None
+    ) -> str:
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+
+        tmp_dir = self.path(".tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        hasher = hashlib.new(self.hash_algorithm)
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in content.chunks(self.chunk_size):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+            return self._store(tmp_path, hasher.hexdigest(), size)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def get_available_name(self, name: str, max_length: int | None = None) -> str:
+        # Names are derived from content, an existing name is the same blob.
+        return name
+
+    def delete(self, name: str) -> None:
+        # The file goes before the blob row is unlocked, a concurrent save()
+        # then stores it again.
+        with transaction.atomic():
+            if Blob.release(self.digest(name)) <= 0:
+                super().delete(name)
+                for encoding in ENCODINGS:
+                    super().delete(variant_name(name, encoding))
+
+
+__all__.append(ContentAddressedStorage.__name__)
+
+
+@deconstructible(path="generic_storage.storage.TieredStorage")
+class TieredStorage(Storage):
+    """
+    Layers faster storages over a slower one holding every file, all
+    configured as STORAGES aliases and listed fastest first::
+
+        "blobs": {
+            "BACKEND": "generic_storage.storage.TieredStorage",
+            "OPTIONS": {
+                "tiers": [
+                    {"storage": "blobs-local", "capacity": 20 * 2**30},
+                    {"storage": "blobs-nfs", "capacity": 500 * 2**30},
+                    "blobs-store",
+                ],
+            },
+        },
+
+    Files are saved to and deleted from the last tier. Reads are served from
+    the fastest tier holding a copy and counted in memory, the counts are
+    written every `flush_interval` seconds. rebalance(), run by the
+    rebalance_tiers command, copies files read `promote_after` times within
+    `window` seconds to the first tier. A tier that would exceed its
+    `capacity` in bytes moves its coldest copies one tier down, the last
+    tier drops them. The other tiers keep copies under the hash of the name,
+    the content behind a name is expected to never change.
+    """
+
+    def __init__(
+        self,
+        tiers: "list[str | dict]",
+        promote_after: int = 2,
+        window: int = 3600,
+        flush_interval: float = 10.0,
+    ) -> None:
+        self.tiers = [
+            tier if isinstance(tier, dict) else {"storage": tier} for tier in tiers
+        ]
+        self.promote_after = promote_after
+        self.window = window
+        self.flush_interval = flush_interval
+        # Reads not written yet, name to count and time of the last one.
+        self._hits: "dict[str, tuple[int, datetime]]" = {}
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+
+    def __getattr__(self, name: str) -> Any:
+        # Store specific API such as ingest() and reference().
+        if name.startswith("_") or "tiers" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(storages[self.store], name)
+
+    @property
+    def store(self) -> str:
+        return self.tiers[-1]["storage"]
+
+    @property
+    def caches(self) -> "list[str]":
+        return [tier["storage"] for tier in self.tiers[:-1]]
+
+    def capacity(self, alias: str) -> "int | None":
+        for tier in self.tiers:
+            if tier["storage"] == alias:
+                return tier.get("capacity")
+        return None
+
+    def copy_name(self, name: str) -> str:
+        digest = hashlib.sha256(name.encode()).hexdigest()
+        return posixpath.join(digest[:2], digest)
+
+    def entry(self, name: str) -> "TierEntry | None":
+        entry = TierEntry.objects.filter(store=self.store, name=name).first()
+        if entry is not None and entry.tier not in self.caches:
+            entry.tier = self.store
+        return entry
+
+    def access(self, name: str) -> None:
+        """
+        Count a read of the file, written with the next flush().
+        """
+        now = timezone.now()
+        with self._lock:
+            hits, _ = self._hits.get(name, (0, now))
+            self._hits[name] = (hits + 1, now)
+            due = time.monotonic() - self._flushed >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Add the counted reads to the entries of the files, hits older than
+        `window` are forgotten.
+        """
+        with self._lock:
+            pending, self._hits = self._hits, {}
+            self._flushed = time.monotonic()
+        if not pending:
+            return
+        cutoff = timezone.now() - timedelta(seconds=self.window)
+        missing = []
+        with transaction.atomic():
+            for name, (hits, accessed) in pending.items():
+                updated = TierEntry.objects.filter(store=self.store, name=name).update(
+                    hits=Case(
+                        When(accessed__lt=cutoff, then=Value(hits)),
+                        default=F("hits") + hits,
+                        output_field=IntegerField(),
+                    ),
+                    accessed=accessed,
+                )
+                if not updated:
+                    missing.append(
+                        TierEntry(
+                            store=self.store,
+                            name=name,
+                            tier=self.store,
+                            hits=hits,
+                            accessed=accessed,
+                        )
+                    )
+            TierEntry.objects.bulk_create(missing, ignore_conflicts=True)
+
+    def _open_copy(self, entry: TierEntry, tier: str) -> File:
+        if tier == self.store:
+            return storages[tier].open(entry.name, "rb")
+        return storages[tier].open(self.copy_name(entry.name), "rb")
+
+    def _move(self, entry: TierEntry, tier: str, size: int | None = None) -> bool:
+        """
+        Record the new tier of a file unless another process moved it first,
+        then drop the copy it was read from before.
+        """
+        previous = entry.tier
+        size = entry.size if size is None else size
+        entries = TierEntry.objects.filter(pk=entry.pk)
+        if previous in self.caches:
+            entries = entries.filter(tier=previous)
+        else:
+            # Copies in tiers no longer configured count as in the store.
+            entries = entries.exclude(tier__in=self.caches)
+        if not entries.update(tier=tier, size=size):
+            return False
+        entry.tier, entry.size = tier, size
+        if previous != tier and previous in self.caches:
+            storages[previous].delete(self.copy_name(entry.name))
+        return True
+
+    def place(self, entry: TierEntry, tier: str) -> bool:
+        """
+        Move the copy of a file to a faster or slower tier, making room there.
+        Returns False if the file is larger than the tier or was moved by
+        another process meanwhile.
+        """
+        if tier == self.store:
+            return self._move(entry, tier)
+        if entry.tier == self.store:
+            size = int(storages[self.store].size(entry.name))
+        else:
+            size = entry.size
+        capacity = self.capacity(tier)
+        if capacity is not None and size > capacity:
+            return False
+        if not self.make_room(tier, size, self.heat(entry)):
+            return False
+        storage = storages[tier]
+        copy = self.copy_name(entry.name)
+        if not storage.exists(copy):
+            content = self._open_copy(entry, entry.tier)
+            try:
+                saved = storage.save(copy, content)
+            finally:
+                content.close()
+            if saved != copy:
+                # Copied concurrently by another process.
+                storage.delete(saved)
+        if self._move(entry, tier, size):
+            return True
+        if not TierEntry.objects.filter(pk=entry.pk, tier=tier).exists():
+            storage.delete(copy)
+        return False
+
+    def demote(self, entry: TierEntry) -> None:
+        index = self.caches.index(entry.tier)
+        for tier in self.caches[index + 1 :]:
+            if self.place(entry, tier):
+                return
+        self._move(entry, self.store)
+
+    def heat(self, entry: TierEntry) -> int:
+        """
+        Reads of the file within `window`.
+        """
+        if entry.accessed < timezone.now() - timedelta(seconds=self.window):
+            return 0
+        return entry.hits
+
+    def make_room(self, tier: str, size: int, heat: "int | None" = None) -> bool:
+        """
+        Demote the coldest copies until `size` more bytes fit in the tier.
+        Copies not read within `window` go first, then the least read ones,
+        copies read at least `heat` times are kept. Returns whether the bytes
+        fit.
+        """
+        capacity = self.capacity(tier)
+        if capacity is None:
+            return True
+        entries = TierEntry.objects.filter(store=self.store, tier=tier)
+        used = entries.aggregate(used=Sum("size"))["used"] or 0
+        cutoff = timezone.now() - timedelta(seconds=self.window)
+        coldest = entries.order_by(
+            Case(
+                When(accessed__lt=cutoff, then=Value(0)),
+                default=F("hits"),
+                output_field=IntegerField(),
+            ),
+            "accessed",
+        )
+        for entry in coldest.iterator():
+            if used + size <= capacity:
+                break
+            if heat is not None and self.heat(entry) >= heat:
+                break
+            self.demote(entry)
+            used -= entry.size
+        return used + size <= capacity
+
+    def open(self, name: str, mode: str = "rb") -> File:
+        if any(flag in mode for flag in "wax+"):
+            return storages[self.store].open(name, mode)
+        self.access(name)
+        entry = self.entry(name)
+        if entry is not None and entry.tier != self.store:
+            try:
+                return self._open_copy(entry, entry.tier)
+            except FileNotFoundError:
+                # Removed behind our back, the store still has the file.
+                self._move(entry, self.store)
+        return storages[self.store].open(name, mode)
+
+    def rebalance(self) -> int:
+        """
+        Copy the files read `promote_after` times within `window` seconds to
+        the first tier, hottest first. Returns the number of files promoted.
+        """
+        self.flush()
+        if not self.caches:
+            return 0
+        cutoff = timezone.now() - timedelta(seconds=self.window)
+        hot = (
+            TierEntry.objects.filter(
+                store=self.store, hits__gte=self.promote_after, accessed__gte=cutoff
+            )
+            .exclude(tier=self.caches[0])
+            .order_by("-hits", "-accessed")
+        )
+        promoted = 0
+        for entry in list(hot):
+            if entry.tier not in self.caches:
+                entry.tier = self.store
+            try:
+                promoted += self.place(entry, self.caches[0])
+            except FileNotFoundError:
+                # Deleted since, delete() drops the entry.
+                continue
+        return promoted
+
+    def path(self, name: str) -> str:
+        entry = self.entry(name)
+        if entry is not None and entry.tier != self.store:
+            storage = storages[entry.tier]
+            copy = self.copy_name(name)
+            try:
+                if storage.exists(copy):
+                    return storage.path(copy)
+            except NotImplementedError:
+                pass
+        return storages[self.store].path(name)
+
+    def exists(self, name: str) -> bool:
+        entry = self.entry(name)
+        if entry is not None and entry.tier != self.store:
+            return True
+        return storages[self.store].exists(name)
+
+    def size(self, name: str) -> int:
+        entry = self.entry(name)
+        if entry is not None and entry.tier != self.store:
+            return entry.size
+        return storages[self.store].size(name)
+
+    def save(
+        self, name: str | None, content: IO[Any], max_length: int | None = None
+    ) -> str:
+        return storages[self.store].save(name, content, max_length=max_length)
+
+    def delete(self, name: str) -> None:
+        store = storages[self.store]
+        store.delete(name)
+        if store.exists(name):
+            # Still referenced, see ContentAddressedStorage.
+            return
+        names = [name, *(variant_name(name, encoding) for encoding in ENCODINGS)]
+        with self._lock:
+            for variant in names:
+                self._hits.pop(variant, None)
+        for entry in TierEntry.objects.filter(store=self.store, name__in=names):
+            if entry.tier in self.caches:
+                storages[entry.tier].delete(self.copy_name(entry.name))
+            entry.delete()
+
+    def redirect_url(
+        self, name: str, filename: str, content_type: "str | None" = None
+    ) -> "str | None":
+        """
+        The redirect of the last tier for files without a copy in a faster
+        one. Counts as a read, so a file that turns hot gets promoted by the
+        next rebalance() and is served from its copy from then on.
+        """
+        redirect_url = getattr(storages[self.store], "redirect_url", None)
+        entry = self.entry(name)
+        if redirect_url is None or (entry is not None and entry.tier != self.store):
+            return None
+        url = redirect_url(name, filename, content_type)
+        if url is not None:
+            self.access(name)
+        return url
+
+    def generate_filename(self, filename: str) -> str:
+        return storages[self.store].generate_filename(filename)
+
+    def get_available_name(self, name: str, max_length: int | None = None) -> str:
+        return storages[self.store].get_available_name(name, max_length=max_length)
+
+    def listdir(self, path: str) -> "tuple[list[str], list[str]]":
+        return storages[self.store].listdir(path)
+
+    def url(self, name: str | None) -> str:
+        return storages[self.store].url(name)
+
+    def get_accessed_time(self, name: str) -> datetime:
+        return storages[self.store].get_accessed_time(name)
+
+    def get_created_time(self, name: str) -> datetime:
+        return storages[self.store].get_created_time(name)
+
+    def get_modified_time(self, name: str) -> datetime:
+        return storages[self.store].get_modified_time(name)
+
+
+__all__.append(TieredStorage.__name__)
+
+
+# S3 rejects multipart uploads with smaller parts, except for the last one.
+MIN_PART_SIZE = 5 * 2**20
+
+
+def _not_found(error: "ClientError") -> bool:
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey")
+
+
+class S3File(io.RawIOBase):
+    """
+    Read-only file over an S3 object, streamed from a ranged GET that is
+    reissued from the new position after a seek.
+    """
+
+    def __init__(self, storage: "S3Storage", name: str) -> None:
+        super().__init__()
+        self.storage = storage
+        self.name = name
+        self._position = 0
+        self._size: "int | None" = None
+        self._body = None
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._size = self.storage.size(self.name)
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        if offset != self._position:
+            self._close_body()
+            self._position = offset
+        return offset
+
+    def readinto(self, buffer) -> int:
+        if self._body is None:
+            if self._size is not None and self._position >= self._size:
+                return 0
+            try:
+                response = self.storage.client.get_object(
+                    Bucket=self.storage.bucket,
+                    Key=self.storage.key(self.name),
+                    Range=f"bytes={self._position}-",
+                )
+            except ClientError as error:
+                if error.response.get("Error", {}).get("Code") == "InvalidRange":
+                    return 0
+                if _not_found(error):
+                    raise FileNotFoundError(self.name) from error
+                raise
+            # "bytes <first>-<last>/<size>"
+            self._size = int(response["ContentRange"].rsplit("/", 1)[1])
+            self._body = response["Body"]
+        data = self._body.read(len(buffer))
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def _close_body(self) -> None:
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    def close(self) -> None:
+        self._close_body()
+        super().close()
+
+
+class S3StorageFile(File):
+    """
+    Buffered S3File, its size is taken from the first GET when known.
+    """
+
+    def __init__(self, raw: S3File, buffer_size: int) -> None:
+        super().__init__(io.BufferedReader(raw, buffer_size), raw.name)
+        self.raw = raw
+
+    @property
+    def size(self) -> int:
+        return self.raw.size
+
+
+@deconstructible(path="generic_storage.storage.S3Storage")
+class S3Storage(Storage):
+    """
+    Storage in a bucket of S3 or a compatible object store, requires boto3::
+
+        "objects": {
+            "BACKEND": "generic_storage.storage.S3Storage",
+            "OPTIONS": {
+                "bucket": "vscode-marketplace",
+                "endpoint_url": "https://minio.internal:9000",
+                "redirect": True,
+            },
+        },
+
+    Uploads are streamed in multipart writes of `part_size` bytes, so at
+    most one part is held in memory. Files open as S3File, reading through
+    ranged GETs on connections pooled up to `max_pool_connections`. With
+    `redirect` the asset views send clients to a presigned URL valid for
+    `expires` seconds instead of proxying the content.
+    """
+
+    chunk_size = 64 * 2**10
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: "str | None" = None,
+        region_name: "str | None" = None,
+        access_key: "str | None" = None,
+        secret_key: "str | None" = None,
+        addressing_style: str = "auto",
+        custom_domain: "str | None" = None,
+        part_size: int = 8 * 2**20,
+        max_pool_connections: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        expires: int = 300,
+        redirect: bool = False,
+    ) -> None:
+        if boto3 is None:
+            raise ImproperlyConfigured("S3Storage requires boto3 to be installed")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.custom_domain = custom_domain
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.expires = expires
+        self.redirect = redirect
+        self.client = boto3.session.Session().client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region_name,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=Config(
+                max_pool_connections=max_pool_connections,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                retries={"mode": "standard"},
+                s3={"addressing_style": addressing_style},
+            ),
+        )
+
+    def key(self, name: str) -> str:
+        return posixpath.join(self.prefix, name) if self.prefix else name
+
+    def _head(self, name: str) -> dict:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as error:
+            if _not_found(error):
+                raise FileNotFoundError(name) from error
+            raise
+
+    def _open(self, name: str, mode: str = "rb") -> File:
+        if mode not in ("r", "rb"):
+            raise ValueError(f"S3Storage only opens files for reading, not {mode!r}")
+        return S3StorageFile(S3File(self, name), self.chunk_size)
+
+    def _save(self, name: str, content: File) -> str:
+        key = self.key(name)
+        parameters = {
+            "Bucket": self.bucket,
+            "Key": key,
+            "ContentType": mimetypes.guess_type(name)[0] or "application/octet-stream",
+        }
+        upload = None
+        parts = []
+        buffer = bytearray()
+
+        def upload_part(data: bytes) -> None:
+            number = len(parts) + 1
+            response = self.client.upload_part(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload,
+                PartNumber=number,
+                Body=data,
+            )
+            parts.append({"PartNumber": number, "ETag": response["ETag"]})
+
+        try:
+            for chunk in content.chunks(self.chunk_size):
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                buffer += chunk
+                while len(buffer) >= self.part_size:
+                    if upload is None:
+                        upload = self.client.create_multipart_upload(**parameters)[
+                            "UploadId"
+                        ]
+                    upload_part(bytes(buffer[: self.part_size]))
+                    del buffer[: self.part_size]
+            if upload is None:
+                self.client.put_object(Body=bytes(buffer), **parameters)
+            else:
+                if buffer:
+                    upload_part(bytes(buffer))
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=key,
+                    UploadId=upload,
+                    MultipartUpload={"Parts": parts},
+                )
+        except BaseException:
+            if upload is not None:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=key, UploadId=upload
+                )
+            raise
+        return name
+
+    def delete(self, name: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def exists(self, name: str) -> bool:
+        try:
+            self._head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def size(self, name: str) -> int:
+        return self._head(name)["ContentLength"]
+
+    def get_modified_time(self, name: str) -> datetime:
+        return self._head(name)["LastModified"]
+
+    def listdir(self, path: str) -> "tuple[list[str], list[str]]":
+        prefix = self.key(path).strip("/")
+        prefix = f"{prefix}/" if prefix else ""
+        directories, files = [], []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=self.bucket, Prefix=prefix, Delimiter="/"
+        ):
+            for common in page.get("CommonPrefixes", ()):
+                directories.append(common["Prefix"][len(prefix) :].rstrip("/"))
+            for item in page.get("Contents", ()):
+                files.append(item["Key"][len(prefix) :])
+        return directories, files
+
+    def url(self, name: str | None, **parameters: str) -> str:
+        """
+        The public URL under `custom_domain`, otherwise a presigned one with
+        the given response header overrides such as ResponseContentType.
+        """
+        if self.custom_domain and not parameters:
+            return f"{self.custom_domain.rstrip('/')}/{quote(self.key(name))}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.key(name), **parameters},
+            ExpiresIn=self.expires,
+        )
+
+    def redirect_url(
+        self, name: str, filename: str, content_type: "str | None" = None
+    ) -> "str | None":
+        """
+        Where to send a client downloading the file instead of proxying it,
+        None unless `redirect` is set. Raises FileNotFoundError rather than
+        sign a URL to a missing object.
+        """
+        if not self.redirect:
+            return None
+        self._head(name)
+        parameters = {"ResponseContentDisposition": f"inline; filename={filename}"}
+        if content_type:
+            parameters["ResponseContentType"] = content_type
+        return self.url(name, **parameters)
+
+
+__all__.append(S3Storage.__name__)
@@ -1,3 +1,393 @@
-from django.test import TestCase
+import io
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import storages
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import storage
+from .compression import ENCODINGS, NotAcceptable, negotiate, variant_name
+from .models import Blob, TierEntry
+
+try:
+    from moto.server import ThreadedMotoServer
+except ImportError:  # pragma: no cover - moto is optional
+    ThreadedMotoServer = None
+
+
+class _Chunks(File):
+    """
+    Content that can only be read once and may fail after a number of bytes,
+    like an upload streamed from a request.
+    """
+
+    def __init__(self, size: int, fail_after: "int | None" = None) -> None:
+        super().__init__(None, "upload")
+        self.total = size
+        self.fail_after = fail_after
+        self.read_bytes = 0
+
+    def chunks(self, chunk_size=None):
+        chunk = os.urandom(chunk_size)
+        while self.read_bytes < self.total:
+            if self.fail_after is not None and self.read_bytes >= self.fail_after:
+                raise ConnectionError("Client went away")
+            data = chunk[: self.total - self.read_bytes]
+            self.read_bytes += len(data)
+            yield data
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.storage = storage.ContentAddressedStorage(location=self.tmp)
+
+    def refcount(self, name: str) -> int:
+        blob = Blob.objects.filter(digest=self.storage.digest(name)).first()
+        return blob.refcount if blob else 0
+
+    def test_identical_content_is_stored_once(self):
+        first = self.storage.save("a.json", ContentFile(b"{}"))
+        second = self.storage.save("b.json", ContentFile(b"{}"))
+        self.assertEqual(first, second)
+        self.assertEqual(first, self.storage.name_for(self.storage.digest(first)))
+        self.assertEqual(self.refcount(first), 2)
+        self.assertEqual(Blob.objects.get().size, 2)
+        self.assertEqual(os.listdir(self.storage.path(".tmp")), [])
+
+    def test_last_delete_removes_the_file_and_its_variants(self):
+        name = self.storage.save("README.md", ContentFile(b"# readme"))
+        self.storage.reference(name)
+        variant = variant_name(name, "gzip")
+        with open(self.storage.path(variant), "wb") as fh:
+            fh.write(b"gz")
+        self.storage.delete(name)
+        self.assertEqual(self.refcount(name), 1)
+        self.assertTrue(self.storage.exists(name))
+        self.storage.delete(name)
+        self.assertEqual(self.refcount(name), 0)
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(self.storage.exists(variant))
+
+    def test_saving_after_the_last_delete_restores_the_file(self):
+        name = self.storage.save("a.json", ContentFile(b"{}"))
+        self.storage.delete(name)
+        self.assertEqual(self.storage.save("a.json", ContentFile(b"{}")), name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.refcount(name), 1)
+
+    def test_ingest_moves_the_file(self):
+        path = os.path.join(self.tmp, "download")
+        with open(path, "wb") as fh:
+            fh.write(b"{}")
+        digest = self.storage.digest(self.storage.save("a.json", ContentFile(b"{}")))
+        name = self.storage.ingest(path, digest, 2)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.refcount(name), 2)
+
+    def test_reference_of_missing_blob(self):
+        with self.assertRaises(FileNotFoundError):
+            self.storage.reference(self.storage.name_for("0" * 64))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_reference_racing_the_last_delete(self):
+        name = self.storage.save("a.json", ContentFile(b"{}"))
+        size = storage.ContentAddressedStorage.size
+
+        def size_then_delete(name: str) -> int:
+            # The last reference goes after the size was read.
+            value = size(self.storage, name)
+            self.storage.delete(name)
+            return value
+
+        with mock.patch.object(self.storage, "size", side_effect=size_then_delete):
+            with self.assertRaises(FileNotFoundError):
+                self.storage.reference(name)
+        self.assertEqual(self.refcount(name), 0)
+
+    def test_failed_moves_do_not_count_a_reference(self):
+        with mock.patch.object(
+            storage, "file_move_safe", side_effect=OSError("disk full")
+        ):
+            with self.assertRaises(OSError):
+                self.storage.save("a.json", ContentFile(b"{}"))
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(os.listdir(self.storage.path(".tmp")), [])
+
+
+class TieredStorageTests(TestCase):
+    """
+    A fast and a slower cache tier, each holding two of the 100 byte test
+    files, over a filesystem store.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings = override_settings(
+            STORAGES={
+                **{
+                    alias: {
+                        "BACKEND": "django.core.files.storage.FileSystemStorage",
+                        "OPTIONS": {"location": os.path.join(self.tmp, alias)},
+                    }
+                    for alias in ("fast", "slow", "store")
+                },
+                "tiered": {
+                    "BACKEND": "generic_storage.storage.TieredStorage",
+                    "OPTIONS": {
+                        "tiers": [
+                            {"storage": "fast", "capacity": 250},
+                            {"storage": "slow", "capacity": 250},
+                            "store",
+                        ],
+                        "flush_interval": 3600,
+                    },
+                },
+            }
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.storage = storages["tiered"]
+
+    def save(self, name: str, reads: int = 0) -> str:
+        name = self.storage.save(name, ContentFile(name.encode().ljust(100, b".")))
+        self.read(name, reads)
+        return name
+
+    def read(self, name: str, times: int = 1) -> None:
+        for _ in range(times):
+            self.storage.open(name).close()
+
+    def tier(self, name: str) -> str:
+        return TierEntry.objects.get(name=name).tier
+
+    def copies(self, alias: str) -> int:
+        return sum(len(files) for _, _, files in os.walk(os.path.join(self.tmp, alias)))
+
+    def test_reads_are_counted_in_batches(self):
+        name = self.save("a.bin")
+        with self.assertNumQueries(3):
+            for _ in range(3):
+                with self.storage.open(name) as fh:
+                    self.assertEqual(fh.read(1), b"a")
+        self.storage.flush()
+        self.assertEqual(TierEntry.objects.get(name=name).hits, 3)
+        self.read(name)
+        self.storage.flush()
+        self.assertEqual(TierEntry.objects.get(name=name).hits, 4)
+
+    def test_reads_do_not_promote(self):
+        name = self.save("a.bin", reads=5)
+        self.storage.flush()
+        self.assertEqual(self.tier(name), "store")
+        self.assertEqual(os.listdir(self.tmp), ["store"])
+
+    def test_hot_files_are_promoted(self):
+        cold = self.save("cold.bin", reads=1)
+        hot = self.save("hot.bin", reads=2)
+        call_command("rebalance_tiers", stdout=io.StringIO())
+        self.assertEqual(self.tier(hot), "fast")
+        self.assertEqual(self.tier(cold), "store")
+        self.assertTrue(self.storage.path(hot).startswith(self.tmp + "/fast/"))
+        with self.storage.open(hot) as fh:
+            self.assertEqual(fh.read(3), b"hot")
+        self.assertEqual(self.storage.rebalance(), 0)
+
+    def test_full_tiers_demote_colder_copies(self):
+        names = [self.save(f"{index}.bin", reads=2 + index) for index in range(3)]
+        self.assertEqual(self.storage.rebalance(), 2)
+        # The coldest one does not push the hotter ones out.
+        self.assertEqual([self.tier(name) for name in names], ["store", "fast", "fast"])
+        self.read(names[0], 10)
+        self.assertEqual(self.storage.rebalance(), 1)
+        self.assertEqual([self.tier(name) for name in names], ["fast", "slow", "fast"])
+        self.assertEqual(self.copies("fast"), 2)
+
+    def test_concurrent_promotions(self):
+        name = self.save("a.bin", reads=2)
+        self.storage.flush()
+        # Both processes read the entry before either moved the file.
+        first = TierEntry.objects.get(name=name)
+        second = TierEntry.objects.get(name=name)
+        self.assertTrue(self.storage.place(first, "fast"))
+        self.assertFalse(self.storage.place(second, "slow"))
+        self.assertEqual(self.tier(name), "fast")
+        self.assertEqual(self.copies("slow"), 0)
+
+    def test_missing_copies_fall_back_to_the_store(self):
+        name = self.save("a.bin", reads=2)
+        self.storage.rebalance()
+        os.unlink(self.storage.path(name))
+        with self.storage.open(name) as fh:
+            self.assertEqual(fh.read(1), b"a")
+        self.assertEqual(self.tier(name), "store")
+
+    def test_delete_removes_copies_and_entries(self):
+        name = self.save("a.bin", reads=2)
+        self.storage.rebalance()
+        copy = self.storage.path(name)
+        self.storage.open(name).close()
+        self.storage.delete(name)
+        self.storage.flush()
+        self.assertFalse(os.path.exists(copy))
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(TierEntry.objects.exists())
+
+
+class NegotiateTests(SimpleTestCase):
+    def test_preferred_encoding(self):
+        self.assertIsNone(negotiate(None, ["gzip"]))
+        self.assertEqual(negotiate("gzip, deflate", ["gzip"]), "gzip")
+        self.assertEqual(negotiate("*", ["gzip"]), "gzip")
+        self.assertIsNone(negotiate("gzip;q=0", ["gzip"]))
+        self.assertIsNone(negotiate("gzip", []))
+
+    def test_identity_preferred(self):
+        self.assertIsNone(negotiate("gzip;q=0.5, identity", ["gzip"]))
+        self.assertIsNone(negotiate("*;q=0, identity", ["gzip"]))
+
+    def test_identity_refused(self):
+        self.assertEqual(negotiate("gzip, identity;q=0", ["gzip"]), "gzip")
+        self.assertEqual(negotiate("gzip;q=0.1, *;q=0", ["gzip"]), "gzip")
+        with self.assertRaises(NotAcceptable):
+            negotiate("identity;q=0", ["gzip"])
+        with self.assertRaises(NotAcceptable):
+            negotiate("*;q=0", [])
+        with self.assertRaises(NotAcceptable):
+            negotiate("gzip;q=0, identity;q=0", list(ENCODINGS))
+
+
+@unittest.skipIf(
+    storage.boto3 is None or ThreadedMotoServer is None, "requires boto3 and moto"
+)
+class S3StorageTests(SimpleTestCase):
+    """
+    S3Storage against a moto server on a free local port.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Keep the request log of the server out of the test output.
+        cls.werkzeug = logging.getLogger("werkzeug")
+        cls.level = cls.werkzeug.level
+        cls.werkzeug.setLevel(logging.ERROR)
+        cls.server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        cls.server.start()
+        host, port = cls.server.get_host_and_port()
+        cls.endpoint_url = f"http://{host}:{port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.werkzeug.setLevel(cls.level)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.storage = self.make_storage()
+        self.storage.client.create_bucket(Bucket=self.storage.bucket)
+
+    def make_storage(self, **kwargs) -> storage.S3Storage:
+        return storage.S3Storage(
+            **{
+                "bucket": f"test-{uuid.uuid4().hex}",
+                "prefix": "assets",
+                "endpoint_url": self.endpoint_url,
+                "region_name": "us-east-1",
+                "access_key": "test",
+                "secret_key": "test",
+                "addressing_style": "path",
+                "part_size": storage.MIN_PART_SIZE,
+                **kwargs,
+            }
+        )
+
+    def head(self, name: str) -> dict:
+        return self.storage.client.head_object(
+            Bucket=self.storage.bucket, Key=self.storage.key(name)
+        )
+
+    def test_small_files_are_put_at_once(self):
+        name = self.storage.save("pub/ext/package.json", ContentFile(b'{"a": 1}'))
+        self.assertEqual(name, "pub/ext/package.json")
+        head = self.head(name)
+        self.assertNotIn("-", head["ETag"])
+        self.assertEqual(head["ContentType"], "application/json")
+        with self.storage.open(name) as fh:
+            self.assertEqual(fh.read(), b'{"a": 1}')
+
+    def test_large_files_are_uploaded_in_parts(self):
+        content = _Chunks(2 * storage.MIN_PART_SIZE + 123)
+        name = self.storage.save("ext.vsix", content)
+        self.assertEqual(self.head(name)["ETag"].strip('"').rsplit("-", 1)[1], "3")
+        self.assertEqual(self.storage.size(name), content.total)
+
+    def test_failed_uploads_are_aborted(self):
+        content = _Chunks(3 * storage.MIN_PART_SIZE, fail_after=storage.MIN_PART_SIZE)
+        with self.assertRaises(ConnectionError):
+            self.storage.save("ext.vsix", content)
+        uploads = self.storage.client.list_multipart_uploads(Bucket=self.storage.bucket)
+        self.assertEqual(uploads.get("Uploads", []), [])
+        self.assertFalse(self.storage.exists("ext.vsix"))
+
+    def test_reads_are_ranged(self):
+        data = os.urandom(200 * 2**10)
+        name = self.storage.save("ext.vsix", ContentFile(data))
+        with self.storage.open(name) as fh:
+            fh.seek(150 * 2**10)
+            self.assertEqual(fh.read(10), data[150 * 2**10 : 150 * 2**10 + 10])
+            fh.seek(-5, os.SEEK_END)
+            self.assertEqual(fh.read(), data[-5:])
+            fh.seek(0)
+            self.assertEqual(b"".join(fh.chunks()), data)
+        with self.storage.open(self.storage.save("empty", ContentFile(b""))) as fh:
+            self.assertEqual(fh.read(), b"")
+
+    def test_sizes_come_from_the_first_read(self):
+        name = self.storage.save("ext.vsix", ContentFile(b"x" * 1000))
+        with self.storage.open(name) as fh:
+            fh.read(10)
+            with mock.patch.object(self.storage.client, "head_object") as head:
+                self.assertEqual(fh.size, 1000)
+            head.assert_not_called()
+
+    def test_missing_files(self):
+        self.assertFalse(self.storage.exists("missing"))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.size("missing")
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open("missing").read()
+
+    def test_listdir_and_delete(self):
+        for name in ("a/1.json", "a/b/2.json", "c.json"):
+            self.storage.save(name, ContentFile(b"{}"))
+        self.assertEqual(self.storage.listdir(""), (["a"], ["c.json"]))
+        self.assertEqual(self.storage.listdir("a"), (["b"], ["1.json"]))
+        self.storage.delete("a/1.json")
+        self.assertFalse(self.storage.exists("a/1.json"))
+        self.assertEqual(self.storage.listdir("a"), (["b"], []))
+
+    def test_redirects_are_presigned(self):
+        name = self.storage.save("README.md", ContentFile(b"# hello"))
+        self.assertIsNone(self.storage.redirect_url(name, "readme"))
+
+        redirecting = self.make_storage(bucket=self.storage.bucket, redirect=True)
+        url = redirecting.redirect_url(name, "pub_ext_v1", "text/markdown")
+        response = requests.get(url)
+        self.assertEqual(response.content, b"# hello")
+        with self.assertRaises(FileNotFoundError):
+            redirecting.redirect_url("missing", "missing")
+        self.assertEqual(
+            response.headers["Content-Disposition"], "inline; filename=pub_ext_v1"
+        )
+        self.assertEqual(response.headers["Content-Type"], "text/markdown")
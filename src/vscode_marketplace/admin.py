@@ -1,8 +1,67 @@
+import json
+
 from django.contrib import admin
+from django.utils.html import format_html
 
 
 from . import models
 
+
+@admin.register(models.SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+    list_display = [
+        "started",
+        "command",
+        "mode",
+        "status",
+        "duration",
+        "extensions",
+        "unchanged",
+        "requests",
+        "slowest_phase",
+    ]
+    list_filter = ["status", "command", "mode"]
+    readonly_fields = ["phases", "summary"]
+    exclude = ["stats"]
+
+    def has_add_permission(self, request) -> bool:
+        return False
+
+    def has_change_permission(self, request, obj=None) -> bool:
+        return False
+
+    @admin.display(description="HTTP requests")
+    def requests(self, obj: models.SyncRun):
+        return obj.stats.get("http", {}).get("requests")
+
+    @admin.display(description="Slowest phase")
+    def slowest_phase(self, obj: models.SyncRun):
+        phases = obj.stats.get("phases") or {}
+        if phases:
+            name = max(phases, key=lambda name: phases[name]["seconds"])
+            return f"{name} ({phases[name]['seconds']:.1f}s)"
+
+    @admin.display(description="Phases")
+    def phases(self, obj: models.SyncRun):
+        phases = sorted(
+            (obj.stats.get("phases") or {}).items(),
+            key=lambda item: -item[1]["seconds"],
+        )
+        return format_html(
+            "<pre>{}</pre>",
+            "\n".join(
+                f"{name:<40} {phase['seconds']:>10.3f}s {phase['calls']:>8} calls"
+                for name, phase in phases
+            ),
+        )
+
+    @admin.display(description="Summary")
+    def summary(self, obj: models.SyncRun):
+        return format_html("<pre>{}</pre>", json.dumps(obj.stats, indent=2))
+
+
 # Register your models here.
 for model in models.__all__:
-    admin.site.register(getattr(models, model))
+    model = getattr(models, model)
+    if not admin.site.is_registered(model):
+        admin.site.register(model)
@@ -34,7 +34,7 @@ class VersionSerializer(serializers.Serializer):
     version = serializers.CharField()
     lastUpdated = serializers.DateTimeField(source="last_updated")
     files = AssetSerializer(source="assets", many=True)
-    properties = PropertySerializer(many=True)
+    properties = PropertySerializer(source="property_list", many=True)
     targetPlatform = serializers.CharField(source="target_platform")
    # flags = serializers.CharField()
 
@@ -37,7 +37,8 @@ def criterium_query(criterium: GalleryCriterium) -> Q:
         return Q(categories__name=value)
     elif type is FilterType.ExtensionName:
         if "." in value:
-            return Q(uid=value)
+            publisher, name = value.split(".", 1)
+            return Q(publisher__name=publisher, name=name)
         else:
             return Q(name=value)
     elif type is FilterType.Target:
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class VscodeMarketplaceConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "vscode_marketplace"
+
+    def ready(self):
+        from .db import configure_sqlite
+
+        connection_created.connect(configure_sqlite)
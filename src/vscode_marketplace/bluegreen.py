@@ -0,0 +1,175 @@
+import glob
+import os
+import re
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from . import db, models
+
+_GENERATION = re.compile(r"\.\d{20}$")
+
+
+class ShadowError(Exception):
+    pass
+
+
+class ShadowDatabase:
+    """
+    A copy of a SQLite database to sync the catalog into while the live one
+    keeps serving, published at once when complete.
+
+    The copy is written next to the live file as `<name>.shadow` and opened
+    under its own connection alias. While active the catalog models are
+    routed to it, everything else, like sessions, users, blobs and sync
+    runs, keeps being read from and written to the live database. publish()
+    replaces the catalog tables of the live database with those of the copy
+    in a single transaction, readers see the previous catalog until it
+    commits. Changes to the live catalog made meanwhile are overwritten.
+    Stored files are counted in the live database, those the copy no longer
+    references are only deleted once it is published and those acquired for
+    it are released again when it is discarded.
+
+    The live database is saved as `<name>.<timestamp>` right before, the
+    last `keep` of these generations are kept for rolling back by hand,
+    older ones are deleted.
+    """
+
+    def __init__(self, alias: str = DEFAULT_DB_ALIAS, keep: int = 1) -> None:
+        connection = connections[alias]
+        if connection.vendor != "sqlite" or connection.is_in_memory_db():
+            raise ShadowError(f"Database {alias!r} is not a SQLite database file")
+        self.alias = alias
+        self.shadow = f"{alias}_shadow"
+        self.keep = keep
+        self.live = os.path.abspath(connection.settings_dict["NAME"])
+        self.path = f"{self.live}.shadow"
+        self.files = db.ShadowFiles()
+
+    def tables(self) -> "list[str]":
+        return [
+            model._meta.db_table
+            for model in apps.get_app_config(db.APP_LABEL).get_models(
+                include_auto_created=True
+            )
+            if db.is_catalog(model)
+        ]
+
+    def create(self) -> None:
+        """
+        Copy the committed state of the live database into the shadow file,
+        compacted with VACUUM INTO.
+        """
+        self.discard()
+        self.live_extensions = models.GalleryExtension.objects.using(self.alias).count()
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute("VACUUM INTO %s", [self.path])
+
+    @contextmanager
+    def active(self):
+        """
+        Route the catalog to the shadow file, in every thread.
+        """
+        connections.settings[self.shadow] = connections.configure_settings(
+            {
+                DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+                self.shadow: {**connections.settings[self.alias], "NAME": self.path},
+            }
+        )[self.shadow]
+        try:
+            with db.catalog(self.shadow, self.files):
+                yield
+        finally:
+            connections[self.shadow].close()
+            del connections[self.shadow]
+            del connections.settings[self.shadow]
+
+    def check(self, min_ratio: float = 0.5) -> None:
+        """
+        Refuse a shadow that is corrupt, breaks foreign keys or lost more
+        than `1 - min_ratio` of the live extensions. Runs while active.
+        """
+        with connections[self.shadow].cursor() as cursor:
+            cursor.execute("PRAGMA integrity_check")
+            problems = [row[0] for row in cursor.fetchall() if row[0] != "ok"]
+            if problems:
+                raise ShadowError(f"Integrity check failed: {'; '.join(problems[:5])}")
+            cursor.execute("PRAGMA foreign_key_check")
+            violations = cursor.fetchall()
+            if violations:
+                raise ShadowError(
+                    f"{len(violations)} foreign key violations, "
+                    f"first in {violations[0][0]}"
+                )
+        extensions = models.GalleryExtension.objects.count()
+        if extensions < self.live_extensions * min_ratio:
+            raise ShadowError(
+                f"The shadow has {extensions} extensions, "
+                f"the live database {self.live_extensions}"
+            )
+
+    def generation(self) -> str:
+        """
+        Save the live database as a new generation, returns its path.
+        """
+        path = f"{self.live}.{timezone.now():%Y%m%d%H%M%S%f}"
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute("VACUUM INTO %s", [path])
+        return path
+
+    def publish(self) -> None:
+        """
+        Save a generation of the live database and replace its catalog with
+        the one of the shadow, then refresh the planner statistics and drop
+        the shadow and old generations.
+        """
+        self.generation()
+        connection = connections[self.alias]
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute("ATTACH DATABASE %s AS shadow", [self.path])
+            try:
+                # Foreign keys of SQLite tables created by Django are
+                # deferred, they are checked once all tables were copied.
+                with transaction.atomic(using=self.alias):
+                    for table in self.tables():
+                        cursor.execute(f"PRAGMA main.table_info({quote(table)})")
+                        columns = ", ".join(quote(row[1]) for row in cursor.fetchall())
+                        cursor.execute(f"DELETE FROM main.{quote(table)}")
+                        cursor.execute(
+                            f"INSERT INTO main.{quote(table)} ({columns}) "
+                            f"SELECT {columns} FROM shadow.{quote(table)}"
+                        )
+            finally:
+                cursor.execute("DETACH DATABASE shadow")
+        self.files.publish()
+        db.analyze(connection)
+        self.discard()
+        self.cleanup()
+
+    def discard(self) -> None:
+        self.files.discard()
+        for path in (self.path, f"{self.path}-wal", f"{self.path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def generations(self) -> "list[str]":
+        return sorted(
+            path
+            for path in glob.glob(f"{glob.escape(self.live)}.*")
+            if _GENERATION.search(path)
+        )
+
+    def cleanup(self) -> None:
+        """
+        Delete all but the last `keep` generations.
+        """
+        # Databases swapped in by a symlink before stay where they are.
+        current = os.path.realpath(self.live)
+        previous = [path for path in self.generations() if path != current]
+        for path in previous[: max(len(previous) - self.keep, 0)]:
+            for name in (path, f"{path}-wal", f"{path}-shm"):
+                if os.path.exists(name):
+                    os.remove(name)
@@ -0,0 +1,116 @@
+import os
+
+from . import models
+from .typing.gallery import GalleryExtension
+
+BUNDLE_VERSION = 1
+CATALOG = "catalog.jsonl.gz"
+MANIFEST = "manifest.json"
+ASSETS = "assets"
+UPSTREAM_STORAGE = "vscode_marketplace"
+
+
+def asset_path(root: str, digest: str) -> str:
+    return os.path.join(root, ASSETS, digest[:2], digest[2:4], digest)
+
+
+def export_queryset():
+    return (
+        models.GalleryExtension.objects.get_queryset()
+        .order_by("id")
+        .select_related("publisher")
+        .prefetch_related(
+            "versions__assets",
+            "statistics",
+            # taggit's own prefetch does not match UUID primary keys, go
+            # through the item tables instead.
+            "galleryextensiontags_set__tag",
+            "galleryextensioncategories_set__tag",
+        )
+    )
+
+
+def _isoformat(value) -> "str | None":
+    return value.isoformat() if value else None
+
+
+def export_extension(ext: models.GalleryExtension) -> GalleryExtension:
+    """
+    Serialize a stored extension in the upstream extensionquery shape, local
+    copies of assets are referenced by digest.
+    """
+    pub = ext.publisher
+    versions = []
+    last_updated = None
+    for version in ext.versions.all():
+        files: "dict[str, dict]" = {}
+        asset_uri = ""
+        for asset in version.assets.all():
+            file = files.setdefault(
+                asset.type, {"assetType": asset.type, "source": asset.source}
+            )
+            if asset.storage == UPSTREAM_STORAGE:
+                file["source"] = asset.source
+                suffix = "/" + asset.type
+                if asset.file.name.endswith(suffix):
+                    asset_uri = asset.file.name[: -len(suffix)]
+            elif asset.digest and "digest" not in file:
+                file["digest"] = asset.digest
+                file["size"] = asset.size
+        versions.append(
+            {
+                "version": str(version.version),
+                "lastUpdated": _isoformat(version.last_updated),
+                "assetUri": asset_uri,
+                "fallbackAssetUri": asset_uri,
+                "files": list(files.values()),
+                "properties": version.property_list(),
+                "targetPlatform": version.target_platform,
+            }
+        )
+        if last_updated is None or version.last_updated > last_updated:
+            last_updated = version.last_updated
+    return {
+        "extensionId": str(ext.id),
+        "extensionName": ext.name,
+        "displayName": ext.display_name,
+        "shortDescription": ext.description,
+        "publisher": {
+            "publisherId": str(pub.id),
+            "publisherName": pub.name,
+            "displayName": pub.display_name,
+            "domain": pub.domain,
+            "isDomainVerified": pub.domain_verified,
+        },
+        "versions": versions,
+        "statistics": [
+            {"statisticName": stat.name, "value": stat.value}
+            for stat in ext.statistics.all()
+        ],
+        "tags": [item.tag.name for item in ext.galleryextensiontags_set.all()],
+        "categories": [
+            item.tag.name for item in ext.galleryextensioncategories_set.all()
+        ],
+        "releaseDate": _isoformat(ext.released),
+        "publishedDate": _isoformat(ext.published),
+        "lastUpdated": _isoformat(last_updated),
+        "flags": ext.flags,
+    }
+
+
+def local_assets(ext: models.GalleryExtension) -> "list[models.GalleryExtensionFile]":
+    """
+    Locally stored assets of an exported extension, one per digest.
+    """
+    seen = set()
+    assets = []
+    for version in ext.versions.all():
+        for asset in version.assets.all():
+            if (
+                asset.storage != UPSTREAM_STORAGE
+                and asset.digest
+                and asset.digest not in seen
+            ):
+                seen.add(asset.digest)
+                assets.append(asset)
+    return assets
@@ -0,0 +1,315 @@
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.files.storage import storages
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.utils import timezone
+
+from .models import SyncRun
+
+APP_LABEL = "vscode_marketplace"
+
+# Set for a few seconds on clients that wrote to the primary, their reads
+# stay there until the replicas caught up.
+PIN_COOKIE = "vscode_marketplace_pin"
+
+# Models of the app that are not part of the catalog a sync writes.
+NOT_CATALOG = ("syncrun",)
+
+_state: "ContextVar[dict | None]" = ContextVar("vscode_marketplace_db", default=None)
+_lag: "dict[str, tuple[float, float]]" = {}
+# Alias the catalog is read from and written to instead, in every thread.
+_catalog: "str | None" = None
+# Stored files referenced by catalog rows written to that alias meanwhile.
+_files: "ShadowFiles | None" = None
+
+
+def read_only(connection) -> bool:
+    return "mode=ro" in str(connection.settings_dict["NAME"])
+
+
+def configure_sqlite(sender, connection, **kwargs) -> None:
+    """
+    Apply the VSCODE_MARKETPLACE_SQLITE pragmas to every new SQLite
+    connection, read-only ones also refuse to write. The journal mode is a
+    property of the database file and only set by writable connections.
+    """
+    if connection.vendor != "sqlite":
+        return
+    readonly = read_only(connection)
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "VSCODE_MARKETPLACE_SQLITE", {}).items():
+            if readonly and name == "journal_mode":
+                continue
+            cursor.execute(f"PRAGMA {name} = {value}")
+        if readonly:
+            cursor.execute("PRAGMA query_only = ON")
+
+
+# Row counts the SQLite planner assumes for tables ANALYZE found empty. Left
+# to its defaults it costs every table alike and sorts all extensions for a
+# page by publisher instead of walking the few publishers in order.
+ESTIMATED_ROWS = {
+    "vscode_marketplace_galleryextensionpublisher": 10_000,
+    "vscode_marketplace_galleryextension": 100_000,
+}
+
+
+def analyze(connection) -> None:
+    """
+    Refresh the planner statistics. On SQLite tables without any, like all
+    of them in a new database, get the ESTIMATED_ROWS of a populated one.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+        if connection.vendor != "sqlite":
+            return
+        cursor.execute("SELECT DISTINCT tbl FROM sqlite_stat1")
+        analyzed = {row[0] for row in cursor.fetchall()}
+        for table, rows in ESTIMATED_ROWS.items():
+            if table not in analyzed:
+                cursor.execute(
+                    "INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (%s, NULL, %s)",
+                    [table, str(rows)],
+                )
+        # Makes this connection load the statistics, new ones read them anyway.
+        cursor.execute("ANALYZE sqlite_schema")
+
+
+def options() -> dict:
+    return {
+        "aliases": [],
+        "max_lag": 30.0,
+        "check_interval": 5.0,
+        "pin_seconds": 30,
+        **getattr(settings, "VSCODE_MARKETPLACE_REPLICAS", {}),
+    }
+
+
+def replicas() -> "list[str]":
+    return [alias for alias in options()["aliases"] if alias in settings.DATABASES]
+
+
+def replica_lag(alias: str) -> float:
+    """
+    Seconds the replica is behind the primary, infinite when it cannot be
+    queried. PostgreSQL standbys report their replay delay, other replicas
+    are compared on the last successful sync run.
+    """
+    try:
+        connection = connections[alias]
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+                    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) "
+                    "END"
+                )
+                return float(cursor.fetchone()[0] or 0)
+        finished = (
+            SyncRun.objects.filter(status=SyncRun.SUCCEEDED)
+            .order_by("-finished")
+            .values_list("finished", flat=True)
+        )
+        primary = finished.using(DEFAULT_DB_ALIAS).first()
+        if (
+            primary is None
+            or finished.using(alias).filter(finished__gte=primary).exists()
+        ):
+            return 0.0
+        return max((timezone.now() - primary).total_seconds(), 0.0)
+    except DatabaseError:
+        return math.inf
+
+
+def lag(alias: str) -> float:
+    """
+    replica_lag() checked at most every `check_interval` seconds.
+    """
+    now = time.monotonic()
+    checked = _lag.get(alias)
+    if checked is None or now - checked[0] >= options()["check_interval"]:
+        checked = _lag[alias] = (now, replica_lag(alias))
+    return checked[1]
+
+
+def is_catalog(model) -> bool:
+    return (
+        model._meta.app_label == APP_LABEL and model._meta.model_name not in NOT_CATALOG
+    )
+
+
+def catalog_alias() -> str:
+    """
+    Where the catalog models are written to, for transactions around them.
+    """
+    return _catalog or DEFAULT_DB_ALIAS
+
+
+class ShadowFiles:
+    """
+    Stored files catalog rows in a shadow copy started or stopped referencing.
+    Their blobs are counted in the live database, so releases wait until the
+    copy is published and files acquired for it are released again if it is
+    discarded.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.acquired: "list[tuple[str, str]]" = []
+        self.released: "list[tuple[str, str]]" = []
+
+    def acquire(self, alias: str, name: str) -> None:
+        with self._lock:
+            self.acquired.append((alias, name))
+
+    def release(self, files: "list[tuple[str, str]]") -> None:
+        with self._lock:
+            self.released.extend(files)
+
+    def publish(self) -> None:
+        with self._lock:
+            released, self.released, self.acquired = self.released, [], []
+        delete_files(released)
+
+    def discard(self) -> None:
+        with self._lock:
+            acquired, self.acquired, self.released = self.acquired, [], []
+        delete_files(acquired)
+
+
+def delete_files(files: "list[tuple[str, str]]") -> None:
+    for alias, name in files:
+        storages[alias].delete(name)
+
+
+def acquired(alias: str, name: str) -> None:
+    """
+    Note a stored file a catalog row was written for, given back if the
+    shadow copy the row went to is discarded.
+    """
+    if _files is not None:
+        _files.acquire(alias, name)
+
+
+def release_files(files: "list[tuple[str, str]]") -> None:
+    """
+    Delete stored files once the catalog transaction removing their rows
+    committed, or once the shadow copy it wrote to is published.
+    """
+    shadow = _files
+    transaction.on_commit(
+        lambda: shadow.release(files) if shadow else delete_files(files),
+        using=catalog_alias(),
+    )
+
+
+@contextmanager
+def catalog(alias: str, files: "ShadowFiles | None" = None):
+    """
+    Route the catalog models of every thread to another database alias, as
+    bluegreen does for a sync into a shadow copy, noting the stored files
+    its rows reference and release in `files`.
+    """
+    global _catalog, _files
+    previous = _catalog, _files
+    _catalog, _files = alias, files
+    try:
+        yield
+    finally:
+        _catalog, _files = previous
+
+
+@contextmanager
+def replica_reads(pinned: bool = False):
+    """
+    Let the vscode_marketplace reads in this context go to the replicas,
+    unless `pinned` to the primary. Yields a state recording whether
+    anything was written.
+    """
+    state = {"pinned": pinned, "wrote": False}
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Send the vscode_marketplace reads of gallery requests to a random replica
+    of VSCODE_MARKETPLACE_REPLICAS lagging at most `max_lag` seconds, and
+    everything else to the primary. Management commands and open primary
+    transactions always read from the primary. Within catalog() the catalog
+    models only use the alias given there.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != APP_LABEL or "instance" in hints:
+            return None
+        if _catalog and is_catalog(model):
+            return _catalog
+        state = _state.get()
+        if (
+            state is None
+            or state["pinned"]
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        max_lag = options()["max_lag"]
+        healthy = [alias for alias in replicas() if lag(alias) <= max_lag]
+        return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        if _catalog and is_catalog(model):
+            return _catalog
+        state = _state.get()
+        if state is not None:
+            state["wrote"] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *replicas()}
+        if _catalog:
+            pool.add(_catalog)
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Enables replica reads for a request. Staff sessions and clients that
+    wrote within `pin_seconds` read their own writes from the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = getattr(request, "user", None)
+        pinned = PIN_COOKIE in request.COOKIES or bool(user and user.is_staff)
+        with replica_reads(pinned) as state:
+            response = self.get_response(request)
+        if state["wrote"]:
+            response.set_cookie(
+                PIN_COOKIE,
+                "1",
+                max_age=options()["pin_seconds"],
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -0,0 +1,401 @@
+import datetime
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .typing import gallery
+
+# Asset urls of synthetic catalogs point here until served, the placeholder
+# is swapped for the address the server is listening on.
+PLACEHOLDER = "http://fake-upstream.invalid"
+API_PATH = "/_apis/public/gallery/extensionquery"
+
+_EPOCH = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+_TAGS = ["python", "javascript", "theme", "snippets", "linter", "debugger", "git"]
+_ASSETS = [
+    gallery.AssetType.Icon,
+    gallery.AssetType.Details,
+    gallery.AssetType.Changelog,
+    gallery.AssetType.Manifest,
+    gallery.AssetType.License,
+    gallery.AssetType.VSIX,
+]
+
+
+def _isoformat(value: datetime.datetime) -> str:
+    return value.isoformat().replace("+00:00", "Z")
+
+
+def synthetic_extension(
+    index: int, versions: int = 3, publishers: int = 100
+) -> gallery.GalleryExtension:
+    """
+    A deterministic extension in the extensionquery shape.
+    """
+    rnd = random.Random(index)
+    publisher = f"publisher{index % publishers}"
+    name = f"extension{index}"
+    released = _EPOCH + datetime.timedelta(hours=index)
+    _versions = []
+    for v in range(versions, 0, -1):
+        version = f"1.{v - 1}.{rnd.randrange(10)}"
+        asset_uri = f"{PLACEHOLDER}/assets/{publisher}/{name}/{version}"
+        _versions.append(
+            {
+                "version": version,
+                "lastUpdated": _isoformat(released + datetime.timedelta(days=v)),
+                "assetUri": asset_uri,
+                "fallbackAssetUri": asset_uri,
+                "files": [
+                    {"assetType": asset.value, "source": f"{asset_uri}/{asset.value}"}
+                    for asset in _ASSETS
+                ],
+                "properties": [
+                    {"key": "Microsoft.VisualStudio.Code.Engine", "value": "^1.60.0"},
+                    {
+                        "key": "Microsoft.VisualStudio.Code.ExtensionDependencies",
+                        "value": "",
+                    },
+                    {"key": "Microsoft.VisualStudio.Code.ExtensionPack", "value": ""},
+                ],
+            }
+        )
+    return {
+        "extensionId": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{publisher}.{name}")),
+        "extensionName": name,
+        "displayName": f"Extension {index}",
+        "shortDescription": f"Synthetic extension number {index}",
+        "publisher": {
+            "publisherId": str(uuid.uuid5(uuid.NAMESPACE_URL, publisher)),
+            "publisherName": publisher,
+            "displayName": publisher.title(),
+            "domain": None,
+            "isDomainVerified": False,
+        },
+        "versions": _versions,
+        "statistics": [
+            {"statisticName": "install", "value": rnd.randrange(10**6)},
+            {"statisticName": "averagerating", "value": rnd.randrange(50) / 10},
+            {"statisticName": "ratingcount", "value": rnd.randrange(1000)},
+        ],
+        "tags": rnd.sample(_TAGS, 2),
+        "categories": [rnd.choice(gallery.CATEGORIES)],
+        "releaseDate": _isoformat(released),
+        "publishedDate": _isoformat(released),
+        "lastUpdated": _versions[0]["lastUpdated"],
+        "flags": "validated, public",
+        "installationTargets": [
+            {"target": gallery.VSCODE_INSTALLATION_TARGET, "targetVersion": ""}
+        ],
+    }
+
+
+def synthetic_catalog(
+    count: int, versions: int = 3, publishers: int = 100
+) -> "list[gallery.GalleryExtension]":
+    return [synthetic_extension(i, versions, publishers) for i in range(count)]
+
+
+def load_catalog(path: str) -> "list[gallery.GalleryExtension]":
+    """
+    Load a recorded catalog, either an extensionquery response or a catalog
+    of one extension per line as written by export_gallery.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as fh:
+        if path.endswith((".jsonl", ".jsonl.gz")):
+            return [json.loads(line) for line in fh if line.strip()]
+        data = json.load(fh)
+    if isinstance(data, dict):
+        return [ext for result in data["results"] for ext in result["extensions"]]
+    return data
+
+
+def _matches(ext: gallery.GalleryExtension, type: int, value: str) -> bool:
+    if type == gallery.FilterType.ExtensionId:
+        return ext["extensionId"].lower() == value.lower()
+    if type == gallery.FilterType.Tag:
+        return value.lower() in (tag.lower() for tag in ext.get("tags") or [])
+    if type == gallery.FilterType.Category:
+        return value in (ext.get("categories") or [])
+    if type == gallery.FilterType.ExtensionName:
+        uid = f"{ext['publisher']['publisherName']}.{ext['extensionName']}"
+        return value.lower() in (uid.lower(), ext["extensionName"].lower())
+    if type == gallery.FilterType.SearchText:
+        value = value.lower()
+        return any(
+            value in (text or "").lower()
+            for text in (
+                ext["extensionName"],
+                ext["displayName"],
+                ext.get("shortDescription"),
+                ext["publisher"]["publisherName"],
+            )
+        )
+    return True
+
+
+_SORT_KEYS = {
+    gallery.SortBy.LastUpdatedDate: lambda ext: ext["lastUpdated"],
+    gallery.SortBy.PublishedDate: lambda ext: ext["publishedDate"],
+    gallery.SortBy.Title: lambda ext: ext["displayName"].lower(),
+    gallery.SortBy.PublisherName: lambda ext: ext["publisher"]["publisherName"],
+    gallery.SortBy.InstallCount: lambda ext: next(
+        (
+            stat["value"]
+            for stat in ext.get("statistics", [])
+            if stat["statisticName"] == "install"
+        ),
+        0,
+    ),
+}
+
+
+def _shape(ext: gallery.GalleryExtension, flags: gallery.GalleryFlags):
+    # Strip what the query flags did not ask for, like upstream does.
+    ext = dict(ext)
+    if gallery.GalleryFlags.IncludeStatistics not in flags:
+        ext["statistics"] = []
+    if gallery.GalleryFlags.IncludeCategoryAndTags not in flags:
+        ext["tags"] = ext["categories"] = None
+    if not flags & (
+        gallery.GalleryFlags.IncludeVersions | gallery.GalleryFlags.IncludeFiles
+    ):
+        ext["versions"] = []
+    else:
+        versions = ext["versions"]
+        if gallery.GalleryFlags.IncludeLatestVersionOnly in flags:
+            versions = versions[:1]
+        ext["versions"] = [
+            {
+                **version,
+                "files": (
+                    version["files"]
+                    if gallery.GalleryFlags.IncludeFiles in flags
+                    else []
+                ),
+                "properties": (
+                    version.get("properties", [])
+                    if gallery.GalleryFlags.IncludeVersionProperties in flags
+                    else []
+                ),
+            }
+            for version in versions
+        ]
+    return ext
+
+
+class FakeMarketplace(ThreadingHTTPServer):
+    """
+    Local stand-in for the upstream marketplace serving extensionquery and
+    assets from an in memory catalog.
+
+    Every request waits `latency` seconds plus up to `jitter`, a fraction
+    `error_rate` of them is answered with 429 or 503 instead and a fraction
+    `truncate_rate` of the extensionquery responses breaks off halfway. Page
+    sizes are capped at `max_page_size` and nothing is returned past
+    `max_pages`, the way the real service limits deep paging.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        catalog: "list[gallery.GalleryExtension]",
+        address: "tuple[str, int]" = ("127.0.0.1", 0),
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        truncate_rate: float = 0.0,
+        max_page_size: "int | None" = 1000,
+        max_pages: "int | None" = None,
+        asset_size: int = 4096,
+        seed: "int | None" = None,
+    ) -> None:
+        super().__init__(address, _Handler)
+        self.catalog = catalog
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.max_page_size = max_page_size
+        self.max_pages = max_pages
+        self.asset_size = asset_size
+        self.requests = self.errors = self.truncated = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread: "threading.Thread | None" = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """
+        Serve from a background thread, returns the base url.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def delay(self) -> "int | None":
+        """
+        Sleep for the configured latency, returns an error status to inject.
+        """
+        status = None
+        with self._lock:
+            self.requests += 1
+            wait = self.latency + self._random.uniform(0, self.jitter)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                status = self._random.choice((429, 503))
+        if wait:
+            time.sleep(wait)
+        return status
+
+    def truncate(self) -> bool:
+        """
+        Whether to cut off the response to an extensionquery halfway.
+        """
+        with self._lock:
+            if self.truncate_rate and self._random.random() < self.truncate_rate:
+                self.truncated += 1
+                return True
+        return False
+
+    def query(self, query: gallery.GalleryExtensionQuery) -> gallery.GalleryQueryResult:
+        flags = gallery.GalleryFlags(query.get("flags", 0))
+        results = []
+        for filter in query["filters"]:
+            # Criteria of the same type are alternatives, different types
+            # all have to match.
+            criteria: "dict[int, list[str]]" = {}
+            for criterium in filter.get("criteria", []):
+                type, value = criterium["filterType"], criterium.get("value", "")
+                if type != gallery.FilterType.SearchText or value:
+                    criteria.setdefault(type, []).append(value)
+            matched = [
+                ext
+                for ext in self.catalog
+                if all(
+                    any(_matches(ext, type, value) for value in values)
+                    for type, values in criteria.items()
+                )
+            ]
+            sort_key = _SORT_KEYS.get(filter.get("sortBy", 0))
+            if sort_key:
+                matched.sort(key=sort_key, reverse=filter.get("sortOrder", 0) != 1)
+            size = filter.get("pageSize", 50)
+            if self.max_page_size:
+                size = min(size, self.max_page_size)
+            page = filter.get("pageNumber", 1)
+            if self.max_pages and page > self.max_pages:
+                extensions = []
+            else:
+                extensions = matched[(page - 1) * size : page * size]
+            results.append(
+                {
+                    "extensions": [_shape(ext, flags) for ext in extensions],
+                    "resultMetadata": [
+                        {
+                            "metadataType": "ResultCount",
+                            "metadataItems": [
+                                {"name": "TotalCount", "count": len(matched)}
+                            ],
+                        }
+                    ],
+                }
+            )
+        return {"results": results}
+
+    def asset(self, path: str) -> bytes:
+        seed = hashlib.sha256(path.encode()).digest()
+        return (seed * (self.asset_size // len(seed) + 1))[: self.asset_size]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeMarketplace
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send(self, status: int, body: bytes = b"", headers: "dict | None" = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self) -> bool:
+        status = self.server.delay()
+        if status:
+            self._send(status, headers={"Retry-After": "0"})
+        return bool(status)
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.split("?")[0] != API_PATH:
+            return self._send(404)
+        if self._error():
+            return
+        try:
+            query = json.loads(body)
+        except ValueError:
+            return self._send(400)
+        data = json.dumps(self.server.query(query)).replace(
+            PLACEHOLDER, self.server.url
+        )
+        if self.server.truncate():
+            # Announce the whole body, send half and drop the connection.
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data.encode())))
+            self.end_headers()
+            self.wfile.write(data.encode()[: len(data) // 2])
+            self.close_connection = True
+            return
+        self._send(200, data.encode(), {"Content-Type": "application/json"})
+
+    def do_GET(self) -> None:
+        if not self.path.startswith("/assets/"):
+            return self._send(404)
+        if self._error():
+            return
+        data = self.server.asset(self.path)
+        etag = f'"{hashlib.sha256(data).hexdigest()[:16]}"'
+        # A Range whose If-Range no longer matches gets the whole new content.
+        if (
+            self.headers.get("Range", "").startswith("bytes=")
+            and self.headers.get("If-Range", etag) == etag
+        ):
+            start = int(self.headers["Range"][6:].split("-")[0] or 0)
+            if start >= len(data):
+                return self._send(
+                    416, headers={"Content-Range": f"bytes */{len(data)}", "ETag": etag}
+                )
+            return self._send(
+                206,
+                data[start:],
+                {
+                    "Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}",
+                    "ETag": etag,
+                },
+            )
+        self._send(
+            200, data, {"Content-Type": "application/octet-stream", "ETag": etag}
+        )
@@ -0,0 +1,155 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from typing import Callable
+
+from django.conf import settings
+
+try:
+    from PIL import Image, features
+except ImportError:  # pragma: no cover - Pillow is optional
+    Image = features = None
+
+
+SIZES = (64, 128)
+# Eviction trims the cache to this fraction of max_size, so it runs again
+# only after a good number of new derivatives.
+LOW_WATERMARK = 0.9
+_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+
+
+def _options() -> dict:
+    return {
+        "location": settings.BASE_DIR.parent / "dev/icons",
+        "max_size": 256 * 2**20,
+        "sizes": SIZES,
+        **getattr(settings, "VSCODE_MARKETPLACE_ICON_CACHE", {}),
+    }
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def pick_size(requested: int) -> int:
+    """
+    Snap a requested size to the smallest configured size that covers it.
+    """
+    sizes = sorted(_options()["sizes"])
+    for size in sizes:
+        if size >= requested:
+            return size
+    return sizes[-1]
+
+
+def pick_format(accept: "str | None") -> str:
+    if accept and "image/webp" in accept and Image and features.check("webp"):
+        return "webp"
+    return "png"
+
+
+def mimetype(format: str) -> str:
+    return _FORMATS[format][1]
+
+
+def cache_path(key: str, size: int, format: str) -> str:
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return os.path.join(
+        str(_options()["location"]), digest[:2], f"{digest}_{size}.{format}"
+    )
+
+
+def _resize(data: bytes, size: int, format: str) -> bytes:
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image.thumbnail((size, size), Image.LANCZOS)
+        out = io.BytesIO()
+        if format == "webp":
+            image.save(out, _FORMATS[format][0], quality=80, method=4)
+        else:
+            image.save(out, _FORMATS[format][0], optimize=True)
+        return out.getvalue()
+
+
+# Bytes used by each cache location, measured by the first write of the
+# process and kept up to date by later ones. Other processes sharing the
+# location are only accounted for by the next eviction.
+_usage: "dict[str, int]" = {}
+_usage_lock = threading.Lock()
+
+
+def _scan(location: str) -> "list[tuple[float, int, str]]":
+    entries = []
+    for root, _dirs, files in os.walk(location):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def _evict(location: str, max_size: int) -> int:
+    """
+    Delete the least recently used derivatives down to the low watermark,
+    returns the bytes left.
+    """
+    entries = _scan(location)
+    total = sum(size for _, size, _ in entries)
+    if total <= max_size:
+        return total
+    # Least recently used first, hits refresh the mtime.
+    for _mtime, size, path in sorted(entries):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        if total <= max_size * LOW_WATERMARK:
+            break
+    return total
+
+
+def _added(location: str, size: int, max_size: int) -> None:
+    with _usage_lock:
+        if location not in _usage:
+            _usage[location] = sum(size for _, size, _ in _scan(location))
+        else:
+            _usage[location] += size
+        if _usage[location] > max_size:
+            _usage[location] = _evict(location, max_size)
+
+
+def derivative(key: str, size: int, format: str, load: Callable[[], bytes]) -> str:
+    """
+    Return the path of a cached resized icon, generating it on first use.
+
+    `load` is only called on a cache miss and must return the original image.
+    `key` must change with the content of the original.
+    """
+    path = cache_path(key, size, format)
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    data = _resize(load(), size, format)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as tmp:
+        tmp.write(data)
+    os.replace(tmp_path, path)
+
+    options = _options()
+    _added(str(options["location"]), len(data), options["max_size"])
+    return path
@@ -0,0 +1,207 @@
+import io
+import itertools
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from vscode_marketplace import fake_upstream
+from vscode_marketplace.management.commands import clone_vscode_marketplace
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark clone_vscode_marketplace against a local stand-in upstream "
+        "in a throwaway database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--catalog",
+            type=str,
+            help="Recorded extensionquery response or export_gallery catalog "
+            "to serve instead of a synthetic one",
+        )
+        parser.add_argument(
+            "--extensions",
+            type=int,
+            default=2000,
+            help="Size of the synthetic catalog",
+        )
+        parser.add_argument(
+            "--versions",
+            type=int,
+            default=3,
+            help="Versions per synthetic extension",
+        )
+        parser.add_argument(
+            "--batch-sizes",
+            type=int,
+            nargs="+",
+            default=[50, 200, 500],
+            help="Batch sizes to compare",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            nargs="+",
+            default=[1, 4],
+            help="Fetch concurrency settings to compare",
+        )
+        parser.add_argument(
+            "--mode",
+            choices=["catalog", "categories"],
+            default="catalog",
+        )
+        parser.add_argument("--page-size", type=int, default=1000)
+        parser.add_argument(
+            "--latency", type=float, default=0.0, help="Seconds added to every request"
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of requests answered with 429 or 503",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=1,
+            help="Timed runs per setting, the fastest one is reported",
+        )
+        parser.add_argument(
+            "--no-memory",
+            action="store_true",
+            help="Skip the extra traced run measuring peak memory",
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Print the results as JSON"
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["catalog"]:
+            catalog = fake_upstream.load_catalog(kwargs["catalog"])
+        else:
+            catalog = fake_upstream.synthetic_catalog(
+                kwargs["extensions"], kwargs["versions"]
+            )
+        server = fake_upstream.FakeMarketplace(
+            catalog,
+            latency=kwargs["latency"],
+            error_rate=kwargs["error_rate"],
+            seed=0,
+        )
+        self.host = server.start()
+        self.extensions = len(catalog)
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        if (
+            connection.vendor == "sqlite"
+            and not connection.settings_dict["TEST"]["NAME"]
+        ):
+            # Writes to an in memory database would not be representative.
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(
+                tempfile.mkdtemp(), "benchmark.sqlite3"
+            )
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        results = []
+        try:
+            for batch_size, workers in itertools.product(
+                kwargs["batch_sizes"], kwargs["concurrency"]
+            ):
+                result = self.benchmark(batch_size, workers, **kwargs)
+                results.append(result)
+                if not kwargs["json"]:
+                    self.report(result, header=len(results) == 1)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            server.stop()
+
+        if kwargs["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def clone(self, batch_size: int, workers: int, **kwargs):
+        command = clone_vscode_marketplace.Command()
+        started = time.perf_counter()
+        call_command(
+            command,
+            host=self.host,
+            mode=kwargs["mode"],
+            page_size=kwargs["page_size"],
+            batch_size=batch_size,
+            concurrency=workers,
+            restart=True,
+            stdout=io.StringIO(),
+        )
+        return time.perf_counter() - started, command.write_times
+
+    def benchmark(self, batch_size: int, workers: int, **kwargs) -> dict:
+        best = None
+        for _ in range(max(kwargs["repeat"], 1)):
+            call_command("flush", interactive=False, verbosity=0)
+            elapsed, write_times = self.clone(batch_size, workers, **kwargs)
+            if best is None or elapsed < best[0]:
+                best = (elapsed, write_times)
+        elapsed, write_times = best
+        # A second pass over an unchanged catalog measures the re-sync path.
+        resync, _ = self.clone(batch_size, workers, **kwargs)
+
+        peak = None
+        if not kwargs["no_memory"]:
+            call_command("flush", interactive=False, verbosity=0)
+            tracemalloc.start()
+            try:
+                self.clone(batch_size, workers, **kwargs)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        return {
+            "batch_size": batch_size,
+            "concurrency": workers,
+            "extensions": self.extensions,
+            "seconds": elapsed,
+            "extensions_per_second": self.extensions / elapsed,
+            "resync_seconds": resync,
+            "batches": len(write_times),
+            "write_ms_mean": (
+                statistics.fmean(write_times) * 1000 if write_times else None
+            ),
+            "write_ms_p95": (
+                _percentile(write_times, 0.95) * 1000 if write_times else None
+            ),
+            "peak_memory_mib": peak / 2**20 if peak is not None else None,
+        }
+
+    def report(self, result: dict, header: bool = False):
+        columns = [
+            ("batch_size", "batch", "{}"),
+            ("concurrency", "conc", "{}"),
+            ("seconds", "seconds", "{:.2f}"),
+            ("extensions_per_second", "ext/s", "{:.1f}"),
+            ("resync_seconds", "resync s", "{:.2f}"),
+            ("write_ms_mean", "write ms", "{:.1f}"),
+            ("write_ms_p95", "p95 ms", "{:.1f}"),
+            ("peak_memory_mib", "peak MiB", "{:.1f}"),
+        ]
+        if header:
+            self.stdout.write(" ".join(f"{title:>9}" for _, title, _ in columns))
+        self.stdout.write(
+            " ".join(
+                f"{(fmt.format(result[key]) if result[key] is not None else '-'):>9}"
+                for key, _, fmt in columns
+            )
+        )
+
+
+def _percentile(values: "list[float]", fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
@@ -1,87 +1,32 @@
-from typing import cast
-from django.core.management.base import BaseCommand
-import semver
+from concurrent import futures
+from datetime import datetime, timedelta
+import json
+import math
+import time
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from vscode_marketplace import models, query
+from vscode_marketplace import models
+from vscode_marketplace.api import utils as query
+from vscode_marketplace.bluegreen import ShadowDatabase, ShadowError
+from vscode_marketplace.mirror import AssetMirror, pending_assets
+from vscode_marketplace.mirror_spec import MirrorSpec, dependencies, uid
+from vscode_marketplace.records import GalleryRecords, batched
+from vscode_marketplace.retention import RetentionPolicy
+from vscode_marketplace.stats import SyncStats
 from vscode_marketplace.typing import gallery
-import requests
-
-import itertools
-
-
-def batched(it, size):
-    it = iter(it)
-    return iter(lambda: tuple(itertools.islice(it, size)), ())
-
-
-class GalleryRecords:
-    extensions: list[models.GalleryExtension]
-    publishers: list[models.GalleryExtensionPublisher]
-    versions: list[models.GalleryExtensionVersion]
-    properties: list[models.GalleryExtensionProperty]
-    assets: list[models.GalleryExtensionFile]
-    statistics: list[models.GalleryExtensionStatistic]
-
-    def __init__(self) -> None:
-        self.extensions = []
-        self.publishers = []
-        self.versions = []
-        self.properties = []
-        self.assets = []
-        self.statistics = []
-
-    def update(self):
-        models.GalleryExtensionPublisher.objects.bulk_create(
-            self.publishers,
-            update_fields=["name", "display_name", "domain", "domain_verified"],
-            unique_fields=["id"],
-            update_conflicts=True,
-        )
-        models.GalleryExtension.objects.bulk_create(
-            self.extensions,
-            update_fields=[
-                "name",
-                "display_name",
-                "publisher_id",
-                "description",
-                "released",
-                "published",
-                "flags",
-            ],
-            update_conflicts=True,
-            unique_fields=["id"],
-        )
-        models.GalleryExtensionStatistic.objects.bulk_create(
-            self.statistics,
-            update_conflicts=True,
-            unique_fields=["extension_id", "name"],
-            update_fields=["value"],
-        )
-        for ext in self.extensions:
-            ext.categories.set(ext._categories)
-            ext.tags.set(ext._tags)
-        models.GalleryExtensionVersion.objects.bulk_create(
-            self.versions,
-            update_conflicts=True,
-            unique_fields=["version", "extension_id"],
-            update_fields=["last_updated", "target_platform"],
-        )
-        models.GalleryExtensionProperty.objects.bulk_create(
-            self.properties,
-            update_conflicts=True,
-            unique_fields=["extension_version_id", "key"],
-            update_fields=["value"],
-        )
-        models.GalleryExtensionFile.objects.bulk_create(
-            self.assets,
-            update_conflicts=True,
-            unique_fields=["extension_version_id", "type", "storage"],
-            update_fields=["source"],
-        )
+from vscode_marketplace.upstream import GalleryClient, IncompleteResponse
+
+# Incremental runs walk back this far past the watermark, catching updates
+# published in the same second as the previous run's newest one or indexed
+# late upstream. Extensions that did not change are skipped by date.
+WATERMARK_OVERLAP = timedelta(minutes=5)
 
 
 class Command(BaseCommand):
-    help = "Displays current time"
+    help = "Clone extensions from an upstream VS Code marketplace"
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -94,104 +39,588 @@ class Command(BaseCommand):
         parser.add_argument(
             "--endpoint", type=str, help="", default="/_apis", required=False
         )
+        parser.add_argument(
+            "--mode",
+            choices=["search", "catalog", "categories", "incremental", "spec"],
+            default="search",
+            help="search: mirror the results of --search, "
+            "catalog: page through the whole upstream catalog, "
+            "categories: page through every category to stay under upstream result caps, "
+            "incremental: only fetch extensions updated since the last successful run, "
+            "spec: mirror what --spec selects plus its dependencies",
+        )
+        parser.add_argument(
+            "--spec",
+            type=str,
+            help="JSON mirror spec for --mode spec, defaults to VSCODE_MARKETPLACE_MIRROR_SPEC",
+        )
+        parser.add_argument(
+            "--search", type=str, default="python", help="Search text for --mode search"
+        )
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=100,
+            help="Extensions listed per upstream page",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the stored checkpoint and crawl from the first page",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Extensions requested per upstream query",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Upstream requests in flight at the same time",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=None,
+            help="Maximum upstream requests per second",
+        )
+        parser.add_argument(
+            "--retries",
+            type=int,
+            default=5,
+            help="Retries with exponential backoff for failed upstream requests",
+        )
+
+        parser.add_argument(
+            "--mirror-assets",
+            nargs="*",
+            choices=[type.name for type in gallery.AssetType],
+            default=[],
+            help="Download these asset types into --mirror-storage after syncing",
+        )
+        parser.add_argument(
+            "--mirror-storage",
+            type=str,
+            default="blobs",
+            help="Storage alias mirrored assets are stored in",
+        )
+        parser.add_argument(
+            "--mirror-workers",
+            type=int,
+            default=8,
+            help="Parallel asset downloads",
+        )
+        parser.add_argument(
+            "--keep-stable",
+            type=int,
+            help="Stable versions kept per platform, overrides VSCODE_MARKETPLACE_RETENTION",
+        )
+        parser.add_argument(
+            "--keep-prerelease",
+            type=int,
+            help="Pre-release versions kept per platform",
+        )
+        parser.add_argument(
+            "--keep-days",
+            type=float,
+            help="Also keep versions updated within this many days",
+        )
+        parser.add_argument(
+            "--blue-green",
+            action="store_true",
+            help="Sync the catalog into a copy of the SQLite database and "
+            "publish it when complete, readers keep the previous catalog until then",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Print the run summary with per-phase timings as JSON, "
+            "progress goes to stderr",
+        )
+
+    def fetch_batch(
+        self,
+        client: GalleryClient,
+        group: "tuple[str, ...]",
+        filter_type: gallery.FilterType = gallery.FilterType.ExtensionId,
+    ):
+        """
+        Fetch the extensions of a batch, starting over from an empty batch
+        when the response breaks off while it is being read.
+        """
+        _query = query.simple_query(
+            [
+                {
+                    "filterType": filter_type,
+                    "value": uuid,
+                }
+                for uuid in group
+            ],
+            pageSize=len(group),
+        )
+        for attempt in range(client.retries + 1):
+            update = GalleryRecords(self.stats, self.retention)
+            try:
+                for ext in client.extensions(_query):
+                    update.add_extension(ext)
+                return update
+            except IncompleteResponse:
+                if attempt >= client.retries:
+                    raise
+                self.stats.count("batches_retried")
+                client.pause(attempt)
+        raise AssertionError("unreachable")
 
     def handle(self, *args, **kwargs):
+        self.verbosity = kwargs["verbosity"]
+        output = self.stdout
+        if kwargs["json"]:
+            # Keep stdout for the summary only.
+            self.stdout = self.stderr
+        self.stats = SyncStats()
+        self.retention = RetentionPolicy.from_settings(
+            stable=kwargs["keep_stable"],
+            prerelease=kwargs["keep_prerelease"],
+            days=kwargs["keep_days"],
+        )
+        self.unchanged = 0
+        self.write_times: "list[float]" = []
+        try:
+            shadow = ShadowDatabase() if kwargs["blue_green"] else None
+        except ShadowError as e:
+            raise CommandError(f"--blue-green: {e}")
+        run = models.SyncRun.objects.create(
+            command="clone_vscode_marketplace", mode=kwargs["mode"]
+        )
+        try:
+            if shadow:
+                run.extensions = self.blue_green(shadow, **kwargs)
+            else:
+                run.extensions = self.clone(**kwargs)
+            run.status = models.SyncRun.SUCCEEDED
+        except BaseException as e:
+            run.status = models.SyncRun.FAILED
+            run.error = repr(e)
+            raise
+        finally:
+            run.unchanged = self.unchanged
+            run.stats = self.stats.as_dict()
+            run.finished = timezone.now()
+            run.save()
+            self.run = run
+        if kwargs["json"]:
+            output.write(json.dumps(self.summary(run), indent=2))
+
+    def clone(self, **kwargs) -> int:
+        written = self.sync(**kwargs)
+        if kwargs["mirror_assets"]:
+            with self.stats.phase("mirror"):
+                self.mirror_assets(**kwargs)
+        return written
+
+    def blue_green(self, shadow: ShadowDatabase, **kwargs) -> int:
+        """
+        Clone the catalog into a shadow copy of the database and publish it
+        once it passed its checks. The run record stays in the live database.
+        """
+        with self.stats.phase("shadow:copy"):
+            shadow.create()
+        try:
+            with shadow.active():
+                written = self.clone(**kwargs)
+                with self.stats.phase("shadow:check"):
+                    shadow.check()
+        except ShadowError as e:
+            shadow.discard()
+            raise CommandError(f"Not publishing {shadow.path}: {e}")
+        except BaseException:
+            shadow.discard()
+            raise
+        with self.stats.phase("shadow:publish"):
+            try:
+                shadow.publish()
+            except BaseException:
+                shadow.discard()
+                raise
+        self.stdout.write(f"Published the catalog of {shadow.path}")
+        return written
+
+    def summary(self, run: models.SyncRun) -> dict:
+        return {
+            "id": run.pk,
+            "command": run.command,
+            "mode": run.mode,
+            "status": run.status,
+            "started": run.started.isoformat(),
+            "finished": run.finished.isoformat() if run.finished else None,
+            "duration": run.duration,
+            "extensions": run.extensions,
+            "unchanged": run.unchanged,
+            **run.stats,
+        }
+
+    def sync(self, **kwargs) -> int:
         api_url = f"{kwargs['host']}/{kwargs['endpoint'].strip('/')}/public/gallery/extensionquery"
-        _query = query.simple_query(
-            "python", pageSize=100, flags=query.EXTENSION_MINIMUM_FLAG
-        )
-        result = cast(
-            gallery.GalleryQueryResult,
-            requests.post(
-                api_url,
-                json=_query,
-                headers={"accept": "application/json;api-version=1.0"},
-            ).json(),
-        )
-        publisher_ids = set()
-        extension_ids = set()
-        for ext in result["results"][0]["extensions"]:
-            extension_ids.add(ext["extensionId"])
-
-        for group in batched(extension_ids, 50):
-            update = GalleryRecords()
-            for ext in cast(
-                gallery.GalleryQueryResult,
-                requests.post(
-                    api_url,
-                    headers={"accept": "application/json;api-version=3.0-preview.1"},
-                    json=query.simple_query(
-                        [
-                            {
-                                "filterType": query.FilterType.ExtensionId,
-                                "value": uuid,
-                            }
-                            for uuid in group
-                        ]
-                    ),
-                ).json(),
-            )["results"][0]["extensions"]:
-                pub = ext["publisher"]
-                if pub["publisherId"] not in publisher_ids:
-                    update.publishers.append(
-                        models.GalleryExtensionPublisher(
-                            id=pub["publisherId"],
-                            name=pub["publisherName"],
-                            display_name=pub["displayName"],
-                            domain=pub.get("domain"),
-                            domain_verified=pub.get("isDomainVerified"),
-                        )
-                    )
-                    publisher_ids.add(pub["publisherId"])
-                extension = models.GalleryExtension(
-                    id=ext["extensionId"],
-                    name=ext["extensionName"],
-                    display_name=ext["displayName"],
-                    publisher_id=pub["publisherId"],
-                    description=ext.get("shortDescription", ""),
-                    released=ext["releaseDate"],
-                    published=ext["publishedDate"],
-                    flags=ext["flags"],
+        concurrency = max(kwargs["concurrency"], 1)
+        client = GalleryClient(
+            api_url,
+            concurrency=concurrency,
+            rate=kwargs["rate"],
+            retries=kwargs["retries"],
+            stats=self.stats,
+        )
+        started = time.monotonic()
+        try:
+            if kwargs["mode"] == "search":
+                _query = query.simple_query(
+                    kwargs["search"],
+                    pageSize=kwargs["page_size"],
+                    flags=query.EXTENSION_MINIMUM_FLAG,
                 )
-                for stat in ext["statistics"]:
-                    update.statistics.append(
-                        models.GalleryExtensionStatistic(
-                            extension_id=extension.id,
-                            name=stat["statisticName"],
-                            value=stat["value"],
-                        )
-                    )
-                setattr(extension, "_categories", ext["categories"] or [])
-                setattr(extension, "_tags", ext.get("tags") or [])
-                update.extensions.append(extension)
-                for ver in ext["versions"]:
-                    version = models.GalleryExtensionVersion(
-                        extension_id=extension.id,
-                        version=semver.Version.parse(ver["version"]),
-                        last_updated=ver["lastUpdated"],
-                        target_platform=ver.get("targetPlatform"),
+                result = client.query(_query, api_version="1.0")
+                extension_ids = set()
+                for ext in result["results"][0]["extensions"]:
+                    extension_ids.add(ext["extensionId"])
+
+                written = self.run_pipeline(
+                    client,
+                    batched(extension_ids, kwargs["batch_size"]),
+                    concurrency,
+                )
+            elif kwargs["mode"] == "incremental":
+                written = self.incremental(client, **kwargs)
+            elif kwargs["mode"] == "spec":
+                written = self.scoped(client, **kwargs)
+            else:
+                written = self.crawl(client, **kwargs)
+        finally:
+            client.close()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Cloned {written} extensions in {elapsed:.1f}s "
+            f"({written / elapsed if elapsed else 0:.1f} extensions/s), "
+            f"{self.unchanged} unchanged"
+        )
+        return written
+
+    def mirror_assets(self, **kwargs):
+        started = time.monotonic()
+        types = [gallery.AssetType[name].value for name in kwargs["mirror_assets"]]
+        mirror = AssetMirror(kwargs["mirror_storage"], workers=kwargs["mirror_workers"])
+        try:
+            # Collect ids first, the rows are written while being mirrored.
+            ids = list(
+                pending_assets(types, kwargs["mirror_storage"]).values_list(
+                    "id", flat=True
+                )
+            )
+            mirror.run(
+                (
+                    asset
+                    for group in batched(ids, 500)
+                    for asset in models.GalleryExtensionFile.objects.filter(
+                        id__in=group
                     )
-                    version_id = models.GalleryExtensionVersion.objects.filter(
-                        extension_id=extension.id, version=version.version
-                    )[:1].values("id")
-                    update.versions.append(version)
-                    for prop in ver.get("properties", []):
-                        prop = models.GalleryExtensionProperty(
-                            key=prop["key"],
-                            value=prop["value"],
-                            extension_version_id=version_id,
-                        )
-                        update.properties.append(prop)
-                    for asset in ver.get("files", []):
-                        if asset["assetType"] == query.AssetType.VSIX:
-                            skip = False
-                        asset = models.GalleryExtensionFile(
-                            extension_version_id=version_id,
-                            type=asset["assetType"],
-                            source=asset["source"],
-                            storage="vscode_marketplace",
-                            file=ver["assetUri"] + "/" + asset["assetType"],
+                ),
+                log=self.stderr.write,
+            )
+        finally:
+            mirror.close()
+        self.stats.count("assets_mirrored", mirror.mirrored)
+        self.stats.count("assets_reused", mirror.reused)
+        self.stats.count("assets_failed", mirror.failed)
+        self.stdout.write(
+            f"Mirrored {mirror.mirrored} assets, reused {mirror.reused}, "
+            f"failed {mirror.failed} in {time.monotonic() - started:.1f}s"
+        )
+
+    def partitions(
+        self, mode: str
+    ) -> "list[tuple[str, list[gallery.GalleryCriterium]]]":
+        base: "list[gallery.GalleryCriterium]" = [
+            {
+                "filterType": gallery.FilterType.Target,
+                "value": gallery.VSCODE_INSTALLATION_TARGET,
+            },
+            {
+                "filterType": gallery.FilterType.ExcludeWithFlags,
+                "value": str(gallery.GalleryFlags.Unpublished.numerator),
+            },
+        ]
+        if mode == "categories":
+            return [
+                (
+                    category,
+                    [
+                        *base,
+                        {"filterType": gallery.FilterType.Category, "value": category},
+                    ],
+                )
+                for category in gallery.CATEGORIES
+            ]
+        return [("*", base)]
+
+    def crawl(self, client: GalleryClient, **kwargs) -> int:
+        """
+        Page through the upstream catalog, storing a checkpoint after every
+        page so an interrupted crawl resumes from the last completed page.
+        """
+        mode = kwargs["mode"]
+        page_size = kwargs["page_size"]
+        batch_size = kwargs["batch_size"]
+        checkpoint, created = models.SyncCheckpoint.objects.get_or_create(
+            name=f"crawl:{mode}"
+        )
+        if kwargs["restart"] or created or checkpoint.completed:
+            checkpoint.state = {"pages": {}, "done": [], "batches": 0, "extensions": 0}
+            checkpoint.completed = None
+            checkpoint.started = timezone.now()
+            checkpoint.save()
+        else:
+            self.stdout.write(
+                f"Resuming {checkpoint.name} after {checkpoint.state['batches']} batches"
+            )
+        state = checkpoint.state
+
+        seen = set()
+        written = 0
+        for key, criteria in self.partitions(mode):
+            if key in state["done"]:
+                continue
+            page = state["pages"].get(key, 0) + 1
+            while True:
+                result = client.query(
+                    query.simple_query(
+                        criteria,
+                        page=page,
+                        pageSize=page_size,
+                        sortBy=gallery.SortBy.PublishedDate,
+                        sortOrder=gallery.SortOrder.Ascending,
+                        flags=query.EXTENSION_MINIMUM_FLAG,
+                    ),
+                    api_version="1.0",
+                )
+                ids = [ext["extensionId"] for ext in result["results"][0]["extensions"]]
+                new_ids = [id for id in ids if id not in seen]
+                seen.update(new_ids)
+                written += self.run_pipeline(
+                    client, batched(new_ids, batch_size), max(kwargs["concurrency"], 1)
+                )
+                state["pages"][key] = page
+                state["batches"] += math.ceil(len(new_ids) / batch_size)
+                state["extensions"] += len(new_ids)
+                checkpoint.save(update_fields=["state", "updated"])
+                if self.verbosity > 1:
+                    self.stdout.write(f"{key}: page {page}, {len(seen)} extensions")
+                if len(ids) < page_size:
+                    break
+                page += 1
+            state["done"].append(key)
+            checkpoint.save(update_fields=["state", "updated"])
+
+        checkpoint.completed = timezone.now()
+        checkpoint.save(update_fields=["completed", "updated"])
+        return written
+
+    def incremental(self, client: GalleryClient, **kwargs) -> int:
+        """
+        Walk upstream by last updated date until the watermark stored by the
+        previous successful run and fetch details only for changed extensions.
+        """
+        page_size = kwargs["page_size"]
+        checkpoint, _ = models.SyncCheckpoint.objects.get_or_create(name="incremental")
+        watermark = parse_datetime(checkpoint.state.get("watermark") or "")
+        newest = watermark
+        stop = watermark - WATERMARK_OVERLAP if watermark else None
+
+        candidates: "dict[str, datetime]" = {}
+        criteria = self.partitions("catalog")[0][1]
+        page = 1
+        while True:
+            result = client.query(
+                query.simple_query(
+                    criteria,
+                    page=page,
+                    pageSize=page_size,
+                    sortBy=gallery.SortBy.LastUpdatedDate,
+                    sortOrder=gallery.SortOrder.Descending,
+                    flags=query.EXTENSION_MINIMUM_FLAG,
+                ),
+                api_version="1.0",
+            )
+            extensions = result["results"][0]["extensions"]
+            reached = False
+            for ext in extensions:
+                last_updated = parse_datetime(ext["lastUpdated"])
+                if stop and last_updated < stop:
+                    reached = True
+                    break
+                candidates.setdefault(str(uuid.UUID(ext["extensionId"])), last_updated)
+                if newest is None or last_updated > newest:
+                    newest = last_updated
+            if reached or len(extensions) < page_size:
+                break
+            page += 1
+
+        known: "dict[str, datetime | None]" = {}
+        for group in batched(candidates, 500):
+            for id, last_updated in models.GalleryExtension.objects.filter(
+                id__in=group
+            ).values_list("id", "last_updated"):
+                known[str(id)] = last_updated
+
+        inserted, updated, unchanged = [], [], []
+        for id, last_updated in candidates.items():
+            if id not in known:
+                inserted.append(id)
+            elif known[id] is None or known[id] < last_updated:
+                updated.append(id)
+            else:
+                unchanged.append(id)
+
+        written = self.run_pipeline(
+            client,
+            batched([*inserted, *updated], kwargs["batch_size"]),
+            max(kwargs["concurrency"], 1),
+        )
+        checkpoint.state = {
+            "watermark": newest.isoformat() if newest else None,
+            "inserted": len(inserted),
+            "updated": len(updated),
+            "unchanged": len(unchanged),
+        }
+        checkpoint.completed = timezone.now()
+        checkpoint.save()
+        self.stdout.write(
+            f"Inserted {len(inserted)}, updated {len(updated)}, "
+            f"unchanged {len(unchanged)} extensions since {watermark or 'the beginning'}"
+        )
+        return written
+
+    def scoped(self, client: GalleryClient, **kwargs) -> int:
+        """
+        Mirror the extensions selected by the mirror spec, then follow their
+        dependencies and extension packs until every one is installable.
+        """
+        try:
+            spec = MirrorSpec.load(kwargs["spec"])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Invalid mirror spec: {e}")
+        page_size = kwargs["page_size"]
+        batch_size = kwargs["batch_size"]
+        concurrency = max(kwargs["concurrency"], 1)
+
+        selected: "dict[str, str]" = {}
+        base = self.partitions("catalog")[0][1]
+        for key, criteria, sort_by, limit in spec.partitions(base):
+            page = listed = 0
+            while limit is None or listed < limit:
+                page += 1
+                result = client.query(
+                    query.simple_query(
+                        criteria,
+                        page=page,
+                        pageSize=page_size,
+                        sortBy=sort_by,
+                        sortOrder=(
+                            gallery.SortOrder.Descending
+                            if sort_by == gallery.SortBy.InstallCount
+                            else gallery.SortOrder.Ascending
+                        ),
+                        flags=query.EXTENSION_MINIMUM_FLAG
+                        | gallery.GalleryFlags.IncludeCategoryAndTags,
+                    ),
+                    api_version="1.0",
+                )
+                extensions = result["results"][0]["extensions"]
+                for ext in extensions[: limit - listed if limit else None]:
+                    if spec.allows(ext, ranked=key == "top"):
+                        selected.setdefault(ext["extensionId"], uid(ext))
+                listed += len(extensions)
+                if len(extensions) < page_size:
+                    break
+            if self.verbosity > 1:
+                self.stdout.write(f"{key}: {len(selected)} extensions selected")
+
+        fetched: "set[str]" = set()
+        wanted: "set[str]" = set()
+
+        def collect(update: GalleryRecords):
+            for ext in update.queued():
+                fetched.add(uid(ext))
+                if spec.dependencies:
+                    wanted.update(dependencies(update.retained(ext["versions"])))
+
+        written = self.run_pipeline(
+            client, batched(selected, batch_size), concurrency, on_batch=collect
+        )
+        requested: "set[str]" = set()
+        denied: "set[str]" = set()
+        while True:
+            missing = wanted - fetched - requested - denied
+            denied.update(uid for uid in missing if spec.denies_uid(uid))
+            missing -= denied
+            if not missing:
+                break
+            requested.update(missing)
+            written += self.run_pipeline(
+                client,
+                batched(sorted(missing), batch_size),
+                concurrency,
+                filter_type=gallery.FilterType.ExtensionName,
+                on_batch=collect,
+            )
+        unresolved = requested - fetched
+        self.stdout.write(
+            f"Selected {len(selected)} extensions, added "
+            f"{len(requested & fetched)} dependencies, "
+            f"{len(denied)} denied and {len(unresolved)} not found upstream"
+        )
+        if unresolved and self.verbosity > 1:
+            self.stdout.write(f"Not found: {', '.join(sorted(unresolved))}")
+        return written
+
+    def run_pipeline(
+        self,
+        client: GalleryClient,
+        groups,
+        concurrency: int,
+        filter_type: gallery.FilterType = gallery.FilterType.ExtensionId,
+        on_batch=None,
+    ) -> int:
+        """
+        Fetch batches on a bounded thread pool while this thread writes the
+        completed ones, keeping at most two batches per worker in flight.
+        `on_batch` sees every fetched batch before it is written.
+        """
+        written = 0
+        groups = iter(groups)
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            pending = set()
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < concurrency * 2:
+                    group = next(groups, None)
+                    if group is None:
+                        exhausted = True
+                    else:
+                        pending.add(
+                            pool.submit(self.fetch_batch, client, group, filter_type)
                         )
-                    
-                        update.assets.append(asset)
-            update.update()
+                if not pending:
+                    break
+                done, pending = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    update = future.result()
+                    if on_batch:
+                        on_batch(update)
+                    started = time.monotonic()
+                    written += update.update()
+                    self.write_times.append(time.monotonic() - started)
+                    self.stats.count("batches")
+                    self.unchanged += update.unchanged
+        return written
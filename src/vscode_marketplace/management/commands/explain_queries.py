@@ -0,0 +1,128 @@
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from vscode_marketplace import db, models
+from vscode_marketplace.typing.gallery import (
+    AssetType,
+    FilterType,
+    GalleryFlags,
+    SortBy,
+    SortOrder,
+    VSCODE_INSTALLATION_TARGET,
+)
+
+PAGE_SIZE = 50
+
+
+def shapes() -> "dict[str, models.models.QuerySet]":
+    """
+    The queries the gallery API and the sync issue on every request or
+    extension, by name.
+    """
+    id = uuid.uuid4()
+    # Sent by VS Code along with every query.
+    client = [
+        {"filterType": FilterType.Target, "value": VSCODE_INSTALLATION_TARGET},
+        {
+            "filterType": FilterType.ExcludeWithFlags,
+            "value": str(int(GalleryFlags.Unpublished)),
+        },
+    ]
+    queries = {}
+    for sort in SortBy:
+        for order in (SortOrder.Ascending, SortOrder.Descending):
+            queries[f"browse:{sort.name}:{order.name}"] = models.GalleryExtension.query(
+                [{"filterType": FilterType.SearchText, "value": ""}, *client],
+                sort,
+                order,
+            )[:PAGE_SIZE]
+    queries["lookup:extension_id"] = models.GalleryExtension.query(
+        [{"filterType": FilterType.ExtensionId, "value": str(id)}, *client]
+    )
+    queries["lookup:extension_name"] = models.GalleryExtension.query(
+        [{"filterType": FilterType.ExtensionName, "value": "publisher.name"}, *client]
+    )
+    queries["version:latest"] = models.GalleryExtensionVersion.objects.filter(
+        extension_id=id
+    ).order_by("-last_updated")[:1]
+    queries["asset:by_type"] = models.GalleryExtensionFile.objects.filter(
+        extension_version_id=1, type=AssetType.VSIX.value
+    )
+    queries["statistics:by_extension"] = (
+        models.GalleryExtensionStatistic.objects.filter(extension_id=id)
+    )
+    return queries
+
+
+def problems(plan: str, sorts: bool = True) -> "list[str]":
+    """
+    Plan lines showing a full table scan or, unless `sorts` is False for
+    lookups of a single row, a sort that no index serves.
+    """
+    found = []
+    for line in plan.splitlines():
+        step = line.strip(" |-`")
+        if connection.vendor == "sqlite":
+            if (step.startswith("SCAN ") and " USING " not in step) or (
+                sorts and "USE TEMP B-TREE" in step
+            ):
+                found.append(step)
+        elif connection.vendor == "postgresql":
+            if (
+                "Seq Scan" in step
+                or sorts
+                and (step.startswith("->  Sort") or step.startswith("Sort"))
+            ):
+                found.append(step)
+    return found
+
+
+class Command(BaseCommand):
+    help = "Check that the hot gallery queries are served by indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--shape",
+            action="append",
+            help="Only explain the shapes starting with this name, can be repeated",
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Refresh the planner statistics first, plans of tables never "
+            "analyzed may differ from production ones",
+        )
+        parser.add_argument(
+            "--verbose",
+            action="store_true",
+            help="Print every query plan",
+        )
+
+    def handle(self, *args, **kwargs):
+        if connection.vendor not in ("sqlite", "postgresql"):
+            raise CommandError(f"Query plans of {connection.vendor} are not checked")
+        if kwargs["analyze"]:
+            db.analyze(connection)
+        failing = []
+        for name, queryset in shapes().items():
+            if kwargs["shape"] and not any(
+                name.startswith(prefix) for prefix in kwargs["shape"]
+            ):
+                continue
+            with transaction.atomic():
+                if connection.vendor == "postgresql":
+                    # Small test tables are cheaper to scan, only fall back
+                    # to it when no index applies.
+                    with connection.cursor() as cursor:
+                        cursor.execute("SET LOCAL enable_seqscan = off")
+                plan = queryset.explain()
+            found = problems(plan, sorts=not name.startswith("lookup:"))
+            if found:
+                failing.append(name)
+            if kwargs["verbose"] or found:
+                self.stdout.write(f"{name}:\n{plan}\n")
+            self.stdout.write(f"{name}: {'; '.join(found) if found else 'ok'}")
+        if failing:
+            raise CommandError(f"Unindexed query shapes: {', '.join(failing)}")
@@ -0,0 +1,79 @@
+import gzip
+import json
+import os
+import shutil
+import time
+
+from django.core.management.base import BaseCommand
+
+from vscode_marketplace import bundle
+
+
+class Command(BaseCommand):
+    help = "Export the gallery catalog and local assets into an offline bundle"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", type=str, help="Bundle directory to write")
+        parser.add_argument(
+            "--no-assets",
+            action="store_true",
+            help="Only export the catalog, without locally stored assets",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Extensions loaded from the database at a time",
+        )
+
+    def handle(self, *args, **kwargs):
+        output = kwargs["output"]
+        os.makedirs(output, exist_ok=True)
+        started = time.monotonic()
+        extensions = 0
+        assets = 0
+        with gzip.open(
+            os.path.join(output, bundle.CATALOG), "wt", encoding="utf-8"
+        ) as catalog:
+            for ext in bundle.export_queryset().iterator(
+                chunk_size=kwargs["chunk_size"]
+            ):
+                catalog.write(json.dumps(bundle.export_extension(ext)))
+                catalog.write("\n")
+                extensions += 1
+                if not kwargs["no_assets"]:
+                    for asset in bundle.local_assets(ext):
+                        assets += self.export_asset(output, asset)
+                if extensions % 1000 == 0:
+                    self.progress(extensions, assets, started)
+
+        with open(os.path.join(output, bundle.MANIFEST), "w") as fh:
+            json.dump(
+                {
+                    "version": bundle.BUNDLE_VERSION,
+                    "extensions": extensions,
+                    "assets": assets,
+                },
+                fh,
+            )
+        self.progress(extensions, assets, started)
+
+    def export_asset(self, output: str, asset) -> int:
+        path = bundle.asset_path(output, asset.digest)
+        if os.path.exists(path):
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.part"
+        with asset.file.storage.open(asset.file.name, "rb") as src, open(
+            tmp_path, "wb"
+        ) as dst:
+            shutil.copyfileobj(src, dst, 2**20)
+        os.replace(tmp_path, path)
+        return 1
+
+    def progress(self, extensions: int, assets: int, started: float):
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Exported {extensions} extensions and {assets} assets in {elapsed:.1f}s "
+            f"({extensions / elapsed if elapsed else 0:.1f} extensions/s)"
+        )
@@ -0,0 +1,149 @@
+import gzip
+import json
+import os
+import time
+
+from django.core.files.storage import storages
+from django.core.management.base import BaseCommand, CommandError
+
+from generic_storage.compression import compress_variants
+from vscode_marketplace import bundle, models
+from vscode_marketplace.records import GalleryRecords, batched, version_key
+from vscode_marketplace.retention import RetentionPolicy
+from vscode_marketplace.typing.gallery import AssetType
+
+
+class Command(BaseCommand):
+    help = "Import an offline bundle written by export_gallery"
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", type=str, help="Bundle directory to read")
+        parser.add_argument(
+            "--storage",
+            type=str,
+            default="blobs",
+            help="Storage alias the bundled assets are copied into",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Extensions upserted per transaction",
+        )
+
+    def handle(self, *args, **kwargs):
+        root = kwargs["input"]
+        with open(os.path.join(root, bundle.MANIFEST)) as fh:
+            manifest = json.load(fh)
+        if manifest.get("version") != bundle.BUNDLE_VERSION:
+            raise CommandError(f"Unsupported bundle version {manifest.get('version')}")
+
+        self.root = root
+        self.alias = kwargs["storage"]
+        self.storage = storages[self.alias]
+        retention = RetentionPolicy.from_settings()
+        started = time.monotonic()
+        extensions = unchanged = 0
+        with gzip.open(
+            os.path.join(root, bundle.CATALOG), "rt", encoding="utf-8"
+        ) as catalog:
+            for lines in batched(catalog, kwargs["batch_size"]):
+                batch = [json.loads(line) for line in lines]
+                update = GalleryRecords(retention=retention)
+                stored = self.attach_assets(batch, update)
+                for ext in batch:
+                    update.add_extension(ext)
+                update.update()
+                self.release_unused(stored)
+                extensions += len(batch)
+                unchanged += update.unchanged
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"Imported {extensions}/{manifest['extensions']} extensions "
+                    f"in {elapsed:.1f}s ({extensions / elapsed if elapsed else 0:.1f} extensions/s), "
+                    f"{unchanged} unchanged"
+                )
+
+    def attach_assets(
+        self, batch: list, update: GalleryRecords
+    ) -> "list[tuple[str, str, str, str]]":
+        """
+        Copy the bundled assets of the versions of a batch the retention
+        policy keeps into the target storage and point the file entries at
+        the stored copy. Assets already imported for the same version are not
+        copied or referenced again. Returns the version key, type and name of
+        every newly stored asset.
+        """
+        files = [
+            (ext["extensionId"], ver["version"], file)
+            for ext in batch
+            for ver in update.retained(ext["versions"])
+            for file in ver.get("files", [])
+            if file.get("digest")
+        ]
+        if not files:
+            return []
+        existing = {
+            (*version_key(extension_id, version), type, digest): name
+            for extension_id, version, type, digest, name in models.GalleryExtensionFile.objects.filter(
+                storage=self.alias,
+                digest__in={file["digest"] for _, _, file in files},
+            ).values_list(
+                "extension_version__extension_id",
+                "extension_version__version",
+                "type",
+                "digest",
+                "file",
+            )
+        }
+        stored = []
+        for extension_id, version, file in files:
+            digest = file["digest"]
+            key = (*version_key(extension_id, version), file["assetType"], digest)
+            name = existing.get(key)
+            if name is None:
+                name = self.store(digest, file["assetType"])
+                if name is None:
+                    continue
+                stored.append((*key[:3], name))
+            file["storage"] = self.alias
+            file["file"] = name
+        return stored
+
+    def release_unused(self, stored: "list[tuple[str, str, str, str]]") -> None:
+        """
+        Drop the copies stored for assets whose rows were not written, like
+        those of extensions whose content did not change.
+        """
+        if not stored:
+            return
+        written = {
+            (*version_key(extension_id, version), type, name)
+            for extension_id, version, type, name in models.GalleryExtensionFile.objects.filter(
+                storage=self.alias, file__in={name for *_, name in stored}
+            ).values_list(
+                "extension_version__extension_id",
+                "extension_version__version",
+                "type",
+                "file",
+            )
+        }
+        for key in stored:
+            if key not in written:
+                self.storage.delete(key[-1])
+
+    def store(self, digest: str, asset_type: str) -> "str | None":
+        name_for = getattr(self.storage, "name_for", None)
+        if name_for and self.storage.exists(name_for(digest)):
+            return self.storage.reference(name_for(digest))
+        path = bundle.asset_path(self.root, digest)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as fh:
+            name = self.storage.save(digest, fh)
+        if AssetType.compressible(asset_type):
+            try:
+                compress_variants(self.storage, name)
+            except NotImplementedError:
+                pass
+        return name
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from vscode_marketplace import models
+from vscode_marketplace.retention import RetentionPolicy
+
+
+class Command(BaseCommand):
+    help = "Delete stored versions outside the retention policy"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-stable",
+            type=int,
+            help="Stable versions kept per platform, overrides VSCODE_MARKETPLACE_RETENTION",
+        )
+        parser.add_argument(
+            "--keep-prerelease",
+            type=int,
+            help="Pre-release versions kept per platform",
+        )
+        parser.add_argument(
+            "--keep-days",
+            type=float,
+            help="Also keep versions updated within this many days",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Extensions examined and versions deleted per transaction",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the versions that would be deleted",
+        )
+
+    def handle(self, *args, **kwargs):
+        policy = RetentionPolicy.from_settings(
+            stable=kwargs["keep_stable"],
+            prerelease=kwargs["keep_prerelease"],
+            days=kwargs["keep_days"],
+        )
+        if not policy:
+            self.stdout.write("No retention limits configured, nothing to prune")
+            return
+        started = time.monotonic()
+        before = models.GalleryExtensionVersion.objects.count()
+        pruned = policy.prune(
+            chunk_size=kwargs["chunk_size"], dry_run=kwargs["dry_run"]
+        )
+        self.stdout.write(
+            f"{'Would delete' if kwargs['dry_run'] else 'Deleted'} {pruned} of "
+            f"{before} versions with {policy!r} in {time.monotonic() - started:.1f}s"
+        )
@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand
+
+from vscode_marketplace import fake_upstream
+
+
+class Command(BaseCommand):
+    help = "Serve a local stand-in for the upstream marketplace to clone from"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", type=str, default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--catalog",
+            type=str,
+            help="Recorded extensionquery response or export_gallery catalog "
+            "to serve instead of a synthetic one",
+        )
+        parser.add_argument(
+            "--extensions",
+            type=int,
+            default=1000,
+            help="Size of the synthetic catalog",
+        )
+        parser.add_argument(
+            "--versions",
+            type=int,
+            default=3,
+            help="Versions per synthetic extension",
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0.0, help="Seconds added to every request"
+        )
+        parser.add_argument(
+            "--jitter",
+            type=float,
+            default=0.0,
+            help="Random extra seconds added to every request",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of requests answered with 429 or 503",
+        )
+        parser.add_argument(
+            "--max-page-size",
+            type=int,
+            default=1000,
+            help="Largest page size honoured",
+        )
+        parser.add_argument(
+            "--max-pages",
+            type=int,
+            help="Return no extensions past this page",
+        )
+        parser.add_argument(
+            "--seed", type=int, help="Seed for injected latency and errors"
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["catalog"]:
+            catalog = fake_upstream.load_catalog(kwargs["catalog"])
+        else:
+            catalog = fake_upstream.synthetic_catalog(
+                kwargs["extensions"], kwargs["versions"]
+            )
+        server = fake_upstream.FakeMarketplace(
+            catalog,
+            (kwargs["bind"], kwargs["port"]),
+            latency=kwargs["latency"],
+            jitter=kwargs["jitter"],
+            error_rate=kwargs["error_rate"],
+            max_page_size=kwargs["max_page_size"],
+            max_pages=kwargs["max_pages"],
+            seed=kwargs["seed"],
+        )
+        self.stdout.write(
+            f"Serving {len(catalog)} extensions on {server.url}{fake_upstream.API_PATH}"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(
+                f"Answered {server.requests} requests, injected {server.errors} errors"
+            )
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.2 on 2026-10-19 02:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vscode_marketplace", "0002_remove_galleryextension_statistics_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="galleryextension",
+            options={"base_manager_name": "objects"},
+        ),
+        migrations.AddField(
+            model_name="galleryextensionfile",
+            name="digest",
+            field=models.CharField(db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="galleryextensionfile",
+            name="size",
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
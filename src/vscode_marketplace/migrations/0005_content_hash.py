@@ -0,0 +1,23 @@
+# Generated by Django 4.2.2 on 2026-10-19 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vscode_marketplace", "0004_synccheckpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="galleryextension",
+            name="content_hash",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="galleryextensionversion",
+            name="content_hash",
+            field=models.CharField(max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.2 on 2026-10-19 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vscode_marketplace", "0005_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("command", models.CharField(max_length=100)),
+                ("mode", models.CharField(blank=True, max_length=100)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("succeeded", "Succeeded"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=20,
+                    ),
+                ),
+                ("started", models.DateTimeField(auto_now_add=True)),
+                ("finished", models.DateTimeField(null=True)),
+                ("extensions", models.IntegerField(default=0)),
+                ("unchanged", models.IntegerField(default=0)),
+                ("stats", models.JSONField(default=dict)),
+                ("error", models.TextField(blank=True)),
+            ],
+            options={
+                "ordering": ["-started"],
+            },
+        ),
+    ]
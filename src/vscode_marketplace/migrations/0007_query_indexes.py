@@ -0,0 +1,82 @@
+# Generated by Django 4.2.2 on 2026-10-19 04:20
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Subquery
+
+SORTABLE_STATISTICS = ("install", "averagerating", "weightedRating")
+
+
+def backfill(apps, schema_editor):
+    Extension = apps.get_model("vscode_marketplace", "GalleryExtension")
+    Version = apps.get_model("vscode_marketplace", "GalleryExtensionVersion")
+    Statistic = apps.get_model("vscode_marketplace", "GalleryExtensionStatistic")
+    db = schema_editor.connection.alias
+    Extension.objects.using(db).update(
+        last_updated=Subquery(
+            Version.objects.filter(extension_id=OuterRef("pk"))
+            .order_by("-last_updated")
+            .values("last_updated")[:1]
+        )
+    )
+    for name in SORTABLE_STATISTICS:
+        missing = (
+            Extension.objects.using(db)
+            .exclude(
+                Exists(Statistic.objects.filter(extension_id=OuterRef("pk"), name=name))
+            )
+            .values_list("pk", flat=True)
+        )
+        Statistic.objects.using(db).bulk_create(
+            [Statistic(extension_id=pk, name=name, value=0) for pk in missing],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vscode_marketplace", "0006_syncrun"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="galleryextension",
+            name="last_updated",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="galleryextension",
+            index=models.Index(fields=["published"], name="gallery_extension_pub_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="galleryextension",
+            index=models.Index(
+                fields=["display_name"], name="gallery_extension_title_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="galleryextension",
+            index=models.Index(
+                fields=["last_updated"], name="gallery_extension_upd_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="galleryextensionpublisher",
+            index=models.Index(
+                fields=["display_name"], name="gallery_publisher_title_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="galleryextensionstatistic",
+            index=models.Index(
+                fields=["name", "value"], name="gallery_statistic_value_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="galleryextensionversion",
+            index=models.Index(
+                fields=["extension", "last_updated"], name="gallery_version_latest_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 4.2.2 on 2026-10-19 04:50
+
+import itertools
+
+from django.db import migrations, models
+import django.db.models.deletion
+import vscode_marketplace.models
+
+BATCH_SIZE = 1000
+
+
+def _save(Version, db: str, properties: dict) -> None:
+    Version.objects.using(db).bulk_update(
+        [Version(id=id, properties=value) for id, value in properties.items()],
+        ["properties"],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def pack(apps, schema_editor):
+    Version = apps.get_model("vscode_marketplace", "GalleryExtensionVersion")
+    Property = apps.get_model("vscode_marketplace", "GalleryExtensionProperty")
+    db = schema_editor.connection.alias
+    rows = (
+        Property.objects.using(db)
+        .order_by("extension_version_id", "id")
+        .values_list("extension_version_id", "key", "value")
+    )
+    batch = {}
+    for version_id, group in itertools.groupby(
+        rows.iterator(chunk_size=BATCH_SIZE), key=lambda row: row[0]
+    ):
+        batch[version_id] = {key: value for _, key, value in group}
+        if len(batch) >= BATCH_SIZE:
+            _save(Version, db, batch)
+            batch = {}
+    _save(Version, db, batch)
+
+
+def unpack(apps, schema_editor):
+    Version = apps.get_model("vscode_marketplace", "GalleryExtensionVersion")
+    Property = apps.get_model("vscode_marketplace", "GalleryExtensionProperty")
+    db = schema_editor.connection.alias
+    batch = []
+    for id, properties in (
+        Version.objects.using(db)
+        .values_list("id", "properties")
+        .order_by("id")
+        .iterator(chunk_size=BATCH_SIZE)
+    ):
+        batch.extend(
+            Property(extension_version_id=id, key=key, value=value)
+            for key, value in (properties or {}).items()
+        )
+        if len(batch) >= BATCH_SIZE:
+            Property.objects.using(db).bulk_create(batch, batch_size=BATCH_SIZE)
+            batch = []
+    Property.objects.using(db).bulk_create(batch, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vscode_marketplace", "0007_query_indexes"),
+    ]
+
+    operations = [
+        # Free the "properties" name on versions for the new column.
+        migrations.AlterField(
+            model_name="galleryextensionproperty",
+            name="extension_version",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="property_rows",
+                to="vscode_marketplace.galleryextensionversion",
+            ),
+        ),
+        migrations.AddField(
+            model_name="galleryextensionversion",
+            name="properties",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.RunPython(pack, unpack),
+        migrations.AddIndex(
+            model_name="galleryextensionversion",
+            index=models.Index(
+                vscode_marketplace.models.PropertyValue(
+                    "Microsoft.VisualStudio.Code.Engine"
+                ),
+                name="gallery_version_engine_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="galleryextensionversion",
+            index=models.Index(
+                vscode_marketplace.models.PropertyValue(
+                    "Microsoft.VisualStudio.Code.PreRelease"
+                ),
+                name="gallery_version_prerelease_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="galleryextensionversion",
+            index=models.Index(
+                vscode_marketplace.models.PropertyValue(
+                    "Microsoft.VisualStudio.Code.WebExtension"
+                ),
+                name="gallery_version_web_idx",
+            ),
+        ),
+        migrations.DeleteModel(
+            name="GalleryExtensionProperty",
+        ),
+    ]
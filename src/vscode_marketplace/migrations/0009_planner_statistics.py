@@ -0,0 +1,37 @@
+# Generated by Django 4.2.2 on 2026-10-19 05:30
+
+from django.db import migrations
+
+# Rows of a populated catalog, the planner assumes these for tables without
+# statistics of their own.
+ESTIMATED_ROWS = {
+    "vscode_marketplace_galleryextensionpublisher": 10_000,
+    "vscode_marketplace_galleryextension": 100_000,
+}
+
+
+def analyze(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        cursor.execute("SELECT DISTINCT tbl FROM sqlite_stat1")
+        analyzed = {row[0] for row in cursor.fetchall()}
+        for table, rows in ESTIMATED_ROWS.items():
+            if table not in analyzed:
+                cursor.execute(
+                    "INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (%s, NULL, %s)",
+                    [table, str(rows)],
+                )
+        cursor.execute("ANALYZE sqlite_schema")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vscode_marketplace", "0008_version_properties"),
+    ]
+
+    operations = [
+        migrations.RunPython(analyze, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,396 @@
+import hashlib
+import multiprocessing
+import os
+import posixpath
+from concurrent import futures
+from typing import Iterable
+
+import requests
+from django.conf import settings
+from django.core.files.storage import storages
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from generic_storage.compression import compress_variants
+
+from . import db, models, utils
+from .typing.gallery import AssetType
+
+UPSTREAM_STORAGE = "vscode_marketplace"
+
+
+class MirrorError(Exception):
+    pass
+
+
+# Lives in utils so spawned hash workers can import it without Django.
+hash_file = utils.hash_file
+
+
+def _content_range(value: str) -> "tuple[int | None, int | None]":
+    """
+    First byte and total size of a `bytes start-end/total` or `bytes */total`
+    Content-Range header, None for the parts that are missing.
+    """
+    unit, _, rest = value.partition(" ")
+    span, _, total = rest.partition("/")
+    start = span.partition("-")[0]
+    if unit != "bytes":
+        return None, None
+    return (
+        int(start) if start.isdigit() else None,
+        int(total) if total.isdigit() else None,
+    )
+
+
+def pending_assets(types: "Iterable[str]", storage: str = "blobs"):
+    """
+    Upstream assets of the given types without a copy in the storage alias.
+    """
+    return models.GalleryExtensionFile.objects.filter(
+        storage=UPSTREAM_STORAGE, type__in=list(types)
+    ).exclude(
+        Exists(
+            models.GalleryExtensionFile.objects.filter(
+                extension_version_id=OuterRef("extension_version_id"),
+                type=OuterRef("type"),
+                storage=storage,
+            )
+        )
+    )
+
+
+class AssetMirror:
+    """
+    Download upstream assets into a local storage alias.
+
+    Downloads run on a thread pool and resume from partial files in the
+    staging directory with Range requests guarded by If-Range, sizes and
+    hashes are verified on a process pool and the database row is only
+    written once the file is in place.
+    """
+
+    def __init__(
+        self,
+        storage: str = "blobs",
+        workers: int = 8,
+        hash_workers: "int | None" = None,
+        retries: int = 5,
+        timeout: float = 120,
+        staging: "str | None" = None,
+    ) -> None:
+        self.alias = storage
+        self.storage = storages[storage]
+        self.workers = max(workers, 1)
+        self.hash_workers = hash_workers
+        self.retries = retries
+        self.timeout = timeout
+        self.staging = str(
+            staging
+            or getattr(
+                settings,
+                "VSCODE_MARKETPLACE_MIRROR_STAGING",
+                settings.BASE_DIR.parent / "dev/staging",
+            )
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.workers,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.mirrored = self.reused = self.failed = 0
+
+    def staging_path(self, asset: models.GalleryExtensionFile) -> str:
+        key = hashlib.sha256((asset.source or asset.file.name).encode()).hexdigest()
+        return os.path.join(self.staging, f"{key}.part")
+
+    def discard(self, path: str) -> None:
+        """
+        Drop a partial download together with its validator.
+        """
+        for name in (path, f"{path}.validator"):
+            try:
+                os.unlink(name)
+            except FileNotFoundError:
+                pass
+
+    def download(self, asset: models.GalleryExtensionFile) -> "tuple[str, int | None]":
+        """
+        Download an asset into the staging directory, resuming a previous
+        partial download. Returns the path and the size announced upstream.
+
+        The ETag or Last-Modified of the first response is kept next to the
+        partial file and sent as If-Range, so a changed upstream file is
+        downloaded again from the start instead of being appended to.
+        """
+        url = asset.source or asset.file.name
+        path = self.staging_path(asset)
+        marker = f"{path}.validator"
+        os.makedirs(self.staging, exist_ok=True)
+        for attempt in range(self.retries + 1):
+            offset = os.path.getsize(path) if os.path.exists(path) else 0
+            validator = None
+            if offset:
+                try:
+                    with open(marker) as fh:
+                        validator = fh.read().strip()
+                except FileNotFoundError:
+                    pass
+                if not validator:
+                    # Nothing tells whether the partial file is still current.
+                    self.discard(path)
+                    offset = 0
+            headers = (
+                {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+            )
+            try:
+                with self.session.get(
+                    url, headers=headers, stream=True, timeout=self.timeout
+                ) as resp:
+                    if resp.status_code == 416:
+                        # Nothing is left past the partial file, it is only
+                        # complete if upstream has exactly that many bytes.
+                        # verify() then checks the content.
+                        _, total = _content_range(resp.headers.get("Content-Range", ""))
+                        if total == offset:
+                            return path, offset
+                        self.discard(path)
+                        continue
+                    resp.raise_for_status()
+                    encoded = (
+                        resp.headers.get("Content-Encoding", "identity") != "identity"
+                    )
+                    if resp.status_code == 206:
+                        start, expected = _content_range(
+                            resp.headers.get("Content-Range", "")
+                        )
+                        if start != offset:
+                            self.discard(path)
+                            continue
+                        mode = "ab"
+                    else:
+                        length = resp.headers.get("Content-Length")
+                        expected = int(length) if length and length.isdigit() else None
+                        mode = "wb"
+                        # If-Range needs a strong validator, and a decoded
+                        # body cannot be resumed with ranges of the encoding.
+                        validator = resp.headers.get("ETag", "")
+                        if validator.startswith("W/") or not validator:
+                            validator = resp.headers.get("Last-Modified")
+                        if encoded:
+                            validator = None
+                        if validator:
+                            with open(marker, "w") as fh:
+                                fh.write(validator)
+                        elif os.path.exists(marker):
+                            os.unlink(marker)
+                    # Sizes only make sense for the raw bytes on the wire.
+                    if encoded:
+                        expected = None
+                    with open(path, mode) as fh:
+                        for chunk in resp.iter_content(2**20):
+                            fh.write(chunk)
+                return path, expected
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ):
+                # Whatever arrived is kept and the next attempt resumes it.
+                if attempt >= self.retries:
+                    raise
+        raise MirrorError(f"{url}: could not resume the partial download")
+
+    def verify(
+        self,
+        asset: models.GalleryExtensionFile,
+        path: str,
+        expected: "int | None",
+        hashers: "futures.Executor | None" = None,
+    ) -> "tuple[str, int]":
+        if hashers is not None:
+            digest, size = hashers.submit(hash_file, path).result()
+        else:
+            digest, size = hash_file(path)
+        if expected is not None and size != expected:
+            self.discard(path)
+            raise MirrorError(f"{asset.source}: expected {expected} bytes, got {size}")
+        if asset.digest and asset.digest != digest:
+            self.discard(path)
+            raise MirrorError(
+                f"{asset.source}: digest mismatch {digest} != {asset.digest}"
+            )
+        return digest, size
+
+    def fetch(
+        self,
+        asset: models.GalleryExtensionFile,
+        hashers: "futures.Executor | None" = None,
+    ) -> "tuple[models.GalleryExtensionFile, str, str, int]":
+        resumed = os.path.exists(self.staging_path(asset))
+        path, expected = self.download(asset)
+        try:
+            digest, size = self.verify(asset, path, expected, hashers)
+        except MirrorError:
+            if not resumed:
+                raise
+            # The partial file may have been bad, verify() dropped it so
+            # this is a fresh download.
+            path, expected = self.download(asset)
+            digest, size = self.verify(asset, path, expected, hashers)
+        return asset, path, digest, size
+
+    def known(self, asset: models.GalleryExtensionFile):
+        if not asset.source:
+            return None
+        return (
+            models.GalleryExtensionFile.objects.filter(
+                source=asset.source, storage=self.alias, digest__isnull=False
+            )
+            .exclude(file="")
+            .first()
+        )
+
+    def commit(
+        self,
+        asset: models.GalleryExtensionFile,
+        name: str,
+        digest: "str | None",
+        size: int,
+    ) -> models.GalleryExtensionFile:
+        if AssetType.compressible(asset.type):
+            try:
+                compress_variants(self.storage, name)
+            except NotImplementedError:
+                pass
+        db.acquired(self.alias, name)
+        with transaction.atomic(db.catalog_alias()):
+            local, _ = models.GalleryExtensionFile.objects.update_or_create(
+                extension_version_id=asset.extension_version_id,
+                type=asset.type,
+                storage=self.alias,
+                defaults={
+                    "source": asset.source,
+                    "file": name,
+                    "digest": digest,
+                    "size": size,
+                },
+            )
+            if asset.pk and asset.pk != local.pk:
+                models.GalleryExtensionFile.objects.filter(pk=asset.pk).update(
+                    digest=digest, size=size
+                )
+        return local
+
+    def store(
+        self, asset: models.GalleryExtensionFile, path: str, digest: str, size: int
+    ) -> models.GalleryExtensionFile:
+        self.discard(f"{path}.validator")
+        if hasattr(self.storage, "ingest"):
+            name = self.storage.ingest(path, digest, size)
+        else:
+            filename = utils.filename_from_url(asset.source) if asset.source else None
+            with open(path, "rb") as fh:
+                name = self.storage.save(filename or posixpath.basename(asset.type), fh)
+            os.unlink(path)
+        self.mirrored += 1
+        return self.commit(asset, name, digest, size)
+
+    def reuse(
+        self, asset: models.GalleryExtensionFile
+    ) -> "models.GalleryExtensionFile | None":
+        known = self.known(asset)
+        if known is None or not hasattr(self.storage, "reference"):
+            return None
+        name = self.storage.reference(known.file.name)
+        self.reused += 1
+        return self.commit(asset, name, known.digest, known.size)
+
+    def mirror(self, asset: models.GalleryExtensionFile) -> models.GalleryExtensionFile:
+        return self.reuse(asset) or self.store(*self.fetch(asset))
+
+    def run(self, assets: "Iterable[models.GalleryExtensionFile]", log=None) -> None:
+        """
+        Mirror many assets, keeping at most two downloads per worker queued.
+        """
+        assets = iter(assets)
+        # Assets sharing a source wait for the first download and reuse it.
+        inflight: "dict[str, list[models.GalleryExtensionFile]]" = {}
+        # Hash workers are started on demand from the download threads, forking
+        # there could copy locks held by other threads into the child.
+        with futures.ThreadPoolExecutor(
+            max_workers=self.workers
+        ) as downloads, futures.ProcessPoolExecutor(
+            max_workers=self.hash_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as hashers:
+            pending = {}
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < self.workers * 2:
+                    asset = next(assets, None)
+                    if asset is None:
+                        exhausted = True
+                    elif self.reuse(asset):
+                        continue
+                    elif (path := self.staging_path(asset)) in inflight:
+                        inflight[path].append(asset)
+                    else:
+                        inflight[path] = []
+                        pending[downloads.submit(self.fetch, asset, hashers)] = path
+                if not pending:
+                    break
+                done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    waiting = inflight.pop(pending.pop(future))
+                    try:
+                        self.store(*future.result())
+                    except (requests.RequestException, MirrorError, OSError) as e:
+                        self.failed += 1 + len(waiting)
+                        if log:
+                            log(f"Failed to mirror asset: {e}")
+                        continue
+                    for asset in waiting:
+                        try:
+                            if not self.reuse(asset):
+                                self.store(*self.fetch(asset))
+                        except (requests.RequestException, MirrorError, OSError) as e:
+                            self.failed += 1
+                            if log:
+                                log(f"Failed to mirror asset: {e}")
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def mirror_asset(
+    asset: models.GalleryExtensionFile, storage: str = "blobs"
+) -> models.GalleryExtensionFile:
+    """
+    Copy an asset into a local storage alias and record its digest and size.
+
+    Content already mirrored from the same source is referenced instead of
+    downloaded again, with a content addressed storage identical files from
+    different sources end up sharing a single blob.
+    """
+    local = models.GalleryExtensionFile.objects.filter(
+        extension_version_id=asset.extension_version_id,
+        type=asset.type,
+        storage=storage,
+    ).first()
+    if local and local.digest:
+        return local
+    mirror = AssetMirror(storage, workers=1)
+    try:
+        return mirror.mirror(asset)
+    finally:
+        mirror.close()
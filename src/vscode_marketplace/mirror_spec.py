@@ -0,0 +1,194 @@
+import json
+
+from django.conf import settings
+
+from .typing import gallery
+
+RULES = ("publishers", "categories", "tags", "extensions")
+
+
+def uid(ext: gallery.GalleryExtension) -> str:
+    return f"{ext['publisher']['publisherName']}.{ext['extensionName']}".lower()
+
+
+def dependencies(versions: "list[gallery.GalleryExtensionVersion]") -> "set[str]":
+    """
+    Uids referenced by the ExtensionDependencies and ExtensionPack
+    properties of the given versions.
+    """
+    uids = set()
+    for ver in versions:
+        for prop in ver.get("properties") or []:
+            if prop["key"] in (
+                gallery.PropertyType.Dependency.value,
+                gallery.PropertyType.ExtensionPack.value,
+            ):
+                uids.update(
+                    value.strip().lower()
+                    for value in prop["value"].split(",")
+                    if value.strip()
+                )
+    return uids
+
+
+class MirrorSpec:
+    """
+    Declarative scope of a partial mirror.
+
+    `allow` and `deny` map publishers, categories, tags and extensions (by
+    uid) to lists of values, `top` adds the N most installed extensions.
+    With nothing allowed the whole catalog is mirrored minus what is denied.
+    When `dependencies` is set the extension dependencies and packs of every
+    mirrored extension are followed transitively, except into denied
+    publishers or extensions.
+    """
+
+    def __init__(
+        self,
+        allow: "dict[str, list[str]] | None" = None,
+        deny: "dict[str, list[str]] | None" = None,
+        top: "int | None" = None,
+        dependencies: bool = True,
+    ) -> None:
+        self.allow = self._rules(allow or {})
+        self.deny = self._rules(deny or {})
+        self.top = top
+        self.dependencies = dependencies
+
+    @staticmethod
+    def _rules(rules: "dict[str, list[str]]") -> "dict[str, set[str]]":
+        unknown = set(rules) - set(RULES)
+        if unknown:
+            raise ValueError(f"Unknown mirror spec rules: {', '.join(sorted(unknown))}")
+        return {
+            rule: {value.lower() for value in rules.get(rule) or []} for rule in RULES
+        }
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> "MirrorSpec":
+        unknown = set(spec) - {"allow", "deny", "top", "dependencies"}
+        if unknown:
+            raise ValueError(f"Unknown mirror spec keys: {', '.join(sorted(unknown))}")
+        return cls(
+            allow=spec.get("allow"),
+            deny=spec.get("deny"),
+            top=spec.get("top"),
+            dependencies=spec.get("dependencies", True),
+        )
+
+    @classmethod
+    def load(cls, path: "str | None" = None) -> "MirrorSpec":
+        """
+        Read a spec from a JSON file, or VSCODE_MARKETPLACE_MIRROR_SPEC.
+        """
+        if path is None:
+            return cls.from_dict(
+                getattr(settings, "VSCODE_MARKETPLACE_MIRROR_SPEC", {})
+            )
+        with open(path) as fh:
+            return cls.from_dict(json.load(fh))
+
+    @property
+    def scoped(self) -> bool:
+        return bool(self.top) or any(self.allow.values())
+
+    def partitions(
+        self, base: "list[gallery.GalleryCriterium]"
+    ) -> "list[tuple[str, list[gallery.GalleryCriterium], gallery.SortBy, int | None]]":
+        """
+        Upstream queries covering the spec as (key, criteria, sort, limit).
+        They may return more than allowed, results go through allows().
+        """
+        if not self.scoped:
+            return [("*", base, gallery.SortBy.PublishedDate, None)]
+        partitions = []
+        if self.top:
+            partitions.append(("top", base, gallery.SortBy.InstallCount, self.top))
+        for publisher in sorted(self.allow["publishers"]):
+            partitions.append(
+                (
+                    f"publisher:{publisher}",
+                    [
+                        *base,
+                        {
+                            "filterType": gallery.FilterType.SearchText,
+                            "value": publisher,
+                        },
+                    ],
+                    gallery.SortBy.PublishedDate,
+                    None,
+                )
+            )
+        for rule, type in (
+            ("categories", gallery.FilterType.Category),
+            ("tags", gallery.FilterType.Tag),
+        ):
+            # Categories are matched case sensitively upstream.
+            values = (
+                [
+                    category
+                    for category in gallery.CATEGORIES
+                    if category.lower() in self.allow[rule]
+                ]
+                if rule == "categories"
+                else sorted(self.allow[rule])
+            )
+            for value in values:
+                partitions.append(
+                    (
+                        f"{rule}:{value}",
+                        [*base, {"filterType": type, "value": value}],
+                        gallery.SortBy.PublishedDate,
+                        None,
+                    )
+                )
+        if self.allow["extensions"]:
+            partitions.append(
+                (
+                    "extensions",
+                    [
+                        *base,
+                        *(
+                            {
+                                "filterType": gallery.FilterType.ExtensionName,
+                                "value": uid,
+                            }
+                            for uid in sorted(self.allow["extensions"])
+                        ),
+                    ],
+                    gallery.SortBy.PublishedDate,
+                    None,
+                )
+            )
+        return partitions
+
+    def _matches(
+        self, rules: "dict[str, set[str]]", ext: gallery.GalleryExtension
+    ) -> bool:
+        return (
+            ext["publisher"]["publisherName"].lower() in rules["publishers"]
+            or uid(ext) in rules["extensions"]
+            or any(
+                category.lower() in rules["categories"]
+                for category in ext.get("categories") or []
+            )
+            or any(tag.lower() in rules["tags"] for tag in ext.get("tags") or [])
+        )
+
+    def denied(self, ext: gallery.GalleryExtension) -> bool:
+        return self._matches(self.deny, ext)
+
+    def denies_uid(self, uid: str) -> bool:
+        return (
+            uid in self.deny["extensions"]
+            or uid.split(".")[0] in self.deny["publishers"]
+        )
+
+    def allows(self, ext: gallery.GalleryExtension, ranked: bool = False) -> bool:
+        """
+        Whether a listed extension is in scope, `ranked` ones came from the
+        top N query.
+        """
+        if self.denied(ext):
+            return False
+        return ranked or not any(self.allow.values()) or self._matches(self.allow, ext)
@@ -124,6 +124,11 @@ class GalleryExtensionPublisher(_Named):
     domain_verified = models.BooleanField(null=True)
     extensions: models.QuerySet["GalleryExtension"]
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["display_name"], name="gallery_publisher_title_idx")
+        ]
+
     def __str__(self) -> str:
         return self.name
 
@@ -173,18 +178,13 @@ class GalleryExtension(_Named):
     published = models.DateTimeField()
     categories = TaggableManager(through=GalleryExtensionCategories)
     flags = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64, null=True)
+    # Newest version update, kept by the sync so it can be sorted on.
+    last_updated = models.DateTimeField(null=True)
 
     @property
     def latest_version(self):
         return self.versions.order_by("-last_updated").first()
-    
-    @property
-    def last_updated(self):
-        version = self.versions.order_by("-last_updated").first()
-        if version:
-            return version.last_updated
-        else:
-            return None
 
     @classmethod
     def sort(
@@ -206,18 +206,17 @@ class GalleryExtension(_Named):
         elif sortBy is _gallery.SortBy.PublishedDate:
             orderby = "published"
         elif sortBy is _gallery.SortBy.LastUpdatedDate:
-            qs = qs
+            orderby = "last_updated"
         else:
             orderby = "name"
 
         if _gallery.SortOrder.Descending is sortOrder:
             orderby = f"-{orderby}"
         if statistic_name:
-            qs = qs.annotate(
-                _orderby=models.Avg(
-                    "statistic__value", filter=models.Q(name=statistic_name)
-                )
-            )
+            # Every extension has the sortable statistics, joining on them
+            # walks the (name, value) index in order.
+            qs = qs.filter(statistics__name=statistic_name)
+            orderby = orderby.replace("_orderby", "statistics__value")
         return qs.order_by(orderby)
 
     @classmethod
@@ -245,6 +244,11 @@ class GalleryExtension(_Named):
                 fields=["name", "publisher"], name="gallery_extension_unique_name"
             )
         ]
+        indexes = [
+            models.Index(fields=["published"], name="gallery_extension_pub_idx"),
+            models.Index(fields=["display_name"], name="gallery_extension_title_idx"),
+            models.Index(fields=["last_updated"], name="gallery_extension_upd_idx"),
+        ]
 
 
 __all__.append(GalleryExtension.__name__)
@@ -257,12 +261,50 @@ class GalleryExtensionStatistic(models.Model):
     name = models.CharField(max_length=255)
     value = models.FloatField()
 
+    # Statistics GalleryExtension.sort() orders by, stored for every
+    # extension (VS Code reads a missing statistic as 0 anyway).
+    SORTABLE = ("install", "averagerating", "weightedRating")
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=["name", "extension"], name="gallery_extension_statistic_uid"
             )
         ]
+        indexes = [
+            models.Index(fields=["name", "value"], name="gallery_statistic_value_idx")
+        ]
+
+
+class PropertyValue(models.Func):
+    """
+    Text value of a version property. The JSON path is part of the SQL so
+    that queries match the expression indexes on it.
+    """
+
+    output_field = models.TextField()
+
+    def __init__(self, key: str, **extra: Any) -> None:
+        if not key.replace(".", "").isalnum():
+            raise ValueError(f"Invalid property key: {key!r}")
+        self.key = key
+        super().__init__(models.F("properties"), **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler,
+            connection,
+            template=f"JSON_EXTRACT(%(expressions)s, '$.\"{self.key}\"')",
+            **extra_context,
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler,
+            connection,
+            template=f"(%(expressions)s ->> '{self.key}')",
+            **extra_context,
+        )
 
 
 class GalleryExtensionVersion(models.Model):
@@ -273,8 +315,10 @@ class GalleryExtensionVersion(models.Model):
     version = SemVerField()
     last_updated = models.DateTimeField()
     assets: models.QuerySet["GalleryExtensionFile"]
-    properties: models.QuerySet["GalleryExtensionProperty"]
+    # Property key to value, as listed upstream.
+    properties = models.JSONField(default=dict)
     target_platform = models.CharField(max_length=100, null=True)
+    content_hash = models.CharField(max_length=64, null=True)
 
     class Meta:
         constraints = [
@@ -282,14 +326,38 @@ class GalleryExtensionVersion(models.Model):
                 fields=["version", "extension"], name="gallery_extension_version_uid"
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["extension", "last_updated"], name="gallery_version_latest_idx"
+            ),
+            models.Index(
+                PropertyValue(_gallery.PropertyType.Engine.value),
+                name="gallery_version_engine_idx",
+            ),
+            models.Index(
+                PropertyValue(_gallery.PropertyType.PreRelease.value),
+                name="gallery_version_prerelease_idx",
+            ),
+            models.Index(
+                PropertyValue(_gallery.PropertyType.WebExtension.value),
+                name="gallery_version_web_idx",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.extension.uid} v{self.version}"
 
-    def icon(self):
-        icon = self.assets.filter(type=_gallery.AssetType.Icon).first()
+    def property_list(self) -> "list[_gallery.GalleryExtensionProperty]":
+        return [{"key": key, "value": value} for key, value in self.properties.items()]
+
+    def icon(self, size: "int | None" = None):
+        icon = self.assets.filter(type=_gallery.AssetType.Icon.value).first()
         if icon:
-            return f'/assets/extensions/{self.extension.publisher.name}/{self.extension.name}/{self.version}/{AssetType.Icon}'
+            url = f'/assets/extensions/{self.extension.publisher.name}/{self.extension.name}/{self.version}/{AssetType.Icon.value}'
+            return f"{url}?size={size}" if size else url
+
+    def icon_thumbnail(self):
+        return self.icon(size=128)
 
 __all__.append(GalleryExtensionVersion.__name__)
 
@@ -317,6 +385,8 @@ class GalleryExtensionFile(_ExtVerLinked):
     file = GenericStorageFileField(storage=_get_storage)
     file: "models.FieldFile"
     storage = models.CharField(max_length=255, null=True)
+    digest = models.CharField(max_length=64, null=True, db_index=True)
+    size = models.BigIntegerField(null=True)
 
     class Meta:
         constraints = [
@@ -330,22 +400,49 @@ class GalleryExtensionFile(_ExtVerLinked):
 __all__.append(GalleryExtensionFile.__name__)
 
 
-class GalleryExtensionProperty(_ExtVerLinked):
-    extension_version = models.ForeignKey(
-        GalleryExtensionVersion, on_delete=models.CASCADE, related_name="properties"
+class SyncCheckpoint(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    state = models.JSONField(default=dict)
+    started = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    completed = models.DateTimeField(null=True)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+__all__.append(SyncCheckpoint.__name__)
+
+
+class SyncRun(models.Model):
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    command = models.CharField(max_length=100)
+    mode = models.CharField(max_length=100, blank=True)
+    status = models.CharField(
+        max_length=20,
+        choices=[(RUNNING, "Running"), (SUCCEEDED, "Succeeded"), (FAILED, "Failed")],
+        default=RUNNING,
     )
-    key = models.CharField(max_length=255)
-    value = models.TextField()
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True)
+    extensions = models.IntegerField(default=0)
+    unchanged = models.IntegerField(default=0)
+    stats = models.JSONField(default=dict)
+    error = models.TextField(blank=True)
 
     class Meta:
-        verbose_name = "GalleryExtensionProperty"
-        verbose_name_plural = "GalleryExtensionProperties"
-        constraints = [
-            models.UniqueConstraint(
-                fields=["extension_version", "key"],
-                name="gallery_extension_property_uid",
-            )
-        ]
+        ordering = ["-started"]
+
+    def __str__(self) -> str:
+        return f"{self.command} {self.mode} {self.started:%Y-%m-%d %H:%M}"
+
+    @property
+    def duration(self) -> "float | None":
+        if self.finished:
+            return (self.finished - self.started).total_seconds()
 
 
-__all__.append(GalleryExtensionProperty.__name__)
+__all__.append(SyncRun.__name__)
@@ -0,0 +1,429 @@
+import functools
+import hashlib
+import itertools
+import json
+import operator
+import uuid
+from contextlib import nullcontext
+from typing import TYPE_CHECKING
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+import semver
+from taggit.models import ItemBase, TagBase
+
+from . import db, models
+from .stats import SyncStats
+from .typing import gallery
+
+if TYPE_CHECKING:
+    from .retention import RetentionPolicy
+
+
+def batched(it, size):
+    it = iter(it)
+    return iter(lambda: tuple(itertools.islice(it, size)), ())
+
+
+def version_key(extension_id, version) -> "tuple[str, str]":
+    return str(uuid.UUID(str(extension_id))), str(version)
+
+
+def content_hash(data) -> str:
+    """
+    Stable digest of upstream JSON, independent of key order and whitespace.
+    """
+    return hashlib.sha256(
+        json.dumps(
+            data, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+        ).encode()
+    ).hexdigest()
+
+
+def _prerelease(ver: gallery.GalleryExtensionVersion) -> bool:
+    return bool(semver.Version.parse(ver["version"]).prerelease) or any(
+        prop["key"] == gallery.PropertyType.PreRelease.value and prop["value"] == "true"
+        for prop in ver.get("properties") or []
+    )
+
+
+def _unique(records: list, key) -> list:
+    # A row may only be upserted once per statement, the last one wins.
+    return list({key(record): record for record in records}.values())
+
+
+class GalleryRecords:
+    extensions: list[models.GalleryExtension]
+    publishers: list[models.GalleryExtensionPublisher]
+    versions: list[models.GalleryExtensionVersion]
+    assets: list[models.GalleryExtensionFile]
+    local_assets: list[models.GalleryExtensionFile]
+    statistics: list[models.GalleryExtensionStatistic]
+
+    def __init__(
+        self,
+        stats: "SyncStats | None" = None,
+        retention: "RetentionPolicy | None" = None,
+    ) -> None:
+        self.stats = stats
+        self.retention = retention
+        self.extensions = []
+        self.publishers = []
+        self.versions = []
+        self.assets = []
+        self.local_assets = []
+        self.statistics = []
+        self.unchanged = 0
+        self._pending: "list[tuple[gallery.GalleryExtension, str]]" = []
+        self._publisher_ids = set()
+
+    def add_extension(self, ext: gallery.GalleryExtension):
+        """
+        Queue an upstream extension, rows are only built in update() for the
+        extensions and versions whose content hash changed.
+        """
+        with self._phase("hash"):
+            self._pending.append((ext, content_hash(ext)))
+
+    def queued(self) -> "list[gallery.GalleryExtension]":
+        return [ext for ext, _ in self._pending]
+
+    def _phase(self, name: str):
+        return self.stats.phase(name) if self.stats else nullcontext()
+
+    def _upsert(self, model, records: list, **kwargs):
+        with self._phase(f"upsert:{model.__name__}"):
+            model.objects.bulk_create(records, update_conflicts=True, **kwargs)
+        if self.stats:
+            self.stats.upserted(model.__name__, len(records))
+
+    def build(self) -> "list[uuid.UUID]":
+        """
+        Compare the queued extensions against the stored content hashes and
+        build model instances for what changed, skipping the rest. Returns
+        the ids of all queued extensions.
+        """
+        pending, self._pending = self._pending, []
+        stored = dict(
+            models.GalleryExtension.objects.filter(
+                id__in={ext["extensionId"] for ext, _ in pending}
+            ).values_list("id", "content_hash")
+        )
+        changed = [
+            (ext, digest)
+            for ext, digest in pending
+            if stored.get(uuid.UUID(ext["extensionId"])) != digest
+        ]
+        self.unchanged += len(pending) - len(changed)
+        version_hashes = {
+            version_key(extension_id, version): digest
+            for extension_id, version, digest in models.GalleryExtensionVersion.objects.filter(
+                extension_id__in={ext["extensionId"] for ext, _ in changed}
+            ).values_list(
+                "extension_id", "version", "content_hash"
+            )
+        }
+        for ext, digest in changed:
+            self._build_extension(ext, digest, version_hashes)
+        return list({uuid.UUID(ext["extensionId"]) for ext, _ in pending})
+
+    def retained(
+        self, versions: "list[gallery.GalleryExtensionVersion]"
+    ) -> "list[gallery.GalleryExtensionVersion]":
+        if not self.retention:
+            return versions
+        kept = self.retention.keep(
+            (
+                index,
+                semver.Version.parse(ver["version"]),
+                ver.get("targetPlatform"),
+                parse_datetime(ver["lastUpdated"]),
+                _prerelease(ver),
+            )
+            for index, ver in enumerate(versions)
+        )
+        return [ver for index, ver in enumerate(versions) if index in kept]
+
+    def _build_extension(
+        self,
+        ext: gallery.GalleryExtension,
+        digest: str,
+        version_hashes: "dict[tuple[str, str], str | None]",
+    ):
+        pub = ext["publisher"]
+        if pub["publisherId"] not in self._publisher_ids:
+            self.publishers.append(
+                models.GalleryExtensionPublisher(
+                    id=pub["publisherId"],
+                    name=pub["publisherName"],
+                    display_name=pub["displayName"],
+                    domain=pub.get("domain"),
+                    domain_verified=pub.get("isDomainVerified"),
+                )
+            )
+            self._publisher_ids.add(pub["publisherId"])
+        extension = models.GalleryExtension(
+            id=ext["extensionId"],
+            name=ext["extensionName"],
+            display_name=ext["displayName"],
+            publisher_id=pub["publisherId"],
+            description=ext.get("shortDescription", ""),
+            released=ext["releaseDate"],
+            published=ext["publishedDate"],
+            flags=ext["flags"],
+            content_hash=digest,
+            last_updated=ext.get("lastUpdated")
+            or max((ver["lastUpdated"] for ver in ext["versions"]), default=None),
+        )
+        statistics = {
+            **dict.fromkeys(models.GalleryExtensionStatistic.SORTABLE, 0),
+            **{stat["statisticName"]: stat["value"] for stat in ext["statistics"]},
+        }
+        for name, value in statistics.items():
+            self.statistics.append(
+                models.GalleryExtensionStatistic(
+                    extension_id=extension.id,
+                    name=name,
+                    value=value,
+                )
+            )
+        setattr(extension, "_categories", ext["categories"] or [])
+        setattr(extension, "_tags", ext.get("tags") or [])
+        self.extensions.append(extension)
+        for ver in self.retained(ext["versions"]):
+            version = models.GalleryExtensionVersion(
+                extension_id=extension.id,
+                version=semver.Version.parse(ver["version"]),
+                last_updated=ver["lastUpdated"],
+                target_platform=ver.get("targetPlatform"),
+                properties={
+                    prop["key"]: prop["value"] for prop in ver.get("properties") or []
+                },
+                content_hash=content_hash(ver),
+            )
+            key = version_key(extension.id, version.version)
+            if version_hashes.get(key) == version.content_hash:
+                continue
+            self.versions.append(version)
+            for file in ver.get("files", []):
+                asset = models.GalleryExtensionFile(
+                    type=file["assetType"],
+                    source=file["source"],
+                    storage="vscode_marketplace",
+                    file=ver["assetUri"] + "/" + file["assetType"],
+                )
+                setattr(asset, "_version_key", key)
+                self.assets.append(asset)
+                # Bundles carry the local copy of an asset next to the upstream one.
+                if file.get("storage") and file.get("file"):
+                    asset = models.GalleryExtensionFile(
+                        type=file["assetType"],
+                        source=file["source"],
+                        storage=file["storage"],
+                        file=file["file"],
+                        digest=file.get("digest"),
+                        size=file.get("size"),
+                    )
+                    setattr(asset, "_version_key", key)
+                    self.local_assets.append(asset)
+        return extension
+
+    def version_ids(self) -> "dict[tuple[str, str], int]":
+        """
+        Map (extension_id, version) to the primary key of every stored
+        version of the extensions in this batch, in a single query.
+        """
+        extension_ids = {version.extension_id for version in self.versions}
+        return {
+            version_key(extension_id, version): id
+            for extension_id, version, id in models.GalleryExtensionVersion.objects.filter(
+                extension_id__in=extension_ids
+            ).values_list(
+                "extension_id", "version", "id"
+            )
+        }
+
+    def sync_tags(
+        self,
+        tag_model: "type[TagBase]",
+        through_model: "type[ItemBase]",
+        attr: str,
+        batch_size: "int | None" = 500,
+    ):
+        """
+        Bring the tags of every extension in the batch in line with upstream,
+        creating missing tags in one statement and diffing the through rows.
+        """
+        wanted = {
+            uuid.UUID(str(ext.id)): set(getattr(ext, attr)) for ext in self.extensions
+        }
+        names = set(itertools.chain.from_iterable(wanted.values()))
+
+        tag_ids = dict(
+            tag_model.objects.filter(name__in=names).values_list("name", "id")
+        )
+        missing = names - tag_ids.keys()
+        if missing:
+            tag_model.objects.bulk_create(
+                [
+                    tag_model(name=name, slug=tag_model().slugify(name))
+                    for name in missing
+                ],
+                ignore_conflicts=True,
+                batch_size=batch_size,
+            )
+            tag_ids.update(
+                tag_model.objects.filter(name__in=missing).values_list("name", "id")
+            )
+            # Names whose slug collides with an existing tag, let taggit pick
+            # a unique slug for those.
+            for name in missing - tag_ids.keys():
+                tag_ids[name] = tag_model.objects.get_or_create(name=name)[0].id
+
+        target = {
+            (extension_id, tag_ids[name])
+            for extension_id, tags in wanted.items()
+            for name in tags
+        }
+        current = set(
+            through_model.objects.filter(content_object_id__in=wanted).values_list(
+                "content_object_id", "tag_id"
+            )
+        )
+
+        stale: "dict[uuid.UUID, list[int]]" = {}
+        for extension_id, tag_id in current - target:
+            stale.setdefault(extension_id, []).append(tag_id)
+        if stale:
+            through_model.objects.filter(
+                functools.reduce(
+                    operator.or_,
+                    (
+                        Q(content_object_id=extension_id, tag_id__in=ids)
+                        for extension_id, ids in stale.items()
+                    ),
+                )
+            ).delete()
+        through_model.objects.bulk_create(
+            [
+                through_model(content_object_id=extension_id, tag_id=tag_id)
+                for extension_id, tag_id in target - current
+            ],
+            ignore_conflicts=True,
+            batch_size=batch_size,
+        )
+
+    def update(self, batch_size: "int | None" = 500) -> int:
+        """
+        Upsert the batch in one transaction: parents first, then versions,
+        then assets with the version ids resolved in bulk. The retention
+        policy is applied to every queued extension, changed or not, so a
+        tighter policy takes effect on the next sync.
+        Returns the number of extensions written.
+        """
+        with self._phase("transaction"), transaction.atomic(db.catalog_alias()):
+            with self._phase("build"):
+                queued = self.build()
+            if self.extensions:
+                self._write(batch_size)
+            if self.retention and queued:
+                # Versions stored earlier may now fall outside the policy.
+                with self._phase("retention"):
+                    pruned = self.retention.prune(queued, batch_size or 500)
+                if self.stats:
+                    self.stats.count("versions_pruned", pruned)
+        return len(self.extensions)
+
+    def _write(self, batch_size: "int | None") -> None:
+        self._upsert(
+            models.GalleryExtensionPublisher,
+            self.publishers,
+            update_fields=["name", "display_name", "domain", "domain_verified"],
+            unique_fields=["id"],
+            batch_size=batch_size,
+        )
+        self._upsert(
+            models.GalleryExtension,
+            self.extensions,
+            update_fields=[
+                "name",
+                "display_name",
+                "publisher_id",
+                "description",
+                "released",
+                "published",
+                "flags",
+                "content_hash",
+                "last_updated",
+            ],
+            unique_fields=["id"],
+            batch_size=batch_size,
+        )
+        self._upsert(
+            models.GalleryExtensionStatistic,
+            _unique(self.statistics, lambda stat: (stat.extension_id, stat.name)),
+            unique_fields=["extension_id", "name"],
+            update_fields=["value"],
+            batch_size=batch_size,
+        )
+        with self._phase("tags"):
+            self.sync_tags(
+                models.GalleryExtensionCategory,
+                models.GalleryExtensionCategories,
+                "_categories",
+                batch_size,
+            )
+            self.sync_tags(
+                models.GalleryExtensionTag,
+                models.GalleryExtensionTags,
+                "_tags",
+                batch_size,
+            )
+        self._upsert(
+            models.GalleryExtensionVersion,
+            _unique(
+                self.versions,
+                lambda version: version_key(version.extension_id, version.version),
+            ),
+            unique_fields=["version", "extension_id"],
+            update_fields=[
+                "last_updated",
+                "target_platform",
+                "properties",
+                "content_hash",
+            ],
+            batch_size=batch_size,
+        )
+
+        with self._phase("resolve"):
+            version_ids = self.version_ids()
+        for record in itertools.chain(self.assets, self.local_assets):
+            record.extension_version_id = version_ids[record._version_key]
+        self._upsert(
+            models.GalleryExtensionFile,
+            _unique(
+                self.assets,
+                lambda asset: (
+                    asset.extension_version_id,
+                    asset.type,
+                    asset.storage,
+                ),
+            ),
+            unique_fields=["extension_version_id", "type", "storage"],
+            update_fields=["source"],
+            batch_size=batch_size,
+        )
+        self._upsert(
+            models.GalleryExtensionFile,
+            _unique(
+                self.local_assets,
+                lambda asset: (
+                    asset.extension_version_id,
+                    asset.type,
+                    asset.storage,
+                ),
+            ),
+            unique_fields=["extension_version_id", "type", "storage"],
+            update_fields=["source", "file", "digest", "size"],
+            batch_size=batch_size,
+        )
@@ -0,0 +1,167 @@
+import datetime
+import itertools
+from typing import Hashable, Iterable
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import db, models
+from .mirror import UPSTREAM_STORAGE
+from .records import batched
+from .typing.gallery import PropertyType
+
+
+class RetentionPolicy:
+    """
+    Which versions of an extension to keep, per target platform: the newest
+    `stable` releases, the newest `prerelease` ones and anything updated in
+    the last `days`. A limit left as None keeps everything of that kind and
+    the newest version of every platform is always kept.
+    """
+
+    def __init__(
+        self,
+        stable: "int | None" = None,
+        prerelease: "int | None" = None,
+        days: "float | None" = None,
+    ) -> None:
+        self.stable = stable
+        self.prerelease = prerelease
+        self.days = days
+
+    @classmethod
+    def from_settings(cls, **overrides) -> "RetentionPolicy":
+        options = {
+            **getattr(settings, "VSCODE_MARKETPLACE_RETENTION", {}),
+            **{key: value for key, value in overrides.items() if value is not None},
+        }
+        return cls(
+            stable=options.get("stable"),
+            prerelease=options.get("prerelease"),
+            days=options.get("days"),
+        )
+
+    def __bool__(self) -> bool:
+        return self.stable is not None or self.prerelease is not None
+
+    def __repr__(self) -> str:
+        return (
+            f"RetentionPolicy(stable={self.stable}, "
+            f"prerelease={self.prerelease}, days={self.days})"
+        )
+
+    def keep(
+        self, versions: "Iterable[tuple]", now: "datetime.datetime | None" = None
+    ) -> "set[Hashable]":
+        """
+        Keys of the versions of a single extension the policy keeps, given
+        (key, version, target platform, last updated, pre-release) tuples.
+        """
+        if not self:
+            return {key for key, *_ in versions}
+        cutoff = (
+            (now or timezone.now()) - datetime.timedelta(days=self.days)
+            if self.days is not None
+            else None
+        )
+        kept = set()
+        platform = lambda info: info[2] or ""
+        for _, group in itertools.groupby(sorted(versions, key=platform), key=platform):
+            group = sorted(group, key=lambda info: info[1], reverse=True)
+            kept.add(group[0][0])
+            for prerelease, limit in ((False, self.stable), (True, self.prerelease)):
+                candidates = [info for info in group if info[4] == prerelease]
+                if limit is not None:
+                    candidates = candidates[:limit]
+                kept.update(info[0] for info in candidates)
+            if cutoff is not None:
+                kept.update(info[0] for info in group if info[3] >= cutoff)
+        return kept
+
+    def expired(self, extension_ids: "Iterable") -> "list[int]":
+        """
+        Ids of the stored versions of these extensions the policy drops.
+        """
+        if not self:
+            return []
+        rows = (
+            models.GalleryExtensionVersion.objects.filter(
+                extension_id__in=list(extension_ids)
+            )
+            .annotate(_prerelease=models.PropertyValue(PropertyType.PreRelease.value))
+            .order_by("extension_id")
+            .values_list(
+                "id",
+                "extension_id",
+                "version",
+                "target_platform",
+                "last_updated",
+                "_prerelease",
+            )
+        )
+        now = timezone.now()
+        expired = []
+        for _, group in itertools.groupby(rows, key=lambda row: row[1]):
+            group = [
+                (
+                    id,
+                    version,
+                    platform,
+                    last_updated,
+                    flag == "true" or bool(version.prerelease),
+                )
+                for id, _, version, platform, last_updated, flag in group
+            ]
+            kept = self.keep(group, now)
+            expired.extend(info[0] for info in group if info[0] not in kept)
+        return expired
+
+    def prune(
+        self,
+        extension_ids: "Iterable | None" = None,
+        chunk_size: int = 500,
+        dry_run: bool = False,
+    ) -> int:
+        """
+        Delete the versions the policy drops, looking at `chunk_size`
+        extensions at a time. Returns the number of versions deleted.
+        """
+        if not self:
+            return 0
+        if extension_ids is None:
+            extension_ids = models.GalleryExtension.objects.order_by("id").values_list(
+                "id", flat=True
+            )
+        deleted = 0
+        for group in batched(extension_ids, chunk_size):
+            expired = self.expired(group)
+            if not dry_run:
+                delete_versions(expired, chunk_size)
+            deleted += len(expired)
+        return deleted
+
+
+def delete_versions(ids: "list[int]", chunk_size: int = 500) -> None:
+    """
+    Delete versions in short transactions of `chunk_size` rows, removing
+    their assets with one statement instead of letting the ORM collect every
+    dependent row. Locally stored files are released once the deleting
+    transaction committed.
+    """
+    for chunk in batched(ids, chunk_size):
+        with transaction.atomic(db.catalog_alias()):
+            files = list(
+                models.GalleryExtensionFile.objects.filter(
+                    extension_version_id__in=chunk
+                )
+                .exclude(storage=UPSTREAM_STORAGE)
+                .exclude(file="")
+                .values_list("storage", "file")
+            )
+            models.GalleryExtensionFile.objects.filter(
+                extension_version_id__in=chunk
+            ).delete()
+            models.GalleryExtensionVersion.objects.filter(id__in=chunk).delete()
+            if files:
+                db.release_files(files)
@@ -0,0 +1,100 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterable, TypeVar
+
+from django.conf import settings
+
+T = TypeVar("T")
+
+
+def options() -> dict:
+    return {
+        "window": 50,
+        "min_samples": 5,
+        "max_error_rate": 0.5,
+        "max_age": 300.0,
+        **getattr(settings, "VSCODE_MARKETPLACE_SOURCES", {}),
+    }
+
+
+class SourceStats:
+    """
+    Latency and error rate of the last `window` asset reads per storage
+    alias, kept per process. Reads older than `max_age` seconds are
+    forgotten, so sources ranked last are tried again eventually.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.samples: "dict[str, deque[tuple[float, float, bool]]]" = {}
+
+    def record(self, alias: str, seconds: float, error: bool = False) -> None:
+        window = options()["window"]
+        with self._lock:
+            samples = self.samples.get(alias)
+            if samples is None or samples.maxlen != window:
+                samples = self.samples[alias] = deque(samples or (), maxlen=window)
+            samples.append((time.monotonic(), seconds, error))
+
+    @contextmanager
+    def timed(self, alias: str):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record(alias, time.perf_counter() - started, error=True)
+            raise
+        self.record(alias, time.perf_counter() - started)
+
+    def source(self, alias: str) -> dict:
+        _options = options()
+        cutoff = time.monotonic() - _options["max_age"]
+        with self._lock:
+            samples = [
+                (seconds, error)
+                for at, seconds, error in self.samples.get(alias, ())
+                if at >= cutoff
+            ]
+        latencies = [seconds for seconds, error in samples if not error]
+        errors = len(samples) - len(latencies)
+        error_rate = errors / len(samples) if samples else 0.0
+        return {
+            "samples": len(samples),
+            "errors": errors,
+            "error_rate": error_rate,
+            "latency": sum(latencies) / len(latencies) if latencies else None,
+            "healthy": len(samples) < _options["min_samples"]
+            or error_rate <= _options["max_error_rate"],
+        }
+
+    def rank(self, items: "Iterable[T]", alias: "Callable[[T], str]") -> "list[T]":
+        """
+        Order items by the health and then the latency of their source. Sources
+        not measured yet come after the measured healthy ones, ones that only
+        failed last among the healthy. Keeps the given order between equally
+        ranked items.
+        """
+        sources = {}
+
+        def key(item: T) -> "tuple[bool, float, bool]":
+            name = alias(item)
+            if name not in sources:
+                sources[name] = self.source(name)
+            source = sources[name]
+            latency = source["latency"]
+            if latency is None:
+                latency = math.inf
+            return (not source["healthy"], latency, bool(source["samples"]))
+
+        return sorted(items, key=key)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            aliases = sorted(self.samples)
+        return {alias: self.source(alias) for alias in aliases}
+
+
+stats = SourceStats()
@@ -0,0 +1,75 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the upstream request latency histogram.
+HTTP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class SyncStats:
+    """
+    Timers and counters for the phases of a sync, shared by the fetching
+    threads and the writing thread.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.phases: "dict[str, dict]" = {}
+        self.rows: "dict[str, int]" = {}
+        self.counters: "dict[str, int]" = {}
+        self.requests = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.latency = [0] * (len(HTTP_BUCKETS) + 1)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            phase = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+            phase["seconds"] += seconds
+            phase["calls"] += 1
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def upserted(self, model: str, rows: int) -> None:
+        with self._lock:
+            self.rows[model] = self.rows.get(model, 0) + rows
+
+    def request(self, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            self.latency[bisect.bisect_left(HTTP_BUCKETS, seconds)] += 1
+
+    def received(self, size: int) -> None:
+        with self._lock:
+            self.bytes_received += size
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "phases": {
+                    name: dict(phase) for name, phase in sorted(self.phases.items())
+                },
+                "rows": dict(sorted(self.rows.items())),
+                "counters": dict(sorted(self.counters.items())),
+                "http": {
+                    "requests": self.requests,
+                    "errors": self.errors,
+                    "bytes_received": self.bytes_received,
+                    "latency": [
+                        {"le": bound, "count": count}
+                        for bound, count in zip((*HTTP_BUCKETS, None), self.latency)
+                    ],
+                },
+            }
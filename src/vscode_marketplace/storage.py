@@ -17,14 +17,30 @@ class FileInfo:
         self.modified = None
 
 
+class WebProxyFile(File):
+    """
+    Streamed upstream response, its size is taken from the Content-Length
+    of bodies sent without a content encoding and None otherwise.
+    """
+
+    def __init__(self, response: requests.Response, name: str) -> None:
+        raw = response.raw
+        raw.decode_content = True
+        super().__init__(raw, name)
+        length = response.headers.get("content-length", "")
+        encoded = response.headers.get("content-encoding", "identity") != "identity"
+        self.size = int(length) if length.isdigit() and not encoded else None
+
+
 class WebProxyStorage(Storage):
-    def __init__(self, option=None):
+    def __init__(self, option=None, timeout: float = 10.0):
         # if not option:
         #   option = settings.CUSTOM_STORAGE_OPTIONS
-        pass
+        # Seconds to wait for the upstream to connect or send more data.
+        self.timeout = timeout
     def info(self, name:str):
         try:
-            resp = requests.head(name)
+            resp = requests.head(name, timeout=self.timeout)
             info = FileInfo()
             if not resp.ok:
                 return None
@@ -39,9 +55,10 @@ class WebProxyStorage(Storage):
         return name
 
     def open(self, name: str, mode: str = ...) -> File:
-        resp = requests.get(name, stream=True).raw
-        resp.decode_content = True
-        return resp
+        resp = requests.get(name, stream=True, timeout=self.timeout)
+        # Error pages are not the asset, let the caller try another source.
+        resp.raise_for_status()
+        return WebProxyFile(resp, name)
     
     def exists(self, name: str) -> bool:
         return self.info(name) is not None
@@ -1,3 +1,898 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from concurrent import futures
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.storage import storages
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+
+from generic_storage.models import Blob
+
+from . import (
+    bluegreen,
+    db,
+    icons,
+    mirror,
+    models,
+    retention,
+    sources,
+    upstream,
+    views,
+    vsix,
+)
+from .fake_upstream import FakeMarketplace, synthetic_catalog
+from .management.commands import clone_vscode_marketplace
+from .typing.gallery import AssetType
+
+REPLICA = "replica_test"
+LIVE = "live_test"
+
+
+def _run(started: datetime.datetime) -> models.SyncRun:
+    return models.SyncRun(
+        command="clone_vscode_marketplace",
+        status=models.SyncRun.SUCCEEDED,
+        started=started,
+        finished=started,
+    )
+
+
+class ReplicaRouterTests(TransactionTestCase):
+    """
+    Routing between the primary test database, the "readonly" alias which
+    mirrors it and a separately migrated SQLite file standing in for a
+    replica that can fall behind. The latter is added after the test
+    databases were set up and is not flushed between tests.
+    """
+
+    databases = {DEFAULT_DB_ALIAS, "readonly"}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.mkdtemp()
+        connections.settings[REPLICA] = connections.configure_settings(
+            {
+                DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+                REPLICA: {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": f"{cls.tmp}/replica.sqlite3",
+                },
+            }
+        )[REPLICA]
+        with override_settings(VSCODE_MARKETPLACE_REPLICAS={"aliases": []}):
+            call_command("migrate", database=REPLICA, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        shutil.rmtree(cls.tmp)
+        super().tearDownClass()
+
+    def setUp(self):
+        db._lag.clear()
+        replicas = override_settings(
+            VSCODE_MARKETPLACE_REPLICAS={
+                "aliases": ["readonly", REPLICA],
+                "max_lag": 30.0,
+                "check_interval": 0,
+            }
+        )
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+        self.addCleanup(models.SyncRun.objects.using(REPLICA).all().delete)
+        self.factory = RequestFactory()
+
+    def read_alias(self) -> str:
+        return models.GalleryExtension.objects.all().db
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_request_reads_use_replicas(self):
+        with mock.patch("random.choice", side_effect=lambda aliases: aliases[-1]):
+            with db.replica_reads():
+                self.assertEqual(self.read_alias(), REPLICA)
+                self.assertEqual(models.GalleryExtensionPublisher.objects.count(), 0)
+
+    def test_other_apps_and_writes_use_primary(self):
+        with db.replica_reads() as state:
+            self.assertEqual(User.objects.all().db, DEFAULT_DB_ALIAS)
+            self.assertFalse(state["wrote"])
+            self.assertEqual(
+                models.GalleryExtensionPublisher.objects.create(
+                    name="pub", display_name="Pub"
+                )._state.db,
+                DEFAULT_DB_ALIAS,
+            )
+            self.assertTrue(state["wrote"])
+
+    def test_transactions_read_from_primary(self):
+        with db.replica_reads(), transaction.atomic():
+            self.assertEqual(self.read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_lagging_replica_is_skipped(self):
+        now = timezone.now()
+        _run(now - datetime.timedelta(minutes=5)).save(using=DEFAULT_DB_ALIAS)
+        self.assertEqual(db.replica_lag("readonly"), 0)
+        self.assertGreaterEqual(db.replica_lag(REPLICA), 300)
+        with mock.patch("random.choice", side_effect=lambda aliases: aliases[-1]):
+            with db.replica_reads():
+                self.assertEqual(self.read_alias(), "readonly")
+        # Once the replica replayed the sync it serves reads again.
+        _run(now - datetime.timedelta(minutes=5)).save(using=REPLICA)
+        self.assertEqual(db.replica_lag(REPLICA), 0)
+        with mock.patch("random.choice", side_effect=lambda aliases: aliases[-1]):
+            with db.replica_reads():
+                self.assertEqual(self.read_alias(), REPLICA)
+
+    def test_unreachable_replicas_fall_back_to_primary(self):
+        with mock.patch.object(db, "replica_lag", return_value=float("inf")):
+            with db.replica_reads():
+                self.assertEqual(self.read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_lag_is_cached(self):
+        with override_settings(VSCODE_MARKETPLACE_REPLICAS={"check_interval": 60}):
+            with mock.patch.object(db, "replica_lag", return_value=0.0) as lag:
+                db.lag(REPLICA)
+                db.lag(REPLICA)
+        self.assertEqual(lag.call_count, 1)
+
+    def test_replicas_are_not_migrated(self):
+        router = db.ReplicaRouter()
+        self.assertFalse(router.allow_migrate(REPLICA, "vscode_marketplace"))
+        self.assertIsNone(router.allow_migrate(DEFAULT_DB_ALIAS, "vscode_marketplace"))
+
+    def middleware(self, view, request) -> "tuple[HttpResponse, list[str]]":
+        aliases = []
+
+        def get_response(request):
+            aliases.append(self.read_alias())
+            view()
+            return HttpResponse()
+
+        with mock.patch("random.choice", side_effect=lambda aliases: aliases[-1]):
+            return db.ReplicaMiddleware(get_response)(request), aliases
+
+    def test_middleware_pins_writers(self):
+        request = self.factory.post("/admin/")
+        response, aliases = self.middleware(
+            lambda: models.GalleryExtensionPublisher.objects.create(
+                name="pub", display_name="Pub"
+            ),
+            request,
+        )
+        self.assertEqual(aliases, [REPLICA])
+        self.assertIn(db.PIN_COOKIE, response.cookies)
+
+        request = self.factory.get("/items")
+        request.COOKIES[db.PIN_COOKIE] = "1"
+        response, aliases = self.middleware(lambda: None, request)
+        self.assertEqual(aliases, [DEFAULT_DB_ALIAS])
+        self.assertNotIn(db.PIN_COOKIE, response.cookies)
+
+    def test_middleware_pins_staff(self):
+        request = self.factory.get("/items")
+        request.user = mock.Mock(is_staff=True)
+        _, aliases = self.middleware(lambda: None, request)
+        self.assertEqual(aliases, [DEFAULT_DB_ALIAS])
+
+        request.user = mock.Mock(is_staff=False)
+        _, aliases = self.middleware(lambda: None, request)
+        self.assertEqual(aliases, [REPLICA])
+
+
+class ShadowDatabaseTests(TransactionTestCase):
+    """
+    Blue/green syncs into a shadow of a separately migrated SQLite file
+    standing in for the live database.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        connections.settings[LIVE] = connections.configure_settings(
+            {
+                DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+                LIVE: {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": f"{self.tmp}/db.sqlite3",
+                },
+            }
+        )[LIVE]
+        self.addCleanup(connections.settings.pop, LIVE)
+        self.addCleanup(connections.__delitem__, LIVE)
+        self.addCleanup(lambda: connections[LIVE].close())
+        with override_settings(VSCODE_MARKETPLACE_REPLICAS={"aliases": []}):
+            call_command("migrate", database=LIVE, verbosity=0)
+        self.publisher("old")
+        self.shadow = bluegreen.ShadowDatabase(LIVE)
+
+    def publisher(self, name: str, using: str = LIVE):
+        return models.GalleryExtensionPublisher.objects.using(using).create(
+            name=name, display_name=name
+        )
+
+    def names(self, using: str = LIVE) -> "list[str]":
+        return sorted(
+            models.GalleryExtensionPublisher.objects.using(using).values_list(
+                "name", flat=True
+            )
+        )
+
+    def test_only_the_catalog_is_published(self):
+        self.shadow.create()
+        with self.shadow.active():
+            self.assertEqual(
+                models.GalleryExtensionPublisher.objects.all().db, self.shadow.shadow
+            )
+            self.assertEqual(models.SyncRun.objects.all().db, DEFAULT_DB_ALIAS)
+            models.GalleryExtensionPublisher.objects.create(
+                name="new", display_name="new"
+            )
+            # Written to the live database while the sync runs.
+            User.objects.db_manager(LIVE).create_user("admin")
+            _run(timezone.now()).save(using=LIVE)
+            self.assertEqual(self.names(), ["old"])
+            self.shadow.check()
+        self.assertNotIn(self.shadow.shadow, connections.settings)
+        self.assertEqual(connections[LIVE].settings_dict["NAME"], self.shadow.live)
+        self.shadow.publish()
+        self.assertEqual(self.names(), ["new", "old"])
+        self.assertTrue(User.objects.using(LIVE).filter(username="admin").exists())
+        self.assertEqual(models.SyncRun.objects.using(LIVE).count(), 1)
+        self.assertFalse(os.path.exists(self.shadow.path))
+
+    def test_previous_generations_are_kept(self):
+        for name in ("first", "second"):
+            self.shadow.create()
+            with self.shadow.active():
+                self.publisher(name, self.shadow.shadow)
+            self.shadow.publish()
+        [generation] = self.shadow.generations()
+        self.assertTrue(os.path.isfile(self.shadow.live))
+        connections.settings["generation"] = {
+            **connections.settings[LIVE],
+            "NAME": generation,
+        }
+        try:
+            self.assertEqual(self.names("generation"), ["first", "old"])
+        finally:
+            connections["generation"].close()
+            del connections["generation"]
+            del connections.settings["generation"]
+
+    def test_shadows_that_lost_extensions_are_refused(self):
+        self.shadow.create()
+        self.shadow.live_extensions = 10
+        with self.shadow.active():
+            with self.assertRaises(bluegreen.ShadowError):
+                self.shadow.check()
+        self.shadow.discard()
+        self.assertEqual(self.names(), ["old"])
+        self.assertEqual(self.shadow.generations(), [])
+
+    def sync_files(self):
+        """
+        Sync into a shadow whose retention drops a version with a stored icon
+        and whose mirror stores the icon of the other, returns both names.
+        """
+        settings = override_settings(
+            STORAGES={
+                "blobs": {
+                    "BACKEND": "generic_storage.storage.ContentAddressedStorage",
+                    "OPTIONS": {"location": os.path.join(self.tmp, "blobs")},
+                },
+            }
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        now = timezone.now()
+        extension = models.GalleryExtension.objects.using(LIVE).create(
+            name="ext",
+            display_name="ext",
+            publisher_id=models.GalleryExtensionPublisher.objects.using(LIVE).get().pk,
+            released=now,
+            published=now,
+        )
+        old, new = (
+            models.GalleryExtensionVersion.objects.using(LIVE).create(
+                extension_id=extension.pk, version=version, last_updated=now
+            )
+            for version in ("1.0.0", "2.0.0")
+        )
+        dropped = storages["blobs"].save("icon", io.BytesIO(b"old"))
+        models.GalleryExtensionFile.objects.using(LIVE).create(
+            extension_version_id=old.pk,
+            type=AssetType.Icon.value,
+            storage="blobs",
+            file=dropped,
+        )
+        self.shadow.create()
+        with self.shadow.active():
+            retention.delete_versions([old.pk])
+            asset_mirror = mirror.AssetMirror("blobs", staging=self.tmp)
+            self.addCleanup(asset_mirror.close)
+            mirrored = storages["blobs"].save("icon", io.BytesIO(b"new"))
+            asset_mirror.commit(
+                models.GalleryExtensionFile(
+                    extension_version_id=new.pk, type=AssetType.Icon.value
+                ),
+                mirrored,
+                storages["blobs"].digest(mirrored),
+                3,
+            )
+        return dropped, mirrored
+
+    def test_files_are_released_once_published(self):
+        dropped, mirrored = self.sync_files()
+        self.assertTrue(storages["blobs"].exists(dropped))
+        self.shadow.publish()
+        self.assertFalse(storages["blobs"].exists(dropped))
+        self.assertTrue(storages["blobs"].exists(mirrored))
+        self.assertEqual(
+            list(Blob.objects.values_list("digest", "refcount")),
+            [(storages["blobs"].digest(mirrored), 1)],
+        )
+
+    def test_discarded_shadows_keep_the_live_files(self):
+        dropped, mirrored = self.sync_files()
+        self.shadow.discard()
+        self.assertTrue(storages["blobs"].exists(dropped))
+        self.assertFalse(storages["blobs"].exists(mirrored))
+        self.assertEqual(
+            list(Blob.objects.values_list("digest", "refcount")),
+            [(storages["blobs"].digest(dropped), 1)],
+        )
+        self.assertEqual(
+            models.GalleryExtensionFile.objects.using(LIVE).get().file.name, dropped
+        )
+
+
+class ExplainQueriesTests(TestCase):
+    def test_new_database_uses_indexes(self):
+        call_command("explain_queries", stdout=io.StringIO())
+
+    def test_analyzed_empty_database_uses_indexes(self):
+        call_command("explain_queries", analyze=True, stdout=io.StringIO())
+
+
+class SourceStatsTests(SimpleTestCase):
+    def test_rank(self):
+        stats = sources.SourceStats()
+        stats.record("local", 0.01)
+        stats.record("nfs", 0.5)
+        stats.record("failing", 0.01, error=True)
+        # Measured sources go first, unmeasured ones in the given order.
+        self.assertEqual(
+            stats.rank(["upstream", "failing", "nfs", "local", "s3"], str),
+            ["local", "nfs", "upstream", "s3", "failing"],
+        )
+
+
+class AssetViewTests(SimpleTestCase):
+    """
+    Serving assets from a local filesystem storage alias.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings = override_settings(
+            STORAGES={
+                "default": {
+                    "BACKEND": "django.core.files.storage.FileSystemStorage",
+                    "OPTIONS": {"location": os.path.join(self.tmp, "default")},
+                },
+                "local": {
+                    "BACKEND": "django.core.files.storage.FileSystemStorage",
+                    "OPTIONS": {"location": os.path.join(self.tmp, "local")},
+                },
+                "vscode_marketplace": {
+                    "BACKEND": "vscode_marketplace.storage.WebProxyStorage",
+                },
+            }
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        stats = mock.patch.object(sources, "stats", sources.SourceStats())
+        stats.start()
+        self.addCleanup(stats.stop)
+        self.data = os.urandom(3 * views.CHUNK_SIZE + 10)
+        self.name = storages["local"].save(
+            "pub/ext/extension.vsix", io.BytesIO(self.data)
+        )
+        self.factory = RequestFactory()
+
+    def asset(self, storage: str = "local", name: "str | None" = None):
+        return models.GalleryExtensionFile(
+            type=AssetType.VSIX.value, storage=storage, file=name or self.name
+        )
+
+    def get(self, files, **headers):
+        return views._find_asset(
+            self.factory.get("/", headers=headers),
+            "pub",
+            "ext",
+            "1.0.0",
+            AssetType.VSIX.value,
+            files,
+        )
+
+    def test_files_are_streamed(self):
+        response = self.get([self.asset()])
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response["Content-Length"], str(len(self.data)))
+        self.assertEqual(b"".join(response), self.data)
+        response.close()
+        self.assertEqual(sources.stats.source("local")["samples"], 1)
+
+    def test_failing_sources_are_failed_over(self):
+        missing = self.asset("default", "pub/ext/missing.vsix")
+        with mock.patch("builtins.print"):
+            response = self.get([missing, self.asset()])
+        self.assertEqual(b"".join(response), self.data)
+        response.close()
+        self.assertEqual(sources.stats.source("default")["errors"], 1)
+
+    def test_ranges(self):
+        response = self.get([self.asset()], Range="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.data)}")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(b"".join(response), self.data[10:20])
+        response = self.get([self.asset()], Range="bytes=-5")
+        self.assertEqual(b"".join(response), self.data[-5:])
+        response = self.get([self.asset()], Range=f"bytes={views.CHUNK_SIZE}-")
+        self.assertEqual(b"".join(response), self.data[views.CHUNK_SIZE :])
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response = self.get([self.asset()], Range=f"bytes={len(self.data)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.data)}")
+        for headers in (
+            {"Range": "bytes=0-1,5-6"},
+            {"Range": "items=0-1"},
+            {"Range": "bytes=5-1"},
+            {"Range": "bytes=0-1", "If-Range": '"etag"'},
+        ):
+            response = self.get([self.asset()], **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response), self.data)
+
+    def test_upstream_files_are_streamed(self):
+        server = FakeMarketplace([], asset_size=3 * views.CHUNK_SIZE + 10)
+        server.start()
+        self.addCleanup(server.stop)
+        url = f"{server.url}/assets/pub/ext/1.0.0/vsix"
+        upstream = self.asset("vscode_marketplace", url)
+        for headers in ({}, {"Range": "bytes=10-19"}):
+            response = self.get([upstream], **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Length"], str(server.asset_size))
+            self.assertNotIn("Accept-Ranges", response)
+            self.assertEqual(b"".join(response), server.asset(urlsplit(url).path))
+            response.close()
+
+        # Without a length, like for encoded bodies, the response has none.
+        content = storages["vscode_marketplace"].open(url)
+        content.size = None
+        with mock.patch.object(
+            storages["vscode_marketplace"], "open", return_value=content
+        ):
+            response = self.get([upstream])
+        self.assertNotIn("Content-Length", response)
+        self.assertEqual(b"".join(response), server.asset(urlsplit(url).path))
+        response.close()
+
+    def test_closing_the_response_closes_the_file(self):
+        content = storages["local"].open(self.name, "rb")
+        with mock.patch.object(storages["local"], "open", return_value=content) as open:
+            response = self.get([self.asset()])
+            next(iter(response))
+            response.close()
+        open.assert_called_once()
+        self.assertTrue(content.closed)
+
+
+class ArchiveCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache = vsix.ArchiveCache(maxsize=2)
+        self.addCleanup(self.cache.clear)
+
+    def package(self, name: str, readme: bytes = b"# readme") -> str:
+        path = os.path.join(self.tmp, name)
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("extension/package.json", "{}")
+            archive.writestr("extension/README.md", readme)
+        return path
+
+    def test_archives_are_reused(self):
+        path = self.package("a.vsix")
+        self.assertIs(self.cache.get(path), self.cache.get(path))
+
+    def test_evicted_archives_are_closed(self):
+        first = self.cache.get(self.package("a.vsix"))
+        self.cache.get(self.package("b.vsix"))
+        self.cache.get(self.package("c.vsix"))
+        self.assertTrue(first.closed)
+
+    def test_open_members_keep_archives_open(self):
+        first = self.cache.get(self.package("a.vsix"))
+        member = first.open("Microsoft.VisualStudio.Services.Content.Details")
+        self.cache.get(self.package("b.vsix"))
+        self.cache.get(self.package("c.vsix"))
+        self.assertFalse(first.closed)
+        self.assertEqual(member.read(), b"# readme")
+        member.close()
+        self.assertTrue(first.closed)
+
+    def test_changed_files_replace_their_archive(self):
+        path = self.package("a.vsix")
+        first = self.cache.get(path)
+        stat = os.stat(path)
+        self.package("a.vsix", b"# changed")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        second = self.cache.get(path)
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+        self.assertEqual(second.read("extension/README.md"), b"# changed")
+
+
+class AssetMirrorTests(SimpleTestCase):
+    """
+    Downloads into the staging directory from the fake upstream, which sends
+    ETags and honours If-Range.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.server = FakeMarketplace([], asset_size=10_000)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.mirror = mirror.AssetMirror(staging=self.tmp, retries=1)
+        self.addCleanup(self.mirror.close)
+        self.asset = models.GalleryExtensionFile(
+            type="Microsoft.VisualStudio.Services.Icons.Default",
+            source=f"{self.server.url}/assets/pub/ext/1.0.0/icon",
+        )
+        self.path = self.mirror.staging_path(self.asset)
+
+    def data(self) -> bytes:
+        return self.server.asset("/assets/pub/ext/1.0.0/icon")
+
+    def partial(self, size: int) -> None:
+        """
+        Leave the first `size` bytes of a download with its validator behind.
+        """
+        self.mirror.download(self.asset)
+        with open(self.path, "r+b") as fh:
+            fh.truncate(size)
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as fh:
+            return fh.read()
+
+    def test_downloads_resume(self):
+        self.partial(1000)
+        with open(self.path, "r+b") as fh:
+            fh.write(b"x" * 1000)
+        self.assertEqual(self.mirror.download(self.asset), (self.path, 10_000))
+        # Only the missing bytes were fetched and appended.
+        self.assertEqual(self.read(), b"x" * 1000 + self.data()[1000:])
+
+    def test_changed_upstream_restarts(self):
+        self.partial(1000)
+        self.server.asset_size = 12_000
+        self.assertEqual(self.mirror.download(self.asset), (self.path, 12_000))
+        self.assertEqual(self.read(), self.data())
+
+    def test_partial_without_validator_restarts(self):
+        self.partial(1000)
+        os.unlink(f"{self.path}.validator")
+        self.mirror.download(self.asset)
+        self.assertEqual(self.read(), self.data())
+
+    def test_complete_partial_is_verified(self):
+        self.partial(10_000)
+        self.asset.digest = hashlib.sha256(self.data()).hexdigest()
+        count = self.server.requests
+        _, path, digest, size = self.mirror.fetch(self.asset)
+        self.assertEqual((digest, size), (self.asset.digest, 10_000))
+        self.assertEqual(self.server.requests, count + 1)
+
+    def test_oversized_partial_restarts(self):
+        self.partial(10_000)
+        self.server.asset_size = 8_000
+        with open(self.path, "ab") as fh:
+            fh.write(b"x" * 2_000)
+        self.assertEqual(self.mirror.download(self.asset), (self.path, 8_000))
+        self.assertEqual(self.read(), self.data())
+
+    def test_corrupt_partial_is_downloaded_again(self):
+        self.partial(10_000)
+        with open(self.path, "r+b") as fh:
+            fh.write(b"x" * 1000)
+        self.asset.digest = hashlib.sha256(self.data()).hexdigest()
+        _, path, digest, size = self.mirror.fetch(self.asset)
+        self.assertEqual(digest, self.asset.digest)
+        self.assertEqual(self.read(), self.data())
+
+    def test_digest_mismatch(self):
+        self.asset.digest = "0" * 64
+        with self.assertRaises(mirror.MirrorError):
+            self.mirror.fetch(self.asset)
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_hash_workers_are_spawned(self):
+        path, expected = self.mirror.download(self.asset)
+        with futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as hashers:
+            digest, size = self.mirror.verify(self.asset, path, expected, hashers)
+        self.assertEqual(digest, hashlib.sha256(self.data()).hexdigest())
+
+
+class CloneTests(TestCase):
+    """
+    clone_vscode_marketplace against a fake upstream serving a synthetic
+    catalog of 20 extensions with 3 versions and 6 assets each.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings = override_settings(
+            STORAGES={
+                "default": {
+                    "BACKEND": "django.core.files.storage.FileSystemStorage",
+                    "OPTIONS": {"location": os.path.join(self.tmp, "default")},
+                },
+                "vscode_marketplace": {
+                    "BACKEND": "vscode_marketplace.storage.WebProxyStorage",
+                },
+                "blobs": {
+                    "BACKEND": "generic_storage.storage.ContentAddressedStorage",
+                    "OPTIONS": {"location": os.path.join(self.tmp, "blobs")},
+                },
+            },
+            VSCODE_MARKETPLACE_MIRROR_STAGING=os.path.join(self.tmp, "staging"),
+            VSCODE_MARKETPLACE_RETENTION={},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.server = FakeMarketplace(synthetic_catalog(20), asset_size=1000)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def clone(self, **options) -> models.SyncRun:
+        command = clone_vscode_marketplace.Command(
+            stdout=io.StringIO(), stderr=io.StringIO()
+        )
+        call_command(
+            command,
+            host=self.server.url,
+            **{"mode": "catalog", "restart": True, "concurrency": 2, **options},
+        )
+        self.assertEqual(command.run.status, models.SyncRun.SUCCEEDED)
+        return command.run
+
+    def test_catalog(self):
+        run = self.clone()
+        self.assertEqual((run.extensions, run.unchanged), (20, 0))
+        self.assertEqual(models.GalleryExtension.objects.count(), 20)
+        self.assertEqual(models.GalleryExtensionVersion.objects.count(), 60)
+        self.assertEqual(models.GalleryExtensionFile.objects.count(), 360)
+        self.assertEqual(models.GalleryExtensionPublisher.objects.count(), 20)
+
+        run = self.clone()
+        self.assertEqual((run.extensions, run.unchanged), (0, 20))
+        self.assertEqual(models.GalleryExtensionVersion.objects.count(), 60)
+
+    def test_broken_off_responses_are_retried(self):
+        self.server.truncate_rate = 0.3
+        self.server._random.seed(0)
+        with mock.patch.object(upstream.GalleryClient, "pause"):
+            run = self.clone(batch_size=5, concurrency=1)
+        self.assertGreater(run.stats["counters"]["batches_retried"], 0)
+        self.assertEqual(run.extensions, 20)
+        self.assertEqual(models.GalleryExtensionVersion.objects.count(), 60)
+        self.assertEqual(models.GalleryExtensionFile.objects.count(), 360)
+
+    def test_incremental(self):
+        self.clone(mode="incremental")
+        self.assertEqual(models.GalleryExtension.objects.count(), 20)
+
+        self.server.catalog = synthetic_catalog(25)
+        self.server.catalog[0]["lastUpdated"] = "2021-01-01T00:00:00Z"
+        self.clone(mode="incremental")
+        self.assertEqual(models.GalleryExtension.objects.count(), 25)
+        state = models.SyncCheckpoint.objects.get(name="incremental").state
+        # The newest extension of the previous run is listed again as the
+        # watermark overlaps, the older ones are not.
+        self.assertEqual(
+            (state["inserted"], state["updated"], state["unchanged"]), (5, 1, 1)
+        )
+        self.assertEqual(state["watermark"], "2021-01-01T00:00:00+00:00")
+
+    def test_retention(self):
+        self.server.catalog = synthetic_catalog(20, versions=5)
+        self.clone()
+        self.assertEqual(models.GalleryExtensionVersion.objects.count(), 100)
+
+        self.clone(keep_stable=1, keep_prerelease=0)
+        self.assertEqual(models.GalleryExtensionVersion.objects.count(), 20)
+        self.assertEqual(models.GalleryExtensionFile.objects.count(), 120)
+        for extension in models.GalleryExtension.objects.all():
+            self.assertEqual(
+                list(extension.versions.values_list("version", flat=True)),
+                [
+                    self.server.catalog[int(extension.name[9:])]["versions"][0][
+                        "version"
+                    ]
+                ],
+            )
+
+    def test_spec(self):
+        spec = {
+            "allow": {
+                "extensions": [
+                    "publisher1.extension1",
+                    "publisher2.extension2",
+                    "publisher3.extension3",
+                ]
+            },
+            "deny": {"publishers": ["publisher3"]},
+        }
+        path = os.path.join(self.tmp, "spec.json")
+        with open(path, "w") as fh:
+            json.dump(spec, fh)
+        self.clone(mode="spec", spec=path)
+        self.assertEqual(
+            sorted(models.GalleryExtension.objects.values_list("name", flat=True)),
+            ["extension1", "extension2"],
+        )
+
+    def test_mirror_assets(self):
+        run = self.clone(mirror_assets=["Icon"], mirror_workers=2)
+        self.assertEqual(run.stats["counters"]["assets_mirrored"], 60)
+        self.assertEqual(run.stats["counters"]["assets_failed"], 0)
+        blobs = models.GalleryExtensionFile.objects.filter(storage="blobs")
+        self.assertEqual(blobs.count(), 60)
+        for asset in blobs:
+            data = self.server.asset(urlsplit(asset.source).path)
+            self.assertEqual(asset.digest, hashlib.sha256(data).hexdigest())
+            self.assertEqual(asset.size, 1000)
+            with storages["blobs"].open(asset.file.name) as fh:
+                self.assertEqual(fh.read(), data)
+
+        # Mirrored assets are not pending anymore.
+        run = self.clone(mirror_assets=["Icon"], mirror_workers=2)
+        self.assertEqual(run.stats["counters"]["assets_mirrored"], 0)
+
+    def test_import_stores_retained_assets_only(self):
+        self.clone(mirror_assets=["Icon"], mirror_workers=2)
+        output = os.path.join(self.tmp, "bundle")
+        call_command("export_gallery", output, stdout=io.StringIO())
+        models.GalleryExtension.objects.all().delete()
+        Blob.objects.all().delete()
+        shutil.rmtree(os.path.join(self.tmp, "blobs"))
+
+        with override_settings(VSCODE_MARKETPLACE_RETENTION={"stable": 1}):
+            call_command("import_gallery", output, stdout=io.StringIO())
+            # Unchanged extensions are not written again.
+            call_command("import_gallery", output, stdout=io.StringIO())
+        self.assertEqual(models.GalleryExtensionVersion.objects.count(), 20)
+        blobs = models.GalleryExtensionFile.objects.filter(storage="blobs")
+        self.assertEqual(blobs.count(), 20)
+        self.assertEqual(
+            sorted(Blob.objects.values_list("digest", "refcount")),
+            sorted((digest, 1) for digest in blobs.values_list("digest", flat=True)),
+        )
+
+
+@unittest.skipUnless(icons.available(), "requires Pillow")
+class IconCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        cache = override_settings(
+            VSCODE_MARKETPLACE_ICON_CACHE={"location": self.tmp, "max_size": 2**20}
+        )
+        cache.enable()
+        self.addCleanup(cache.disable)
+        icons._usage.clear()
+        self.addCleanup(icons._usage.clear)
+
+    def png(self, color: "tuple[int, int, int]") -> bytes:
+        out = io.BytesIO()
+        icons.Image.new("RGB", (256, 256), color).save(out, "PNG")
+        return out.getvalue()
+
+    def test_hits_do_not_load_the_original(self):
+        load = mock.Mock(return_value=self.png((255, 0, 0)))
+        first = icons.derivative("icon", 64, "png", load)
+        self.assertEqual(icons.derivative("icon", 64, "png", load), first)
+        self.assertEqual(load.call_count, 1)
+
+    def test_usage_is_tracked_without_rescanning(self):
+        with mock.patch.object(icons, "_scan", wraps=icons._scan) as scan:
+            for index in range(5):
+                icons.derivative(
+                    f"icon{index}", 64, "png", lambda: self.png((index, 0, 0))
+                )
+        self.assertEqual(scan.call_count, 1)
+        self.assertEqual(
+            icons._usage[self.tmp],
+            sum(entry[1] for entry in icons._scan(self.tmp)),
+        )
+
+    def test_originals_are_read_from_the_storage(self):
+        settings = override_settings(
+            STORAGES={
+                "local": {
+                    "BACKEND": "django.core.files.storage.FileSystemStorage",
+                    "OPTIONS": {"location": self.tmp},
+                }
+            }
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        storage = storages["local"]
+        icon = models.GalleryExtensionFile(
+            type=AssetType.Icon.value,
+            storage="local",
+            file=storage.save("icon.png", io.BytesIO(self.png((0, 0, 255)))),
+        )
+        # A response to the request would be partial or a redirect.
+        request = RequestFactory().get("/", headers={"Range": "bytes=0-9"})
+        with mock.patch.object(
+            views, "_asset_files", return_value=[icon]
+        ), mock.patch.object(
+            storage, "redirect_url", return_value="https://objects/icon", create=True
+        ):
+            response = views._icon_derivative(request, "pub", "ext", "1.0.0", 64)
+        image = icons.Image.open(io.BytesIO(b"".join(response)))
+        response.close()
+        self.assertEqual(image.size, (64, 64))
+
+    def test_least_recently_used_are_evicted(self):
+        size = os.path.getsize(
+            icons.derivative("a", 64, "png", lambda: self.png((1, 0, 0)))
+        )
+        with override_settings(
+            VSCODE_MARKETPLACE_ICON_CACHE={
+                "location": self.tmp,
+                "max_size": size * 5 // 2,
+            }
+        ):
+            paths = [icons.cache_path(key, 64, "png") for key in "abc"]
+            os.utime(paths[0], (0, 0))
+            icons.derivative("b", 64, "png", lambda: self.png((1, 0, 0)))
+            icons.derivative("c", 64, "png", lambda: self.png((1, 0, 0)))
+        self.assertEqual([os.path.exists(path) for path in paths], [False, True, True])
@@ -46,6 +46,17 @@ class AssetType(str, Enum):
             case _:
                 return None
 
+    def compressible(self):
+        return self in _COMPRESSIBLE_ASSETS
+
+
+_COMPRESSIBLE_ASSETS = (
+    AssetType.Details,
+    AssetType.Changelog,
+    AssetType.License,
+    AssetType.Manifest,
+)
+
 
 class PropertyType(str, Enum):
     Dependency = "Microsoft.VisualStudio.Code.ExtensionDependencies"
@@ -238,6 +249,27 @@ class GalleryCriterium(TypedDict):
 
 
 VSCODE_INSTALLATION_TARGET = "Microsoft.VisualStudio.Code"
+# https://code.visualstudio.com/api/references/extension-manifest#extension-manifest
+CATEGORIES = [
+    "Azure",
+    "Data Science",
+    "Debuggers",
+    "Education",
+    "Extension Packs",
+    "Formatters",
+    "Keymaps",
+    "Language Packs",
+    "Linters",
+    "Machine Learning",
+    "Notebooks",
+    "Programming Languages",
+    "SCM Providers",
+    "Snippets",
+    "Testing",
+    "Themes",
+    "Visualization",
+    "Other",
+]
 DefaultPageSize = 10
 
 
@@ -0,0 +1,321 @@
+import codecs
+import json
+import random
+import threading
+import time
+from typing import Iterable, Iterator, cast
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .stats import SyncStats
+from .typing import gallery
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """
+    Spaces calls so no more than `rate` happen per second across threads.
+    """
+
+    def __init__(self, rate: "float | None" = None) -> None:
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(self._next, now)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class RetryableError(requests.HTTPError):
+    retry_after: "float | None"
+
+    def __init__(self, *args, retry_after: "float | None" = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.retry_after = retry_after
+
+
+class IncompleteResponse(requests.RequestException):
+    """
+    The connection failed while a streamed response was being read, after
+    part of it may already have been consumed.
+    """
+
+
+class ExtensionStream:
+    """
+    Iterate the extensions of an extensionquery response as they arrive.
+
+    Only the extension being decoded is held in memory, the resultMetadata of
+    every result is collected in `metadata` while iterating.
+    """
+
+    metadata: "list[list[gallery.GalleryExtensionQueryResultMetadata]]"
+
+    def __init__(self, chunks: "Iterable[bytes]") -> None:
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self.metadata = []
+
+    def _fill(self, minimum: int = 1) -> bool:
+        # Read until `minimum` more characters are buffered, returns False
+        # once the stream is exhausted and nothing could be added.
+        if self._pos > 2**16:
+            self._buf = self._buf[self._pos :]
+            self._pos = 0
+        size = len(self._buf)
+        while len(self._buf) < size + minimum and not self._eof:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._buf += self._decoder.decode(b"", final=True)
+                self._eof = True
+            else:
+                self._buf += self._decoder.decode(chunk)
+        return len(self._buf) > size
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of extensionquery response")
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise ValueError(
+                f"Expected {char!r} in extensionquery response, got {self._peek()!r}"
+            )
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+                # A number at the end of the buffer may continue in the next chunk.
+                if (
+                    end < len(self._buf)
+                    or self._eof
+                    or isinstance(value, (dict, list, str))
+                ):
+                    self._pos = end
+                    return value
+                self._fill()
+            except json.JSONDecodeError:
+                # Grow the buffer geometrically so large values are not
+                # re-parsed once per network chunk.
+                if not self._fill(max(len(self._buf) - self._pos, 2**12)):
+                    raise
+
+    def _separator(self, end: str) -> bool:
+        char = self._peek()
+        self._pos += 1
+        if char == ",":
+            return True
+        if char == end:
+            return False
+        raise ValueError(f"Unexpected {char!r} in extensionquery response")
+
+    def _members(self) -> "Iterator[str]":
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            yield key
+            if not self._separator("}"):
+                return
+
+    def _items(self) -> "Iterator[None]":
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield
+            if not self._separator("]"):
+                return
+
+    def __iter__(self) -> "Iterator[gallery.GalleryExtension]":
+        for key in self._members():
+            if key != "results":
+                self._value()
+                continue
+            for _ in self._items():
+                metadata = []
+                for key in self._members():
+                    if key == "extensions":
+                        for _ in self._items():
+                            yield self._value()
+                    elif key == "resultMetadata":
+                        metadata = self._value()
+                    else:
+                        self._value()
+                self.metadata.append(metadata)
+
+
+class GalleryClient:
+    """
+    Thread safe client for an upstream extensionquery endpoint.
+
+    Connections are pooled up to `concurrency`, calls are rate limited and
+    retried with exponential backoff on connection errors, 429 and 5xx.
+    Streamed responses breaking off raise IncompleteResponse, callers start
+    over with pause() between attempts.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        concurrency: int = 4,
+        rate: "float | None" = None,
+        retries: int = 5,
+        backoff: float = 0.5,
+        timeout: float = 120,
+        stats: "SyncStats | None" = None,
+    ) -> None:
+        self.api_url = api_url
+        self.stats = stats
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(concurrency, 1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(
+        self,
+        query: gallery.GalleryExtensionQuery,
+        api_version: str = "3.0-preview.1",
+        stream: bool = False,
+    ) -> requests.Response:
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            started = time.perf_counter()
+            try:
+                resp = self.session.post(
+                    self.api_url,
+                    json=query,
+                    headers={"accept": f"application/json;api-version={api_version}"},
+                    timeout=self.timeout,
+                    stream=stream,
+                )
+                if self.stats:
+                    self.stats.request(time.perf_counter() - started, error=not resp.ok)
+                if resp.status_code in RETRY_STATUS:
+                    retry_after = resp.headers.get("Retry-After")
+                    resp.close()
+                    raise RetryableError(
+                        f"{resp.status_code} from {self.api_url}",
+                        response=resp,
+                        retry_after=(
+                            float(retry_after)
+                            if retry_after and retry_after.isdigit()
+                            else None
+                        ),
+                    )
+                resp.raise_for_status()
+                return resp
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+                RetryableError,
+            ) as e:
+                if self.stats and not isinstance(e, RetryableError):
+                    self.stats.request(time.perf_counter() - started, error=True)
+                if attempt >= self.retries:
+                    raise
+                self.pause(attempt, getattr(e, "retry_after", None))
+        raise AssertionError("unreachable")
+
+    def pause(self, attempt: int, retry_after: "float | None" = None) -> None:
+        """
+        Wait before retrying a failed call for the `attempt`th time.
+        """
+        delay = retry_after or self.backoff * 2**attempt
+        time.sleep(delay + random.uniform(0, self.backoff))
+
+    def query(
+        self, query: gallery.GalleryExtensionQuery, api_version: str = "3.0-preview.1"
+    ) -> gallery.GalleryQueryResult:
+        resp = self.post(query, api_version)
+        if not self.stats:
+            return cast(gallery.GalleryQueryResult, resp.json())
+        self.stats.received(len(resp.content))
+        with self.stats.phase("decode"):
+            return cast(gallery.GalleryQueryResult, resp.json())
+
+    def extensions(
+        self,
+        query: gallery.GalleryExtensionQuery,
+        api_version: str = "3.0-preview.1",
+        chunk_size: int = 2**16,
+    ) -> "Iterator[gallery.GalleryExtension]":
+        """
+        Stream the extensions of a query one at a time instead of decoding
+        the whole response.
+        """
+        resp = self.post(query, api_version, stream=True)
+        try:
+            if not self.stats:
+                yield from ExtensionStream(resp.iter_content(chunk_size))
+                return
+            # Reading and decoding interleave, time spent waiting for the
+            # network is taken out of the decode time.
+            waited = 0.0
+
+            def chunks():
+                nonlocal waited
+                it = resp.iter_content(chunk_size)
+                while True:
+                    started = time.perf_counter()
+                    chunk = next(it, None)
+                    waited += time.perf_counter() - started
+                    if chunk is None:
+                        return
+                    self.stats.received(len(chunk))
+                    yield chunk
+
+            stream = iter(ExtensionStream(chunks()))
+            decoding = 0.0
+            while True:
+                started = time.perf_counter()
+                ext = next(stream, None)
+                decoding += time.perf_counter() - started
+                if ext is None:
+                    break
+                yield ext
+            self.stats.add_time("http_read", waited)
+            self.stats.add_time("decode", decoding - waited)
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            if self.stats:
+                self.stats.count("incomplete_responses")
+            raise IncompleteResponse(str(e), response=resp) from e
+        finally:
+            resp.close()
+
+    def close(self) -> None:
+        self.session.close()
@@ -25,6 +25,7 @@ register_converter(SemVerConverter, 'semver')
 urlpatterns = [
     path("items", views.items, name='items'),
     path('assets/extensions/<str:publisher>/<str:extension>/<semver:version>/<str:asset>', views.assets_extensions),
+    path("_stats/sources", views.source_stats, name="source_stats"),
     path("_apis/", include(api))
 ]
 
@@ -1,3 +1,4 @@
+import hashlib
 from pathlib import Path
 from urllib.parse import unquote, urlparse
 
@@ -7,6 +8,16 @@ def filename_from_url(url: str):
     file_path = unquote(Path(url_parsed.path).name)
     return file_path
 
+
+def hash_file(path: str, algorithm: str = "sha256") -> "tuple[str, int]":
+    hasher = hashlib.new(algorithm)
+    size = 0
+    with open(path, "rb") as fh:
+        while chunk := fh.read(2**20):
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size
+
 ## https://stackoverflow.com/questions/35640871/is-is-possible-to-clean-a-verbose-python-regex-before-printing-it
 import re
 
@@ -1,10 +1,27 @@
 from io import StringIO
-from django.http import HttpResponse, HttpRequest
+from django.core.files.storage import DEFAULT_STORAGE_ALIAS
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.template import loader
+from django.utils.cache import patch_vary_headers
 import semver
 
+from generic_storage.compression import (
+    ENCODINGS,
+    NotAcceptable,
+    negotiate,
+    variant_name,
+)
 from vscode_marketplace.typing.gallery import AssetType
-from . import models, utils
+from . import icons, models, sources, utils
+from .vsix import SERVED_ASSETS, open_asset
 
 
 def items(request: HttpRequest):
@@ -37,12 +54,181 @@ text/markdown                     md
     )
 )
 
-def assets_extensions(
-    request, publisher: str, extension: str, version: semver, asset: str
+def _source(_asset: models.GalleryExtensionFile) -> str:
+    return _asset.storage or DEFAULT_STORAGE_ALIAS
+
+
+def _local_path(file) -> "str | None":
+    try:
+        return file.storage.path(file.name)
+    except NotImplementedError:
+        return None
+
+
+def _precompressed(file) -> "list[str]":
+    # Variants are only written next to files on local storages, never probe
+    # remote ones as that would cost a round trip per request.
+    if not _local_path(file):
+        return []
+    return [
+        encoding
+        for encoding in ENCODINGS
+        if file.storage.exists(variant_name(file.name, encoding))
+    ]
+
+
+# Read from a source before its response is returned, the rest is streamed.
+CHUNK_SIZE = 64 * 2**10
+
+
+def _stream(content, first: bytes, remaining: "int | None"):
+    """
+    Yield the chunk read up front and then up to `remaining` bytes in total,
+    or all of the content if None, closing the content once done or when the
+    response is closed.
+    """
+    try:
+        first = first[:remaining]
+        yield first
+        if remaining is not None:
+            remaining -= len(first)
+        while remaining is None or remaining > 0:
+            chunk = content.read(
+                CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            )
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        content.close()
+
+
+def _byte_range(value: str, size: int) -> "tuple[int, int] | None":
+    """
+    First and last byte of the file a `bytes` Range header asks for, None if
+    the header is to be ignored: malformed, other units or several ranges.
+    Raises ValueError if the range starts past the end of the file.
+    """
+    unit, _, spec = value.partition("=")
+    first, dash, last = spec.strip().partition("-")
+    if unit.strip() != "bytes" or not dash or not (first + last).isdigit():
+        return None
+    if not first:
+        # The last `last` bytes.
+        if not int(last) or not size:
+            raise ValueError(f"Unsatisfiable range {value}")
+        return max(size - int(last), 0), size - 1
+    if last and int(last) < int(first):
+        return None
+    if int(first) >= size:
+        raise ValueError(f"Unsatisfiable range {value}")
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+
+def _serve_file(
+    request, _asset: models.GalleryExtensionFile, asset: str, filename: str
 ):
-    disposition = "inline"
-    filename = f"{publisher}_{extension}_v{version}"
+    mimetype = None
+    if _asset.source:
+        source = utils.filename_from_url(_asset.source)
+        mimetype = _MIMETYPE.guess_type(source)[0]
+    # Object stores can hand the download off to a presigned URL, they check
+    # the file exists so a missing one fails over like a failed read.
+    redirect_url = getattr(_asset.file.storage, "redirect_url", None)
+    if redirect_url:
+        url = redirect_url(
+            _asset.file.name, filename, mimetype or AssetType.mimetype(asset)
+        )
+        if url:
+            return HttpResponseRedirect(url)
+    compressible = AssetType.compressible(asset)
+    encoding = None
+    if compressible:
+        try:
+            encoding = negotiate(
+                request.headers.get("Accept-Encoding"), _precompressed(_asset.file)
+            )
+        except NotAcceptable:
+            response = HttpResponse(status=406)
+            patch_vary_headers(response, ["Accept-Encoding"])
+            return response
+    if encoding:
+        content = _asset.file.storage.open(variant_name(_asset.file.name, encoding))
+    else:
+        content = _asset.file.storage.open(_asset.file.name, "rb")
+    byte_range = requested = None
+    try:
+        # Ranges are only served of the identity encoding of files that can
+        # seek and whose size is known, not of those streamed from upstream,
+        # and in full if the client makes them conditional as no validators
+        # are sent.
+        ranges = not encoding and content.seekable()
+        if ranges and "If-Range" not in request.headers:
+            requested = request.headers.get("Range")
+        if requested and content.size is not None:
+            try:
+                byte_range = _byte_range(requested, content.size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{content.size}"
+                content.close()
+                return response
+        if byte_range:
+            content.seek(byte_range[0])
+        first = content.read(CHUNK_SIZE)
+        size = content.size
+    except BaseException:
+        content.close()
+        raise
+    length = byte_range[1] - byte_range[0] + 1 if byte_range else size
+    response = StreamingHttpResponse(
+        _stream(content, first, length),
+        status=206 if byte_range else 200,
+        content_type=mimetype or AssetType.mimetype(asset),
+    )
+    if length is not None:
+        response["Content-Length"] = length
+    if byte_range:
+        response["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+    response["Content-Disposition"] = f"inline; filename={filename}"
+    if encoding:
+        response["Content-Encoding"] = encoding
+    elif ranges and size is not None:
+        response["Accept-Ranges"] = "bytes"
+    if compressible:
+        patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+def _serve_vsix_member(vsix: models.GalleryExtensionFile, asset: str, filename: str):
+    opened = open_asset(_local_path(vsix.file), asset)
+    if not opened:
+        return None
+    member, size, fh = opened
+    try:
+        first = fh.read(CHUNK_SIZE)
+    except BaseException:
+        fh.close()
+        raise
+    mimetype = _MIMETYPE.guess_type(member)[0]
+    response = StreamingHttpResponse(
+        _stream(fh, first, size),
+        content_type=mimetype or AssetType.mimetype(asset),
+    )
+    response["Content-Length"] = size
+    response["Content-Disposition"] = f"inline; filename={filename}"
+    return response
 
+
+def _asset_files(
+    publisher: str, extension: str, version: semver, asset: str
+) -> "list[models.GalleryExtensionFile]":
+    """
+    The stored files an asset can be served from: local copies, then local
+    VSIX packages to extract it from and upstream last.
+    """
     ext = models.GalleryExtension.objects.get_queryset().filter(
         publisher__name=publisher, name=extension
     )[:1]
@@ -50,28 +236,119 @@ def assets_extensions(
         extension_id=ext.values("id"), version=version
     )[:1]
 
-    suffix = None
-    if suffix:
-        filename = f"{filename}.{suffix}"
-        default_mimetype = _MIMETYPE.guess_type(filename)[0]
-    else:
-        default_mimetype = AssetType.mimetype(asset)
-
+    types = [asset]
+    if asset in SERVED_ASSETS:
+        types.append(AssetType.VSIX.value)
+    local, vsix, remote = [], [], []
     for _asset in models.GalleryExtensionFile.objects.filter(
-        extension_version_id=vers.values("id"), type=asset
+        extension_version_id=vers.values("id"), type__in=types
     ):
-        if _asset.file:
-            if _asset.source:
-                source = utils.filename_from_url(_asset.source)
-                mimetype = _MIMETYPE.guess_type(source)[0]
-            try:
-                response = HttpResponse(
-                    _asset.file, content_type=mimetype or default_mimetype
-                )
-                response["Content-Disposition"] = f"{disposition}; filename={filename}"
+        if not _asset.file:
+            continue
+        is_local = _local_path(_asset.file) is not None
+        if _asset.type != asset:
+            if is_local:
+                vsix.append(_asset)
+        elif is_local:
+            local.append(_asset)
+        else:
+            remote.append(_asset)
+    return local + vsix + remote
+
+
+def _find_asset(
+    request,
+    publisher: str,
+    extension: str,
+    version: semver,
+    asset: str,
+    files: "list[models.GalleryExtensionFile] | None" = None,
+) -> "HttpResponse | None":
+    filename = f"{publisher}_{extension}_v{version}"
+    if files is None:
+        files = _asset_files(publisher, extension, version, asset)
+
+    # Sources are tried fastest healthy first. Each is opened and its first
+    # chunk read while timed, a source failing or timing out before that is
+    # failed over to the next one, the rest of the content is streamed. Sources
+    # not measured yet follow the measured healthy ones, local copies, then
+    # members of a local VSIX and upstream last among equally ranked sources.
+    for _asset in sources.stats.rank(files, _source):
+        try:
+            with sources.stats.timed(_source(_asset)):
+                if _asset.type == asset:
+                    response = _serve_file(request, _asset, asset, filename)
+                else:
+                    response = _serve_vsix_member(_asset, asset, filename)
+            if response:
                 return response
+        except Exception as _e:
+            print(
+                f"Was not able to serve {asset}: {_asset.file} from storage:{_asset.storage}"
+            )
+    return None
+
+
+def source_stats(request: HttpRequest):
+    return JsonResponse(sources.stats.as_dict())
+
+
+def _read_asset(_asset: models.GalleryExtensionFile, asset: str) -> bytes:
+    if _asset.type == asset:
+        with _asset.file.storage.open(_asset.file.name, "rb") as fh:
+            return fh.read()
+    opened = open_asset(_local_path(_asset.file), asset)
+    if not opened:
+        raise FileNotFoundError(f"No {asset} in {_asset.file}")
+    with opened[2] as fh:
+        return fh.read()
+
+
+def _icon_derivative(
+    request, publisher: str, extension: str, version: semver, size: int
+) -> "HttpResponse | None":
+    format = icons.pick_format(request.headers.get("Accept"))
+    files = _asset_files(publisher, extension, version, AssetType.Icon.value)
+    if not files:
+        raise FileNotFoundError(f"No icon for {publisher}.{extension} v{version}")
+    # Derivatives are keyed by the content they were made from, a re-mirrored
+    # icon gets new ones.
+    key = "|".join(
+        sorted(f"{file.type}:{file.digest or file.file.name}" for file in files)
+    )
+
+    def load() -> bytes:
+        # The original is read whole from the storage, a response to the
+        # request could be partial or a redirect.
+        for file in sources.stats.rank(files, _source):
+            try:
+                with sources.stats.timed(_source(file)):
+                    return _read_asset(file, AssetType.Icon.value)
             except Exception as _e:
                 print(
-                    f"Was not able to serve file: {_asset.file} from storage:{_asset.storage}"
+                    f"Was not able to read icon: {file.file} from storage:{file.storage}"
                 )
+        raise FileNotFoundError(f"No icon for {publisher}.{extension} v{version}")
+
+    path = icons.derivative(key, icons.pick_size(size), format, load)
+    response = FileResponse(open(path, "rb"), content_type=icons.mimetype(format))
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def assets_extensions(
+    request, publisher: str, extension: str, version: semver, asset: str
+):
+    size = request.GET.get("size")
+    if size and size.isdigit() and asset == AssetType.Icon and icons.available():
+        try:
+            return _icon_derivative(request, publisher, extension, version, int(size))
+        except FileNotFoundError:
+            raise Http404(f"{asset} not found for {publisher}.{extension} v{version}")
+        except Exception as _e:
+            print(f"Was not able to resize icon for {publisher}.{extension} v{version}")
 
+    response = _find_asset(request, publisher, extension, version, asset)
+    if response is None:
+        raise Http404(f"{asset} not found for {publisher}.{extension} v{version}")
+    return response
@@ -0,0 +1,259 @@
+import io
+import json
+import mmap
+import os
+import posixpath
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import IO
+from xml.etree import ElementTree
+
+from .typing.gallery import AssetType
+
+# https://learn.microsoft.com/en-us/visualstudio/extensibility/vsix-extension-schema-2-0-reference?view=vs-2022
+_VSIX_MANIFEST = "extension.vsixmanifest"
+_PACKAGE_JSON = "extension/package.json"
+
+_FALLBACK_MEMBERS = {
+    AssetType.Details: ("readme.md", "readme.txt", "readme"),
+    AssetType.Changelog: ("changelog.md", "changelog.txt", "changelog"),
+    AssetType.License: ("license.md", "license.txt", "license"),
+}
+
+SERVED_ASSETS = (
+    AssetType.Manifest,
+    AssetType.Icon,
+    AssetType.Details,
+    AssetType.Changelog,
+    AssetType.License,
+)
+
+
+class _MappedFile(io.RawIOBase):
+    # mmap only gained seekable() in 3.13, zipfile needs the io interface.
+    def __init__(self, buffer: mmap.mmap) -> None:
+        self._buffer = buffer
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._buffer[self._pos : self._pos + len(b)]
+        b[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class _MemberFile(io.BufferedIOBase):
+    # Keeps the archive open until the member is closed.
+    def __init__(self, file: IO[bytes], archive: "VsixArchive") -> None:
+        self._file = file
+        self._archive = archive
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: "int | None" = -1) -> bytes:
+        return self._file.read(size)
+
+    def read1(self, size: int = -1) -> bytes:
+        return self._file.read1(size)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+            self._archive._release()
+        super().close()
+
+
+class VsixArchive:
+    """
+    Read-only view over a locally stored VSIX.
+
+    The file is memory mapped and the zip central directory is parsed once,
+    members are decompressed on demand when they are opened. An archive
+    retired from the cache is closed once its last open member is.
+    """
+
+    path: str
+    assets: "dict[str, str]"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._zip = zipfile.ZipFile(_MappedFile(self._mmap))
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._retired = False
+        self.closed = False
+        self._members = {info.filename: info for info in self._zip.infolist()}
+        self._lower = {name.lower(): name for name in self._members}
+        self.assets = self._read_assets()
+
+    def _read_assets(self) -> "dict[str, str]":
+        assets: "dict[str, str]" = {}
+        if _VSIX_MANIFEST in self._members:
+            root = ElementTree.fromstring(self.read(_VSIX_MANIFEST))
+            for node in root.iter():
+                if node.tag.rsplit("}", 1)[-1] != "Asset":
+                    continue
+                type, path = node.get("Type"), node.get("Path")
+                if type and path and path in self._members:
+                    assets.setdefault(type, path)
+
+        if _PACKAGE_JSON in self._members:
+            assets.setdefault(AssetType.Manifest.value, _PACKAGE_JSON)
+            if AssetType.Icon.value not in assets:
+                try:
+                    icon = json.loads(self.read(_PACKAGE_JSON)).get("icon")
+                except ValueError:
+                    icon = None
+                if icon:
+                    icon = posixpath.normpath(posixpath.join("extension", icon))
+                    if icon in self._members:
+                        assets[AssetType.Icon.value] = icon
+
+        for type, names in _FALLBACK_MEMBERS.items():
+            if type.value in assets:
+                continue
+            for name in names:
+                member = self._lower.get(f"extension/{name}")
+                if member:
+                    assets[type.value] = member
+                    break
+        return assets
+
+    def member(self, asset_type: str) -> "str | None":
+        if isinstance(asset_type, AssetType):
+            asset_type = asset_type.value
+        return self.assets.get(asset_type)
+
+    def read(self, member: str) -> bytes:
+        with self.open_member(member) as fh:
+            return fh.read()
+
+    def open_member(self, member: str) -> IO[bytes]:
+        with self._lock:
+            if self.closed:
+                raise ValueError(f"{self.path} is closed")
+            file = self._zip.open(self._members[member])
+            self._readers += 1
+        return _MemberFile(file, self)
+
+    def size(self, member: str) -> int:
+        return self._members[member].file_size
+
+    def open(self, asset_type: str) -> "IO[bytes] | None":
+        member = self.member(asset_type)
+        return self.open_member(member) if member else None
+
+    def _release(self) -> None:
+        with self._lock:
+            self._readers -= 1
+            if self._retired and not self._readers:
+                self._close()
+
+    def retire(self) -> None:
+        """
+        Close the archive now, or once the members still open are closed.
+        """
+        with self._lock:
+            self._retired = True
+            if not self._readers:
+                self._close()
+
+    def _close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self._zip.close()
+            self._mmap.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+
+class ArchiveCache:
+    """
+    The last `maxsize` archives opened, by path. Archives evicted or
+    replaced because their file changed are retired.
+    """
+
+    def __init__(self, maxsize: int = 64) -> None:
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._archives: "OrderedDict[str, tuple[tuple[int, int], VsixArchive]]" = (
+            OrderedDict()
+        )
+
+    def get(self, path: str) -> VsixArchive:
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._archives.get(path)
+            if cached and cached[0] == key:
+                self._archives.move_to_end(path)
+                return cached[1]
+        archive = VsixArchive(path)
+        retired = []
+        with self._lock:
+            previous = self._archives.pop(path, None)
+            if previous:
+                retired.append(previous[1])
+            self._archives[path] = (key, archive)
+            while len(self._archives) > self.maxsize:
+                retired.append(self._archives.popitem(last=False)[1][1])
+        for old in retired:
+            old.retire()
+        return archive
+
+    def clear(self) -> None:
+        with self._lock:
+            archives, self._archives = self._archives, OrderedDict()
+        for _, archive in archives.values():
+            archive.retire()
+
+
+_cache = ArchiveCache()
+
+
+def open_vsix(path: str) -> VsixArchive:
+    """
+    Return the cached archive for a path, reopened when the file changed.
+    """
+    return _cache.get(path)
+
+
+def open_asset(path: str, asset_type: str) -> "tuple[str, int, IO[bytes]] | None":
+    """
+    Open an asset of the cached archive for a path, returns its member name,
+    size and file or None when the archive does not have it.
+    """
+    while True:
+        archive = open_vsix(path)
+        member = archive.member(asset_type)
+        if not member:
+            return None
+        try:
+            return member, archive.size(member), archive.open_member(member)
+        except ValueError:
+            # Retired and closed by another thread in the meantime.
+            if not archive.closed:
+                raise
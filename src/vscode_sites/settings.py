@@ -53,6 +53,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "vscode_marketplace.db.ReplicaMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -85,9 +86,18 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+    },
+    # Read-only connections to the same file for the gallery views, they keep
+    # answering from the last committed state while a sync is writing.
+    "readonly": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        "TEST": {"MIRROR": "default"},
+    },
 }
 
+DATABASE_ROUTERS = ["vscode_marketplace.db.ReplicaRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -163,6 +173,12 @@ STORAGES = {
     "vscode_marketplace": {
         "BACKEND": "vscode_marketplace.storage.WebProxyStorage",
     },
+    "blobs": {
+        "BACKEND": "generic_storage.storage.ContentAddressedStorage",
+        "OPTIONS": {
+            "location": BASE_DIR.parent / "dev/blobs",
+        },
+    },
     "staticfiles": {
         "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
     },
@@ -189,4 +205,61 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ]
-}
\ No newline at end of file
+}
+
+#
+# VSCODE MARKETPLACE SETTINGS
+#
+
+VSCODE_MARKETPLACE_ICON_CACHE = {
+    "location": BASE_DIR.parent / "dev/icons",
+    "max_size": 256 * 2**20,
+    "sizes": (64, 128),
+}
+
+# Versions kept per extension and target platform: the newest `stable` and
+# `prerelease` ones plus anything updated in the last `days`. None keeps all.
+VSCODE_MARKETPLACE_RETENTION = {
+    "stable": None,
+    "prerelease": None,
+    "days": None,
+}
+
+# Scope of `clone_vscode_marketplace --mode spec` when no --spec is given, e.g.
+# {"allow": {"publishers": ["ms-python"], "categories": ["Themes"]},
+#  "deny": {"extensions": ["ms-python.pylint"]}, "top": 100}
+VSCODE_MARKETPLACE_MIRROR_SPEC = {}
+
+# Database aliases the gallery requests read from. A replica more than
+# `max_lag` seconds behind the primary, checked every `check_interval`
+# seconds, is skipped. Clients that wrote read from the primary for the next
+# `pin_seconds`, staff sessions always do.
+VSCODE_MARKETPLACE_REPLICAS = {
+    "aliases": ["readonly"],
+    "max_lag": 30.0,
+    "check_interval": 5.0,
+    "pin_seconds": 30,
+}
+
+# Asset sources are ranked on the last `window` reads from each storage: one
+# failing more than `max_error_rate` of them, once measured `min_samples`
+# times, is tried after the healthy ones. Reads older than `max_age` seconds
+# are forgotten. Served at /_stats/sources.
+VSCODE_MARKETPLACE_SOURCES = {
+    "window": 50,
+    "min_samples": 5,
+    "max_error_rate": 0.5,
+    "max_age": 300.0,
+}
+
+# Pragmas set on every SQLite connection: write-ahead logging lets readers
+# proceed during long sync transactions, waiting writers retry for up to
+# busy_timeout milliseconds instead of failing with "database is locked".
+VSCODE_MARKETPLACE_SQLITE = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": 1 * 2**30,
+    "cache_size": -64 * 2**10,
+    "busy_timeout": 5000,
+    "temp_store": "memory",
+}